@@ -1,4 +1,7 @@
+import asyncio
 from datetime import date
+import json
+import logging
 import os
 from google.adk.agents import LlmAgent,  SequentialAgent, LoopAgent, BaseAgent
 from google.adk.tools import ToolContext
@@ -7,10 +10,14 @@ from google.genai import types
 
 
 from billing_agent.nl2sql.agent import generate_raw_sql_agent
-from billing_agent.nl2sql.nl2sql_tools import load_business_context
+from billing_agent.nl2sql.nl2sql_tools import (expand_generated_sql, generation_context_version, get_sql_template_cache,
+                                               load_business_context)
+from billing_agent.nl2sql.sql_expander import ExpansionError, extract_sql
 from billing_agent.prompts import return_instructions_root
 from billing_agent.pricing_tool import pricing_tool, sku_pricing_tool
 from billing_agent.validation_execution.agent import refine_agent
+from billing_agent.validation_execution.result_pages import handle_expired, read_page
+from billing_agent.validation_execution.tools import estimate_query, json_serial
 
 # root_agent = generate_raw_sql_agent
 
@@ -24,6 +31,14 @@ sql_generation_agent = SequentialAgent(
 )
 
 
+def expansion_error(tool_context: ToolContext, e: ExpansionError) -> dict:
+    """Clears the generated SQL, a query on the prototype table alone would miss the target billing tables."""
+    logging.warning(f"Failed to expand the generated SQL: {e}")
+    tool_context.state.update({'FINAL_RAW_SQL': None})
+    tool_context.state.update({'GENERATED_SQL': None})
+    return {"error": f"The generated SQL could not be expanded to the billing tables, generate it again: {e}"}
+
+
 async def generate_sql_tool(
     question: str,
     tool_context: ToolContext,
@@ -31,13 +46,57 @@ async def generate_sql_tool(
     
     tool_context.state.update({'MODIFIED_SQL':None})
 
+    # The same question, or the same question about another day or month, reuses the SQL generated before,
+    # as long as the schema and the target tables did not change.
+    context_version = await asyncio.to_thread(generation_context_version)
+    cached_sql = get_sql_template_cache().get(question, context_version)
+    tool_context.state.update({'SQL_CACHE_HIT': cached_sql is not None})
+    if cached_sql is not None:
+        try:
+            expanded_sql = await asyncio.to_thread(expand_generated_sql, cached_sql)
+        except ExpansionError as e:
+            return expansion_error(tool_context, e)
+        tool_context.state.update({'FINAL_RAW_SQL': expanded_sql})
+        tool_context.state.update({'GENERATED_SQL': expanded_sql})
+        return expanded_sql
+
     agent_tool = AgentTool(agent=sql_generation_agent)
 
     db_agent_output = await agent_tool.run_async(
         args={"request": question}, tool_context=tool_context
     )
-    tool_context.state.update({'GENERATED_SQL': db_agent_output})
-    return db_agent_output
+    if not (isinstance(db_agent_output, str) and db_agent_output.strip()):
+        tool_context.state.update({'GENERATED_SQL': db_agent_output})
+        return db_agent_output
+
+    # The model writes the SQL on the prototype table, it is expanded to the target billing tables
+    # by rewriting it, and cached as written once it expands.
+    prototype_sql = extract_sql(db_agent_output)
+    try:
+        expanded_sql = await asyncio.to_thread(expand_generated_sql, prototype_sql)
+    except ExpansionError as e:
+        return expansion_error(tool_context, e)
+    get_sql_template_cache().put(question, context_version, prototype_sql)
+    tool_context.state.update({'FINAL_RAW_SQL': expanded_sql})
+    tool_context.state.update({'GENERATED_SQL': expanded_sql})
+    return expanded_sql
+
+
+async def estimate_sql_tool(
+    sql: str,
+    tool_context: ToolContext,
+):
+    """Estimates the bytes a SQL query would process, with a BigQuery dry run, before it is executed.
+
+    Args:
+        sql: The SQL query.
+
+    Returns:
+        A dictionary with the estimated bytes, the bytes budget, whether the query is over it, and an error if any.
+    """
+    estimate = await asyncio.to_thread(estimate_query, sql)
+    tool_context.state.update({'ESTIMATED_BYTES_PROCESSED': estimate["ESTIMATED_BYTES_PROCESSED"]})
+    return estimate
 
 
 async def execute_sql_tool(
@@ -58,16 +117,52 @@ async def execute_sql_tool(
     validation_error = tool_context.state.get("VALIDATION_ERROR")
     query_results = tool_context.state.get("QUERY_RESULTS")
     modified_sql = tool_context.state.get("MODIFIED_SQL")
+    estimated_bytes_processed = tool_context.state.get("ESTIMATED_BYTES_PROCESSED")
+    query_cache_hit = tool_context.state.get("QUERY_CACHE_HIT")
+    query_total_rows = tool_context.state.get("QUERY_TOTAL_ROWS")
 
     result = {
         "VALIDATION_ERROR": validation_error,
         "QUERY_RESULTS": query_results,
         "MODIFIED_SQL": modified_sql,
+        "ESTIMATED_BYTES_PROCESSED": estimated_bytes_processed,
+        "QUERY_CACHE_HIT": query_cache_hit,
+        "QUERY_TOTAL_ROWS": query_total_rows,
     }
     
     return result
 
 
+async def fetch_result_page_tool(
+    page: int,
+    tool_context: ToolContext,
+):
+    """Fetches a page of the result of the last executed query, QUERY_RESULTS is page 0.
+
+    Args:
+        page: The page number, from 0.
+
+    Returns:
+        A dictionary with the rows of the page, the page size and the total number of rows, or an error.
+    """
+    handle = tool_context.state.get("QUERY_RESULT_HANDLE")
+    if not handle:
+        return {"error": "There is no query result to page through, execute a query first."}
+    if handle_expired(handle):
+        return {"error": "The result of the query has expired, execute the query again."}
+    try:
+        rows = await asyncio.to_thread(read_page, handle, page)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return {"error": f"Failed to read page {page} of the result, execute the query again: {e}"}
+
+    return {
+        "PAGE": page,
+        "PAGE_SIZE": handle["page_size"],
+        "QUERY_TOTAL_ROWS": handle["total_rows"],
+        "QUERY_RESULTS": json.dumps(rows, default=json_serial),
+    }
+
+
 root_agent = LlmAgent(
     name='intend_agent',
     description='Precisely and fully understand user input intension',
@@ -97,17 +192,20 @@ You are an expert of billing, your job is to coordinate the process of generatin
 
 4.  **Present for Confirmation:**
     - After the SQL is generated, you MUST present it to the user. `GENERATED_SQL` in the context is the SQL query itself.
+    - Before presenting it, call the tool `estimate_sql_tool(sql: str)` with the `GENERATED_SQL`, it returns the bytes the query would scan, "ESTIMATED_SIZE". Tell the user this estimate. If "OVER_BUDGET" is true, also tell the user that the query scans more than the budget and will be rewritten with a partition filter on execution.
     - Use the following format to present the SQL query for confirmation:
       "Here is the generated SQL query:
       ```sql
       <THE_GENERATED_SQL_QUERY>
       ```
+      Estimated data scanned: <ESTIMATED_SIZE>.
       Would you like to proceed with the execution?"
     - After presenting the SQL, STOP and wait for the user's confirmation.
 
 5.  **Final Response Formatting:**
     - After the `execute_sql_tool` is called, it returns a JSON object with the results. Your final job is to present this result to the user in a clear and professional markdown format.
-    - The JSON object from the tool has the following keys: "MODIFIED_SQL", "VALIDATION_ERROR", "QUERY_RESULTS".
+    - The JSON object from the tool has the following keys: "MODIFIED_SQL", "VALIDATION_ERROR", "QUERY_RESULTS", "QUERY_TOTAL_ROWS".
+    - `QUERY_RESULTS` only holds the first page of the result, `QUERY_TOTAL_ROWS` is the number of rows of the whole result. If the result has more rows, say so, and when the user asks for more rows call the tool `fetch_result_page_tool(page: int)`, page 1 being the second page.
     - Use the following MARKDOWN format for your response:
         - **Question:** The value of {QUESTION}.
         - **Query Result:** Display the value of `QUERY_RESULTS`. If it's empty or null, state "No results found". If there is a `VALIDATION_ERROR`, display the error. Otherwise, display the result in a Markdown table, showing only the first 50 rows.
@@ -145,7 +243,7 @@ output the refined quesiton only.
 
 QUESTION:
 """,
-    tools=[generate_sql_tool, execute_sql_tool, pricing_tool, sku_pricing_tool],
+    tools=[generate_sql_tool, estimate_sql_tool, execute_sql_tool, fetch_result_page_tool, pricing_tool, sku_pricing_tool],
 
     before_agent_callback=load_business_context
 )
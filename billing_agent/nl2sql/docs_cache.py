@@ -0,0 +1,251 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+
+import requests
+
+# Directory of the persisted docs, so that the service can boot without reaching the docs site,
+# unset to keep them in memory only. The pages go into the prompt, the directory must not be writable by others.
+DOCS_CACHE_DIR = os.getenv('DOCS_CACHE_DIR') or None
+# Age after which a cached page is revalidated with the docs site.
+DOCS_CACHE_TTL_SECONDS = int(os.getenv('DOCS_CACHE_TTL_SECONDS', 86400))
+DOCS_FETCH_TIMEOUT_SECONDS = float(os.getenv('DOCS_FETCH_TIMEOUT_SECONDS', 10))
+
+# Elements whose content is never part of the documentation text.
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'svg', 'template', 'iframe', 'form', 'button',
+                'nav', 'header', 'footer', 'aside'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'ul', 'ol', 'dl', 'dt', 'dd', 'table', 'blockquote',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+class _DocsTextExtractor(HTMLParser):
+    """
+    Reduce a documentation page to its text: headings, paragraphs, lists, code and tables (as pipe rows).
+
+    Only the article body is kept when the page has one (`devsite-article-body` or `<article>`),
+    navigation, scripts and styles are dropped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.skip_depth = None
+        self.article_depth = None
+        self.has_article = False
+        self.page_parts = []
+        self.article_parts = []
+        self.pre_depth = 0
+        self.row = None
+        self.cell = None
+
+    def _emit(self, text: str) -> None:
+        if self.cell is not None:
+            self.cell.append(text)
+            return
+        self.page_parts.append(text)
+        if self.article_depth is not None:
+            self.article_parts.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+        if self.skip_depth is not None:
+            return
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = len(self.stack)
+            return
+
+        classes = dict(attrs).get('class') or ''
+        if not self.has_article and tag not in VOID_TAGS and (
+                tag == 'article' or 'devsite-article-body' in classes.split()):
+            self.article_depth = len(self.stack)
+            self.has_article = True
+
+        if tag in BLOCK_TAGS:
+            self._emit('\n\n')
+        if re.fullmatch(r'h[1-6]', tag):
+            self._emit('#' * int(tag[1]) + ' ')
+        elif tag == 'li':
+            self._emit('\n- ')
+        elif tag == 'br':
+            self._emit('\n')
+        elif tag == 'pre':
+            self.pre_depth += 1
+            self._emit('\n```\n')
+        elif tag == 'tr':
+            self.row = []
+        elif tag in ('td', 'th') and self.row is not None:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack:
+            depth = len(self.stack)
+            open_tag = self.stack.pop()
+            if self.skip_depth is not None:
+                if depth == self.skip_depth:
+                    self.skip_depth = None
+            else:
+                self._close(open_tag)
+            if depth == self.article_depth:
+                self.article_depth = None
+            if open_tag == tag:
+                return
+
+    def _close(self, tag: str) -> None:
+        if tag in ('td', 'th') and self.cell is not None:
+            self.row.append(' '.join(''.join(self.cell).split()))
+            self.cell = None
+        elif tag == 'tr' and self.row is not None:
+            self._emit('\n| ' + ' | '.join(self.row) + ' |')
+            self.row = None
+        elif tag == 'pre':
+            self.pre_depth -= 1
+            self._emit('\n```\n')
+        elif tag in BLOCK_TAGS:
+            self._emit('\n\n')
+
+    def handle_data(self, data):
+        if self.skip_depth is not None:
+            return
+        if self.pre_depth:
+            self._emit(data)
+            return
+        # collapse whitespace like a browser does, without doubling the space between two text nodes
+        text = ' '.join(data.split())
+        if data[:1].isspace() and not self._ends_with_space():
+            text = ' ' + text
+        if text and data[-1:].isspace() and text != ' ':
+            text += ' '
+        if text:
+            self._emit(text)
+
+    def _ends_with_space(self) -> bool:
+        parts = self.cell if self.cell is not None else self.page_parts
+        return not parts or parts[-1][-1:].isspace()
+
+    def text(self) -> str:
+        parts = self.article_parts if self.has_article else self.page_parts
+        lines = [line.rstrip() for line in ''.join(parts).split('\n')]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def html_to_text(html: str) -> str:
+    """
+    Strip a documentation page down to the text and tables of its article.
+
+    Args:
+        html: The HTML of the page.
+
+    Returns:
+        str: The text of the page.
+    """
+    extractor = _DocsTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+class DocsCache:
+    """
+    Documentation pages reduced to text, fetched at most once per ttl_seconds and persisted on disk.
+
+    Expired pages are revalidated with ETag / If-Modified-Since, if the docs site cannot be reached
+    the last known text is served.
+    """
+
+    def __init__(self, cache_dir: str = DOCS_CACHE_DIR, ttl_seconds: int = DOCS_CACHE_TTL_SECONDS,
+                 timeout: float = DOCS_FETCH_TIMEOUT_SECONDS, session: requests.Session = None):
+        """
+        Args:
+            cache_dir: Directory of the persisted pages, None to keep them in memory only.
+            ttl_seconds: Age after which a page is revalidated.
+            timeout: Timeout of a request to the docs site, in seconds.
+            session: The requests session to fetch the pages with.
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        # url --> {'text': str, 'etag': str, 'last_modified': str, 'fetched_at': epoch seconds}
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str):
+        """
+        Get the text of a documentation page.
+
+        Args:
+            url: The URL of the page.
+
+        Returns:
+            str: The text of the page, or None if it was never fetched and cannot be fetched now.
+        """
+        with self._lock:
+            entry = self.entries.get(url) or self._read_disk(url)
+            if entry is not None and time.time() - entry['fetched_at'] < self.ttl_seconds:
+                self.entries[url] = entry
+                return entry['text']
+
+            headers = {}
+            if entry is not None and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code == 304 and entry is not None:
+                    entry = dict(entry, fetched_at=time.time())
+                else:
+                    response.raise_for_status()  # Raise an exception for HTTP errors
+                    entry = {
+                        'text': html_to_text(response.text),
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'fetched_at': time.time(),
+                    }
+            except Exception as e:
+                logging.warning(f"Error fetching content from {url}: {e}")
+                if entry is None:
+                    return None
+                # Serve the stale page, and retry after ttl_seconds rather than on every call.
+                entry = dict(entry, fetched_at=time.time())
+                self.entries[url] = entry
+                return entry['text']
+
+            self.entries[url] = entry
+            self._write_disk(url, entry)
+            return entry['text']
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, f"docs_{hashlib.sha1(url.encode('utf8')).hexdigest()}.json")
+
+    def _read_disk(self, url: str):
+        if not self.cache_dir or not os.path.exists(self._path(url)):
+            return None
+        try:
+            with open(self._path(url), 'r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to read cached docs of {url}: {e}")
+            return None
+
+    def _write_disk(self, url: str, entry: dict) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(dict(entry, url=url), cache_file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to write cached docs of {url}: {e}")
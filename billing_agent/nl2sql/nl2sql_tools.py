@@ -1,21 +1,41 @@
+import hashlib
+import json
 import logging
 import os
 from google.adk.agents.callback_context import CallbackContext
-import requests
 from google.cloud import bigquery
 
+from billing_agent.nl2sql.docs_cache import DocsCache
+from billing_agent.nl2sql.partition_filter import add_partition_filters
+from billing_agent.nl2sql.rollup_router import RollupRouter
+from billing_agent.nl2sql.schema_cache import SchemaContextCache
+from billing_agent.nl2sql.sql_expander import expand_billing_tables, extract_sql
+from billing_agent.nl2sql.sql_template_cache import SqlTemplateCache
+from billing_agent.prompts import NL2SQL_EXPAND_PROMPT
+
 # Initialize global variables
 bq_client = None
+schema_context_cache = None
+docs_cache = None
+sql_template_cache = None
+rollup_router = None
 
 
 def fetch_web_content(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.text
-    except Exception as e:
-        print(f"Error fetching content from {url}: {e}")
-        return None
+    """
+    Fetch a documentation page, reduced to its text and tables, see DocsCache.
+
+    Args:
+        url: The URL of the page.
+
+    Returns:
+        str: The text of the page, or None if it cannot be fetched.
+    """
+    global docs_cache
+
+    if docs_cache is None:
+        docs_cache = DocsCache()
+    return docs_cache.get(url)
 
 
 def get_bq_client():
@@ -44,6 +64,117 @@ def get_bq_client():
     return bq_client
 
 
+def get_schema_context_cache() -> SchemaContextCache:
+    """
+    Get or create the schema context cache shared by all sessions.
+
+    Returns:
+        SchemaContextCache: The process-wide schema context cache.
+    """
+    global schema_context_cache
+
+    if schema_context_cache is None:
+        schema_context_cache = SchemaContextCache(get_bq_client)
+    return schema_context_cache
+
+
+def get_sql_template_cache() -> SqlTemplateCache:
+    """
+    Get or create the cache of the SQL generated for the questions, shared by all sessions.
+
+    Returns:
+        SqlTemplateCache: The process-wide SQL template cache.
+    """
+    global sql_template_cache
+
+    if sql_template_cache is None:
+        sql_template_cache = SqlTemplateCache()
+    return sql_template_cache
+
+
+def get_rollup_router() -> RollupRouter:
+    """
+    Get or create the router of the queries to the daily billing rollup, shared by all sessions.
+
+    Returns:
+        RollupRouter: The process-wide rollup router.
+    """
+    global rollup_router
+
+    if rollup_router is None:
+        rollup_router = RollupRouter(get_bq_client)
+    return rollup_router
+
+
+def generation_context_version() -> str:
+    """
+    Fingerprint of what the SQL generation depends on besides the question: the schema fields of the
+    prototype table, the target billing tables and the generation prompt. The sample rows of the schema context
+    are left out, they change without the SQL to generate changing.
+
+    Returns:
+        str: The version, it changes whenever one of them changes.
+    """
+    table_id = os.getenv('PROTOTYPE_DETAILED_BILLING_TABLE_ID')
+    fields = get_schema_context_cache().get_fields(table_id) if table_id else None
+    payload = json.dumps([table_id, fields, os.getenv('TARGET_BILLING_TABLES'), NL2SQL_EXPAND_PROMPT],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+def billing_table_ids() -> list:
+    """The IDs of the prototype billing table and of the target billing tables."""
+    table_ids = [os.getenv('PROTOTYPE_DETAILED_BILLING_TABLE_ID')] + (os.getenv('TARGET_BILLING_TABLES') or '').split(',')
+    return [table_id.strip() for table_id in table_ids if table_id and table_id.strip()]
+
+
+def add_billing_partition_filters(sql: str) -> str:
+    """
+    Restrict the partitions the billing tables of a SQL read to its time range, see add_partition_filters.
+
+    Args:
+        sql: The SQL.
+
+    Returns:
+        str: The SQL with the partition filters.
+    """
+    return add_partition_filters(sql, billing_table_ids())
+
+
+def expand_generated_sql(sql: str) -> str:
+    """
+    Route the SQL generated on the prototype table to the daily billing rollup where it can, see route_to_rollup,
+    expand what still reads the prototype table into the UNION ALL of the target billing tables,
+    see expand_billing_tables, and add the partition filters of every billing table it reads.
+
+    Args:
+        sql: The generated SQL, possibly in a markdown code block with an explanation around it.
+
+    Returns:
+        str: The expanded SQL.
+
+    Raises:
+        ExpansionError: If the SQL cannot be expanded, running it would only read the prototype table.
+    """
+    sql = extract_sql(sql)
+    table_id = os.getenv('PROTOTYPE_DETAILED_BILLING_TABLE_ID')
+    target_billing_tables = os.getenv('TARGET_BILLING_TABLES')
+    if table_id:
+        # Only when the rollup is computed from the very tables the query is expanded to,
+        # the SELECTs reading it then need no expansion.
+        billing_tables = target_billing_tables.split(',') if target_billing_tables else [table_id]
+        sql = get_rollup_router().route(sql, table_id, billing_tables)
+    if table_id and target_billing_tables:
+        try:
+            columns = [field['name'] for field in get_schema_context_cache().get_fields(table_id)]
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The target tables share the schema of the prototype table, * reads the same columns.
+            logging.warning(f"Expanding with SELECT *, failed to get the columns of {table_id}: {e}")
+            columns = None
+        sql = expand_billing_tables(sql, table_id, target_billing_tables.split(','), columns)
+    return add_billing_partition_filters(sql)
+
+
 def load_table_schema(callback_context: CallbackContext) -> None:
 
     table_id = os.getenv('PROTOTYPE_DETAILED_BILLING_TABLE_ID')
@@ -55,59 +186,26 @@ def load_table_schema(callback_context: CallbackContext) -> None:
     callback_context.state.update(
         {'PROTOTYPE_DETAILED_BILLING_TABLE_ID': table_id})
 
-    if callback_context.state.get('SCHEMA') is None:
-
-        bigquery_client = get_bq_client()
-        table_obj = bigquery_client.get_table(table_id)
-
-        ddl_statement = f"CREATE OR REPLACE TABLE `{table_id}` (\n"
-
-        for field in table_obj.schema:
-            ddl_statement += f"  `{field.name}` {field.field_type}"
-            if field.mode == "REPEATED":
-                ddl_statement += " ARRAY"
-            if field.description:
-                ddl_statement += f" COMMENT '{field.description}'"
-            ddl_statement += ",\n"
-
-        ddl_statement = ddl_statement[:-2] + "\n);\n\n"
-
-        # Add example values if available (limited to first row)
-        rows = bigquery_client.list_rows(
-            table_id, max_results=5).to_dataframe()
-        if not rows.empty:
-            ddl_statement += f"-- Example values for table `{table_id}`:\n"
-            for _, row in rows.iterrows():  # Iterate over DataFrame rows
-                ddl_statement += f"INSERT INTO `{table_id}` VALUES\n"
-                example_row_str = "("
-                for value in row.values:  # Now row is a pandas Series and has values
-                    if isinstance(value, str):
-                        example_row_str += f"'{value}',"
-                    elif value is None:
-                        example_row_str += "NULL,"
-                    else:
-                        example_row_str += f"{value},"
-                example_row_str = (
-                    example_row_str[:-1] + ");\n\n"
-                )  # remove trailing comma
-                ddl_statement += example_row_str
-
-        callback_context.state.update({'SCHEMA': ddl_statement})
+    # The schema context is app-scoped state: it is stored once for all sessions
+    # and only rewritten when the table was modified.
+    schema = get_schema_context_cache().get(table_id)
+    if callback_context.state.get('app:SCHEMA') != schema:
+        callback_context.state.update({'app:SCHEMA': schema})
 
 
 def load_business_context(callback_context: CallbackContext) -> None:
 
     load_table_schema(callback_context)
 
-    if not callback_context.state.get('PUBLIC_DOCS'):
-
-        table_explanation = fetch_web_content(
-            "https://cloud.google.com/billing/docs/how-to/export-data-bigquery-tables/detailed-usage")
+    # Shared by all sessions like app:SCHEMA, the docs are cached in process and on disk.
+    table_explanation = fetch_web_content(
+        "https://cloud.google.com/billing/docs/how-to/export-data-bigquery-tables/detailed-usage")
 
-        bq_examples = fetch_web_content(
-            "https://cloud.google.com/billing/docs/how-to/bq-examples")
-        callback_context.state.update(
-            {'PUBLIC_DOCS': f"{table_explanation}\n\n{bq_examples}"})
+    bq_examples = fetch_web_content(
+        "https://cloud.google.com/billing/docs/how-to/bq-examples")
+    public_docs = f"{table_explanation}\n\n{bq_examples}"
+    if callback_context.state.get('app:PUBLIC_DOCS') != public_docs:
+        callback_context.state.update({'app:PUBLIC_DOCS': public_docs})
 
     # # TODO: treat raw client input as the question. text only.
     callback_context.state.update(
@@ -0,0 +1,343 @@
+import calendar
+import datetime
+import logging
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from billing_agent.nl2sql.sql_expander import PARTITION_COLUMNS, table_id
+
+# Slack between the usage or invoice month of a row and the partition it is exported to, in months.
+PARTITION_SLACK_MONTHS = 1
+# Columns of a partition window, the pseudo-columns and the columns exposing them, see sql_expander.
+PARTITION_NAMES = set(PARTITION_COLUMNS) | set(PARTITION_COLUMNS.values())
+# Functions a compared column may be wrapped in, the truncating ones are handled by their unit.
+WRAPPERS = (exp.Paren, exp.Cast, exp.Date, exp.Datetime, exp.Timestamp, exp.TsOrDsToDate)
+TRUNCS = (exp.DateTrunc, exp.DatetimeTrunc, exp.TimestampTrunc)
+# Unit of a truncation --> (months, days) from the start of a unit to the start of the next one.
+TRUNC_UNITS = {'DAY': (0, 1), 'WEEK': (0, 7), 'MONTH': (1, 0), 'QUARTER': (3, 0), 'YEAR': (12, 0)}
+DATE_LITERAL = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+MONTH_LITERAL = re.compile(r'^(\d{4})(\d{2})$')
+MIDNIGHT = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]00:00(:00(\.0*)?)?)?$')
+COMPARISONS = {exp.EQ: 'eq', exp.GT: 'gt', exp.GTE: 'gt', exp.LT: 'lt', exp.LTE: 'lt'}
+REVERSED = {'eq': 'eq', 'gt': 'lt', 'lt': 'gt'}
+# An unconstrained partition window, (first day, last day) of the partitions a query may read, None when open.
+UNBOUNDED = (None, None)
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def intersect(window: tuple, other: tuple) -> tuple:
+    """Window of the rows in both windows."""
+    lows = [day for day in (window[0], other[0]) if day is not None]
+    highs = [day for day in (window[1], other[1]) if day is not None]
+    return max(lows) if lows else None, min(highs) if highs else None
+
+
+def hull(window: tuple, other: tuple) -> tuple:
+    """Window of the rows in either window."""
+    low = None if window[0] is None or other[0] is None else min(window[0], other[0])
+    high = None if window[1] is None or other[1] is None else max(window[1], other[1])
+    return low, high
+
+
+def constant_string(node: exp.Expression):
+    """The string of a constant like '2025-06-01', DATE '2025-06-01' or TIMESTAMP('2025-06-01', tz), or None."""
+    while isinstance(node, WRAPPERS):
+        node = node.this
+    if isinstance(node, exp.Literal) and node.is_string:
+        return node.name
+    return None
+
+
+def _time_column(node: exp.Expression):
+    """
+    Find the time column compared by an expression, through the wrappers mandated for usage_start_time,
+    e.g. DATETIME(usage_start_time, 'America/Los_Angeles').
+
+    Returns:
+        tuple: (kind: 'usage', 'invoice' or 'partition', qualifier of the column, the truncation units as
+            (months, days), whether a time zone is applied), or None.
+    """
+    truncation, zoned = (0, 0), False
+    while True:
+        if isinstance(node, TRUNCS):
+            unit = node.args.get('unit')
+            unit = unit.name.upper() if unit is not None else ''
+            if unit not in TRUNC_UNITS:
+                return None
+            truncation = (truncation[0] + TRUNC_UNITS[unit][0], truncation[1] + TRUNC_UNITS[unit][1])
+        elif isinstance(node, WRAPPERS):
+            zoned = zoned or bool(node.args.get('zone')) or (
+                isinstance(node, exp.Datetime) and node.args.get('expression') is not None)
+        else:
+            break
+        node = node.this
+    if not isinstance(node, exp.Column):
+        return None
+    parts = [part.name for part in node.parts]
+    if parts[-1].lower() == 'usage_start_time':
+        return 'usage', '.'.join(parts[:-1]), truncation, zoned
+    if parts[-1].lower() in PARTITION_NAMES:
+        return 'partition', '.'.join(parts[:-1]), truncation, zoned
+    if len(parts) >= 2 and parts[-1].lower() == 'month' and parts[-2].lower() == 'invoice':
+        # An invoice month is a month long.
+        return 'invoice', '.'.join(parts[:-2]), (truncation[0] + 1, truncation[1]), zoned
+    return None
+
+
+def _day(kind: str, value: str):
+    """The first day of a constant compared with a time column, e.g. 2025-06-01 for the invoice month 202506."""
+    match = (MONTH_LITERAL if kind == 'invoice' else DATE_LITERAL).match(value)
+    if not match:
+        return None
+    try:
+        return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)) if kind != 'invoice' else 1)
+    except ValueError:
+        return None
+
+
+def _predicate_window(predicate: exp.Expression, belongs, kinds: set, slack_months: int) -> tuple:
+    """The partition window of a comparison of a time column with constants, UNBOUNDED if it is not one."""
+    strict = False
+    if isinstance(predicate, exp.Between):
+        column, bounds = predicate.this, [('gt', predicate.args.get('low')), ('lt', predicate.args.get('high'))]
+    elif isinstance(predicate, exp.In) and not predicate.args.get('query'):
+        values = [constant_string(value) for value in predicate.expressions]
+        if not values or None in values:
+            return UNBOUNDED
+        column = predicate.this
+        bounds = [('gt', exp.Literal.string(min(values))), ('lt', exp.Literal.string(max(values)))]
+    elif type(predicate) in COMPARISONS:
+        column, constant, op = predicate.this, predicate.expression, COMPARISONS[type(predicate)]
+        if _time_column(column) is None:
+            column, constant, op = constant, column, REVERSED[op]
+        bounds = [('gt', constant), ('lt', constant)] if op == 'eq' else [(op, constant)]
+        strict = isinstance(predicate, (exp.LT, exp.GT))
+    else:
+        return UNBOUNDED
+
+    found = _time_column(column)
+    if found is None or found[0] not in kinds or not belongs(found[1]):
+        return UNBOUNDED
+    kind, _, (months, days), zoned = found
+    low, high = None, None
+    for op, constant in bounds:
+        value = constant_string(constant) if constant is not None else None
+        day = _day(kind, value) if value is not None else None
+        if day is None:
+            continue
+        if op == 'lt' and (months or days > 1):
+            # TRUNC(x, unit) <= day holds for x up to the last day of the unit starting at day.
+            day = add_months(day, months) + datetime.timedelta(days=days - 1 if days else -1)
+        elif op == 'lt' and strict and kind == 'usage' and MIDNIGHT.match(value):
+            # x < midnight of a day holds for x up to the day before.
+            day -= datetime.timedelta(days=1)
+        if kind != 'partition' and op == 'gt':
+            day = add_months(day, -slack_months)
+        elif kind != 'partition':
+            # From the end of the day, so that the last day of a month maps to the last day of a month.
+            day = add_months(day + datetime.timedelta(days=1), slack_months) - datetime.timedelta(days=1)
+        elif zoned:
+            # A partition time in another time zone is at most a day away from its UTC day.
+            day += datetime.timedelta(days=-1 if op == 'gt' else 1)
+        if op == 'gt':
+            low = day
+        else:
+            high = day
+    return low, high
+
+
+def condition_window(condition: exp.Expression, belongs, kinds: set = frozenset({'usage', 'invoice', 'partition'}),
+                     slack_months: int = PARTITION_SLACK_MONTHS):
+    """
+    The partition window of the rows satisfying a condition, from its predicates on the time columns.
+
+    Args:
+        condition: The condition, e.g. a WHERE.
+        belongs: Callable telling whether a column qualifier, '' when unqualified, is the table of interest.
+        kinds: The kinds of time columns looked at, see _time_column.
+        slack_months: Slack added to the usage and invoice months, 0 for the window of the usage dates themselves.
+
+    Returns:
+        tuple: The window, UNBOUNDED if the condition does not restrict it.
+    """
+    if condition is None:
+        return UNBOUNDED
+    if isinstance(condition, (exp.Where, exp.Paren)):
+        return condition_window(condition.this, belongs, kinds, slack_months)
+    if isinstance(condition, exp.And):
+        return intersect(condition_window(condition.this, belongs, kinds, slack_months),
+                         condition_window(condition.expression, belongs, kinds, slack_months))
+    if isinstance(condition, exp.Or):
+        return hull(condition_window(condition.this, belongs, kinds, slack_months),
+                    condition_window(condition.expression, belongs, kinds, slack_months))
+    return _predicate_window(condition, belongs, kinds, slack_months)
+
+
+def _passes_time_columns(select: exp.Select) -> bool:
+    """Whether the rows of a SELECT map one to one to its source rows as far as the time columns go."""
+    if select.args.get('limit') or select.args.get('qualify') or any(True for _ in select.find_all(exp.Window)):
+        return False
+    for projection in select.expressions:
+        if isinstance(projection, exp.Star) or (isinstance(projection, exp.Column) and projection.is_star):
+            star = projection if isinstance(projection, exp.Star) else projection.this
+            if star.args.get('replace') or star.args.get('rename'):
+                return False
+            continue
+        name = projection.alias_or_name.lower()
+        if name not in ('usage_start_time', 'invoice') and name not in PARTITION_NAMES:
+            continue
+        source = projection.unalias()
+        if not isinstance(source, exp.Column):
+            return False
+        source_name = source.name.lower()
+        if source_name != name and PARTITION_COLUMNS.get(source_name) != name:
+            return False
+    return True
+
+
+class _PartitionFilter:
+    """Propagates the partition windows from the predicates of a query down to the billing tables it reads."""
+
+    def __init__(self, billing_table_ids: set):
+        self.billing_table_ids = billing_table_ids
+        self.injected = 0
+
+    def visit_query(self, query: exp.Expression, inherited: tuple, ctes: dict) -> None:
+        """
+        Args:
+            query: A query, or a subquery.
+            inherited: The window the consumers of its rows restrict them to.
+            ctes: Name --> list of the windows of the consumers of the CTE, for the CTEs in scope.
+        """
+        while isinstance(query, exp.Subquery):
+            query = query.this
+        with_ = query.args.get('with_')
+        local = {}
+        if with_ is not None:
+            local = {cte.alias_or_name: [] for cte in with_.expressions}
+            ctes = {**ctes, **local}
+
+        if isinstance(query, exp.Union):
+            self.visit_query(query.this, inherited, ctes)
+            self.visit_query(query.expression, inherited, ctes)
+        elif isinstance(query, exp.SetOperation):
+            self.visit_query(query.this, UNBOUNDED, ctes)
+            self.visit_query(query.expression, UNBOUNDED, ctes)
+        elif isinstance(query, exp.Select):
+            self.visit_select(query, inherited, ctes)
+
+        if with_ is not None:
+            # A CTE only reads the CTEs before it, its consumers are all known once the ones after it are visited.
+            for index in reversed(range(len(with_.expressions))):
+                cte = with_.expressions[index]
+                windows = local[cte.alias_or_name]
+                window = UNBOUNDED
+                if windows:
+                    window = windows[0]
+                    for other in windows[1:]:
+                        window = hull(window, other)
+                scope = {**ctes, **{earlier.alias_or_name: ctes[earlier.alias_or_name]
+                                    for earlier in with_.expressions[:index]}}
+                self.visit_query(cte.this, window, scope)
+
+    def visit_select(self, select: exp.Select, inherited: tuple, ctes: dict) -> None:
+        sources = []
+        if select.args.get('from_') is not None:
+            sources.append(select.args['from_'].this)
+        sources.extend(join.this for join in select.args.get('joins') or [])
+        sources = [source for source in sources if not isinstance(source, exp.Unnest)]
+        if len(sources) != 1 or not _passes_time_columns(select):
+            inherited = UNBOUNDED
+
+        where = select.args.get('where')
+        for source in sources:
+            alias = source.alias_or_name
+            belongs = (lambda qualifier, alias=alias: qualifier == alias or
+                       (qualifier == '' and len(sources) == 1))
+            window = intersect(condition_window(where, belongs), inherited)
+            if isinstance(source, exp.Subquery):
+                self.visit_query(source.this, window, ctes)
+            elif isinstance(source, exp.Table):
+                if not source.args.get('db') and source.name in ctes:
+                    ctes[source.name].append(window)
+                elif table_id(source) in self.billing_table_ids:
+                    existing = condition_window(where, belongs, {'partition'})
+                    if window != existing and window != UNBOUNDED:
+                        self.inject(select, window, alias if len(sources) > 1 else None)
+
+        # Subqueries of the expressions, e.g. WHERE x IN (SELECT ...), are not restricted by this SELECT.
+        skipped = {id(select.args.get('from_')), id(select.args.get('with_'))}
+        skipped.update(id(join.this) for join in select.args.get('joins') or [])
+        for node in select.iter_expressions():
+            if id(node) in skipped:
+                continue
+            for query in _outer_queries(node):
+                self.visit_query(query, UNBOUNDED, ctes)
+
+    def inject(self, select: exp.Select, window: tuple, qualifier) -> None:
+        column = f"{qualifier}._PARTITIONTIME" if qualifier else "_PARTITIONTIME"
+        partition_day = f"TIMESTAMP_TRUNC({column}, DAY)"
+        low, high = (f"'{day.isoformat()}'" if day is not None else None for day in window)
+        if low and high:
+            condition = f"{partition_day} BETWEEN {low} AND {high}"
+        else:
+            condition = f"{partition_day} >= {low}" if low else f"{partition_day} <= {high}"
+        condition = sqlglot.parse_one(condition, read='bigquery')
+        where = select.args.get('where')
+        if where is not None:
+            existing = where.this if not isinstance(where.this, exp.Or) else exp.paren(where.this, copy=False)
+            condition = exp.And(this=existing, expression=condition)
+        select.set('where', exp.Where(this=condition))
+        self.injected += 1
+
+
+def _outer_queries(node: exp.Expression):
+    """The outermost queries under a node."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, exp.Query):
+            yield current
+            continue
+        stack.extend(current.iter_expressions())
+
+
+def add_partition_filters(sql: str, billing_table_ids: list) -> str:
+    """
+    Restrict the partitions every billing table of a query reads to the time range the query asks for.
+
+    The window is derived from the predicates on usage_start_time, also through DATETIME(..., 'America/Los_Angeles')
+    and the likes, on invoice.month and on the partition time itself, with PARTITION_SLACK_MONTHS of slack,
+    then carried through the CTEs and subqueries down to every SELECT reading a billing table, e.g. every branch
+    of a UNION ALL of the billing tables. A TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) filter is added to the SELECT,
+    and-ed to its existing conditions so that it never widens an existing partition window.
+
+    Args:
+        sql: The query, in the BigQuery dialect.
+        billing_table_ids: The IDs of the billing tables, as written in the query.
+
+    Returns:
+        str: The query with the partition filters, or the query as it is if no filter can be derived.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read='bigquery') if statement is not None]
+    except SqlglotError as e:
+        logging.warning(f"Cannot parse the SQL to filter its partitions, leaving it as it is: {e}")
+        return sql
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return sql
+
+    expression = statements[0]
+    partition_filter = _PartitionFilter({table.strip() for table in billing_table_ids if table and table.strip()})
+    partition_filter.visit_query(expression, UNBOUNDED, {})
+    if not partition_filter.injected:
+        return sql
+    return expression.sql(dialect='bigquery', pretty=True)
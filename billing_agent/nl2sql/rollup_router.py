@@ -0,0 +1,361 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from billing_agent.nl2sql.partition_filter import (MIDNIGHT, TRUNC_UNITS, TRUNCS, condition_window, constant_string,
+                                                   intersect)
+from billing_agent.nl2sql.sql_expander import table_id
+
+# Daily rollup of the billing tables, see ROLLUP_REPORT of python_script/main.py, unset to read the billing tables.
+BILLING_ROLLUP_TABLE_ID = os.getenv('BILLING_ROLLUP_TABLE_ID')
+# Minimum interval between two probes of the usage dates and the billing tables of the rollup.
+ROLLUP_PROBE_SECONDS = int(os.getenv('ROLLUP_PROBE_SECONDS', 600))
+
+# The time zone of the usage dates of the rollup.
+ROLLUP_TIME_ZONE = 'America/Los_Angeles'
+# Column path of the billing tables --> column of the rollup, the rollup rows are grouped by these.
+DIMENSIONS = {
+    ('billing_account_id',): 'billing_account_id',
+    ('invoice', 'month'): 'invoice_month',
+    ('project', 'id'): 'project_id',
+    ('project', 'name'): 'project_name',
+    ('service', 'id'): 'service_id',
+    ('service', 'description'): 'service_description',
+    ('sku', 'id'): 'sku_id',
+    ('sku', 'description'): 'sku_description',
+    ('location', 'location'): 'location',
+    ('location', 'country'): 'country',
+    ('location', 'region'): 'region',
+    ('location', 'zone'): 'zone',
+    ('cost_type',): 'cost_type',
+    ('currency',): 'currency',
+    ('usage', 'unit'): 'usage_unit',
+    ('usage', 'pricing_unit'): 'usage_pricing_unit',
+}
+# Column path of the billing tables --> column of the rollup, the rollup rows hold their sums.
+MEASURES = {
+    ('cost',): 'cost',
+    ('usage', 'amount'): 'usage_amount',
+    ('usage', 'amount_in_pricing_units'): 'usage_amount_in_pricing_units',
+}
+# Expressions a measure may be wrapped in up to its SUM, the sum of the rollup rows is then the same.
+LINEAR = (exp.Add, exp.Sub, exp.Paren, exp.Neg, exp.Coalesce)
+# Aggregates of the dimensions, the same on the rollup rows.
+DIMENSION_AGGREGATES = (exp.Min, exp.Max, exp.AnyValue, exp.ApproxDistinct)
+DATE_PARTS = {'YEAR', 'ISOYEAR', 'QUARTER', 'MONTH', 'WEEK', 'ISOWEEK', 'DAY', 'DAYOFWEEK', 'DAYOFYEAR'}
+
+
+class _NotRoutable(Exception):
+    pass
+
+
+def _path(column: exp.Column, alias: str) -> tuple:
+    parts = [part.name.lower() for part in column.parts]
+    if len(parts) > 1 and parts[0] == alias.lower():
+        parts = parts[1:]
+    return tuple(parts)
+
+
+def _credits_column(subquery: exp.Expression, alias: str):
+    """
+    The rollup column of a sum of the credits of a row, the ones the generation prompt asks for:
+    (SELECT SUM(credits.amount) FROM UNNEST(credits)) and the same WHERE type != 'PROMOTION'.
+
+    Returns:
+        str: The rollup column, or None if the subquery is not one of them.
+    """
+    select = subquery.this if isinstance(subquery, exp.Subquery) else None
+    if not isinstance(select, exp.Select) or len(select.expressions) != 1 or any(
+            select.args.get(arg_key) for arg_key in ('joins', 'group', 'having', 'qualify', 'order', 'limit', 'with_')):
+        return None
+    unnest = select.args['from_'].this if select.args.get('from_') is not None else None
+    if not isinstance(unnest, exp.Unnest) or len(unnest.expressions) != 1:
+        return None
+    array = unnest.expressions[0]
+    if not isinstance(array, exp.Column) or _path(array, alias) != ('credits',):
+        return None
+    unnest_alias = unnest.args.get('alias')
+    if unnest_alias is not None and unnest_alias.columns:
+        element = unnest_alias.columns[0].name
+    else:
+        element = unnest_alias.name if unnest_alias is not None and unnest_alias.name else 'credits'
+
+    def element_field(node, name: str) -> bool:
+        return (isinstance(node, exp.Column) and node.name.lower() == name
+                and node.table.lower() in ('', element.lower()) and not node.args.get('db'))
+
+    total = select.expressions[0].unalias()
+    if not isinstance(total, exp.Sum) or not element_field(total.this, 'amount'):
+        return None
+    where = select.args.get('where')
+    if where is None:
+        return 'credits_amount'
+    condition = where.this
+    if (isinstance(condition, exp.NEQ) and element_field(condition.this, 'type')
+            and constant_string(condition.expression) == 'PROMOTION'):
+        return 'non_promotion_credits_amount'
+    return None
+
+
+def _in_sum(node: exp.Expression) -> bool:
+    """Whether a measure is summed, through expressions keeping the sum of the rollup rows the same."""
+    child, parent = node, node.parent
+    while isinstance(parent, LINEAR):
+        if isinstance(parent, exp.Coalesce) and (parent.this is not child or any(
+                not (isinstance(default, exp.Literal) and default.name in ('0', '0.0')) for default in parent.expressions)):
+            return False
+        child, parent = parent, parent.parent
+    return isinstance(parent, exp.Sum) and not isinstance(parent.this, exp.Distinct)
+
+
+def _date_level(node: exp.Expression) -> bool:
+    """Whether DATETIME(usage_start_time, time zone) is only used at the day level, where the usage date is enough."""
+    parent = node.parent
+    while isinstance(parent, exp.Paren):
+        node, parent = parent, parent.parent
+    if isinstance(parent, exp.Date) and not parent.args.get('zone'):
+        return True
+    if isinstance(parent, TRUNCS):
+        unit = parent.args.get('unit')
+        return unit is not None and unit.name.upper() in TRUNC_UNITS
+    if isinstance(parent, exp.Extract):
+        return parent.this.name.upper() in DATE_PARTS
+    if isinstance(parent, exp.Between):
+        others = [parent.args.get('low'), parent.args.get('high')]
+    elif isinstance(parent, exp.In) and not parent.args.get('query'):
+        others = parent.expressions
+    elif isinstance(parent, (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+        others = [parent.expression if parent.this is node else parent.this]
+    else:
+        return False
+    return all(MIDNIGHT.match(constant_string(other) or '') for other in others)
+
+
+def _usage_date(column: exp.Column, qualifier):
+    """
+    Map a usage_start_time column to the usage date of the rollup.
+
+    Returns:
+        tuple: The expression to replace and its replacement.
+    """
+    parent = column.parent
+    zone = None
+    if isinstance(parent, exp.Date) and parent.this is column:
+        zone = parent.args.get('zone')
+    elif isinstance(parent, exp.Datetime) and parent.this is column:
+        zone = parent.args.get('expression')
+    if zone is None or constant_string(zone) != ROLLUP_TIME_ZONE:
+        raise _NotRoutable(f'{column.sql()} is not a usage date')
+    usage_date = exp.column('usage_date', table=qualifier)
+    if isinstance(parent, exp.Date):
+        return parent, usage_date
+    if not _date_level(parent):
+        raise _NotRoutable(f'{parent.sql()} is used below the day level')
+    return parent, exp.Datetime(this=usage_date)
+
+
+def _replacements(select: exp.Select, alias: str, qualified: bool) -> list:
+    """
+    Map the expressions of a SELECT on a billing table to the rollup.
+
+    Returns:
+        list: (expression, replacement) pairs, raises _NotRoutable if the SELECT cannot read the rollup.
+    """
+    if select.args.get('qualify') or any(True for _ in select.find_all(exp.Window)):
+        raise _NotRoutable('window functions')
+    aliases = {projection.alias.lower() for projection in select.expressions if projection.alias}
+    qualifier = alias if qualified else None
+    replacements, measures = [], []
+    aggregated = select.args.get('group') is not None
+
+    stack = [(node, arg_key) for arg_key, value in select.args.items() if arg_key not in ('from_', 'with_')
+             for node in (value if isinstance(value, list) else [value]) if isinstance(node, exp.Expression)]
+    while stack:
+        node, arg_key = stack.pop()
+        if isinstance(node, exp.Star):
+            raise _NotRoutable('SELECT *')
+        if isinstance(node, (exp.Subquery, exp.Query)):
+            column = _credits_column(node, alias)
+            if column is None:
+                raise _NotRoutable(f'subquery {node.sql()}')
+            replacements.append((node, exp.column(column, table=qualifier)))
+            measures.append(node)
+            continue
+        if isinstance(node, exp.AggFunc):
+            if isinstance(node, exp.Sum) and not isinstance(node.this, exp.Distinct):
+                aggregated = True
+            elif not (isinstance(node, DIMENSION_AGGREGATES) or
+                      (isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct))):
+                raise _NotRoutable(f'aggregate {node.sql()}')
+        if isinstance(node, exp.Column):
+            path = _path(node, alias)
+            if arg_key in ('group', 'having', 'order') and len(path) == 1 and path[0] in aliases:
+                continue
+            if path == ('usage_start_time',):
+                replacements.append(_usage_date(node, qualifier))
+            elif path in DIMENSIONS:
+                replacements.append((node, exp.column(DIMENSIONS[path], table=qualifier)))
+            elif path in MEASURES:
+                replacements.append((node, exp.column(MEASURES[path], table=qualifier)))
+                measures.append(node)
+            else:
+                raise _NotRoutable(f'column {node.sql()}')
+            continue
+        stack.extend((child, arg_key) for child in node.iter_expressions())
+
+    if not aggregated:
+        raise _NotRoutable('not an aggregation')
+    for measure in measures:
+        if not _in_sum(measure):
+            raise _NotRoutable(f'{measure.sql()} is not summed')
+        aggregate = measure.find_ancestor(exp.AggFunc)
+        if not isinstance(aggregate, exp.Sum):
+            raise _NotRoutable(f'{measure.sql()} is not summed')
+    return replacements
+
+
+def _usage_window(where: exp.Expression, alias: str) -> tuple:
+    """
+    The usage dates of the rows a WHERE keeps, from its predicates on the usage dates and the invoice months.
+
+    Returns:
+        tuple: (first usage date, last usage date), None when open.
+    """
+    def belongs(qualifier):
+        return qualifier in ('', alias)
+
+    high = condition_window(where, belongs, {'usage', 'invoice'}, slack_months=0)[1]
+    # Rows of the usage of the last days of a month may land on the invoice of the next one.
+    low = intersect(condition_window(where, belongs, {'usage'}, slack_months=0),
+                    condition_window(where, belongs, {'invoice'}, slack_months=1))[0]
+    return low, high
+
+
+def route_to_rollup(sql: str, prototype_table_id: str, rollup_table_id: str, first_date: datetime.date,
+                    last_date: datetime.date) -> str:
+    """
+    Rewrite the SELECTs of a query that sum the cost, credits or usage of the prototype billing table by the
+    dimensions of the rollup, to read the rollup instead.
+
+    A SELECT is rewritten when it reads the prototype table only, every column it uses is a dimension of the rollup,
+    or a measure in a SUM, e.g. SUM(cost) + SUM(IFNULL((SELECT SUM(credits.amount) FROM UNNEST(credits)), 0)),
+    usage_start_time is only used at the day level in the time zone of the rollup, and its time range, on the
+    usage dates or the invoice months, is bounded and within first_date and last_date.
+
+    Args:
+        sql: The query, in the BigQuery dialect.
+        prototype_table_id: The ID of the prototype billing table.
+        rollup_table_id: The ID of the rollup table.
+        first_date: The first usage date of the rollup, earlier days are only there if they were backfilled.
+        last_date: The last usage date of the rollup.
+
+    Returns:
+        str: The query reading the rollup, or the query as it is if none of its SELECTs can.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read='bigquery') if statement is not None]
+    except SqlglotError:
+        return sql
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return sql
+    expression = statements[0]
+
+    routed = 0
+    for select in list(expression.find_all(exp.Select)):
+        source = select.args['from_'].this if select.args.get('from_') is not None else None
+        if (not isinstance(source, exp.Table) or table_id(source).lower() != prototype_table_id.lower()
+                or select.args.get('joins')):
+            continue
+        alias = source.alias_or_name
+        try:
+            qualified = any(len(column.parts) > 1 and column.parts[0].name.lower() == alias.lower()
+                            for column in select.find_all(exp.Column))
+            replacements = _replacements(select, alias, qualified)
+            low, high = _usage_window(select.args.get('where'), alias)
+            if low is None or high is None or low < first_date or high > last_date:
+                raise _NotRoutable(f'time range from {low} to {high}, the rollup is from {first_date} to {last_date}')
+        except _NotRoutable as e:
+            logging.debug(f"Not reading the rollup: {e}")
+            continue
+        for node, replacement in replacements:
+            node.replace(replacement)
+        rollup = exp.to_table(f'`{rollup_table_id}`', dialect='bigquery')
+        source.replace(rollup.as_(alias) if source.alias or qualified else rollup)
+        routed += 1
+
+    if not routed:
+        return sql
+    return expression.sql(dialect='bigquery', pretty=True)
+
+
+class RollupRouter:
+    """
+    Routes the queries to the rollup of the billing tables, see route_to_rollup, as long as the rollup covers them:
+    it is computed from exactly the billing tables the query reads, over all the days of its time range.
+
+    The coverage of the rollup is probed at most every probe_seconds.
+    """
+
+    def __init__(self, client_factory, rollup_table_id: str = BILLING_ROLLUP_TABLE_ID,
+                 probe_seconds: int = ROLLUP_PROBE_SECONDS):
+        """
+        Args:
+            client_factory: Callable returning a bigquery.Client.
+            rollup_table_id: The ID of the rollup table, None to never route.
+            probe_seconds: Minimum interval between two probes of the rollup.
+        """
+        self.client_factory = client_factory
+        self.rollup_table_id = rollup_table_id
+        self.probe_seconds = probe_seconds
+        # (coverage, probed_at epoch seconds)
+        self.probe = None
+        self._lock = threading.Lock()
+
+    def coverage(self):
+        """
+        Returns:
+            tuple: (first usage date, last usage date, set of the lowercase IDs of the billing tables the rollup
+                is computed from), None if the rollup cannot be probed or is empty.
+        """
+        with self._lock:
+            if self.probe is not None and time.time() - self.probe[1] < self.probe_seconds:
+                return self.probe[0]
+            try:
+                rows = list(self.client_factory().query(
+                    f"SELECT MIN(usage_date) AS first_date, MAX(usage_date) AS last_date, "
+                    f"ARRAY_AGG(DISTINCT billing_export_table IGNORE NULLS) AS billing_export_tables "
+                    f"FROM `{self.rollup_table_id}`").result())
+                coverage = None
+                if rows and rows[0].last_date is not None:
+                    coverage = (rows[0].first_date, rows[0].last_date,
+                                {table.lower() for table in rows[0].billing_export_tables})
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.warning(f"Failed to probe {self.rollup_table_id}, not routing to it: {e}")
+                coverage = None
+            self.probe = (coverage, time.time())
+            return coverage
+
+    def route(self, sql: str, prototype_table_id: str, billing_table_ids: list) -> str:
+        """
+        Args:
+            sql: The query on the prototype billing table.
+            prototype_table_id: The ID of the prototype billing table.
+            billing_table_ids: The IDs of the billing tables the query stands for, the ones it is expanded to.
+
+        Returns:
+            str: The query, reading the rollup where it can.
+        """
+        if not self.rollup_table_id or prototype_table_id.lower() not in sql.replace('`', '').lower():
+            return sql
+        coverage = self.coverage()
+        billing_table_ids = {table.strip().lower() for table in billing_table_ids if table and table.strip()}
+        if coverage is None or coverage[2] != billing_table_ids:
+            # The rows of the billing tables the rollup is not computed from would be missing.
+            return sql
+        return route_to_rollup(sql, prototype_table_id, self.rollup_table_id, coverage[0], coverage[1])
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from google.cloud import bigquery
+
+# Directory of the persisted schema contexts, unset to keep them in memory only.
+SCHEMA_CACHE_DIR = os.getenv('SCHEMA_CACHE_DIR')
+# Minimum interval between two metadata probes of the `modified` timestamp of a table.
+SCHEMA_CACHE_PROBE_SECONDS = int(os.getenv('SCHEMA_CACHE_PROBE_SECONDS', 300))
+
+
+def build_schema_context(bigquery_client: bigquery.Client, table_obj: bigquery.Table) -> str:
+    """
+    Build the DDL of a table, followed by example INSERTs of its first rows.
+
+    Args:
+        bigquery_client: The BigQuery client used to list the example rows.
+        table_obj: The table, as returned by get_table.
+
+    Returns:
+        str: The schema context of the table.
+    """
+    table_id = f"{table_obj.project}.{table_obj.dataset_id}.{table_obj.table_id}"
+    ddl_statement = f"CREATE OR REPLACE TABLE `{table_id}` (\n"
+
+    for field in table_obj.schema:
+        ddl_statement += f"  `{field.name}` {field.field_type}"
+        if field.mode == "REPEATED":
+            ddl_statement += " ARRAY"
+        if field.description:
+            ddl_statement += f" COMMENT '{field.description}'"
+        ddl_statement += ",\n"
+
+    ddl_statement = ddl_statement[:-2] + "\n);\n\n"
+
+    # Add example values if available (limited to first row)
+    rows = bigquery_client.list_rows(
+        table_obj, max_results=5).to_dataframe()
+    if not rows.empty:
+        ddl_statement += f"-- Example values for table `{table_id}`:\n"
+        for _, row in rows.iterrows():  # Iterate over DataFrame rows
+            ddl_statement += f"INSERT INTO `{table_id}` VALUES\n"
+            example_row_str = "("
+            for value in row.values:  # Now row is a pandas Series and has values
+                if isinstance(value, str):
+                    example_row_str += f"'{value}',"
+                elif value is None:
+                    example_row_str += "NULL,"
+                else:
+                    example_row_str += f"{value},"
+            example_row_str = (
+                example_row_str[:-1] + ");\n\n"
+            )  # remove trailing comma
+            ddl_statement += example_row_str
+    return ddl_statement
+
+
+class SchemaContextCache:
+    """
+    Schema contexts shared by every session of the process, keyed by table ID and the `modified` timestamp of the table.
+
+    The `modified` timestamp is probed at most once per probe_seconds, the example rows are only listed again
+    when it moved. The schema fields of the table are cached alongside, for the offline SQL checks.
+    """
+
+    def __init__(self, client_factory, cache_dir: str = SCHEMA_CACHE_DIR,
+                 probe_seconds: int = SCHEMA_CACHE_PROBE_SECONDS):
+        """
+        Args:
+            client_factory: Callable returning a bigquery.Client.
+            cache_dir: Directory of the persisted contexts, None to keep them in memory only.
+            probe_seconds: Minimum interval between two probes of a table.
+        """
+        self.client_factory = client_factory
+        self.cache_dir = cache_dir
+        self.probe_seconds = probe_seconds
+        # table ID --> {'modified': isoformat, 'context': str, 'fields': [api repr], 'probed_at': epoch seconds}
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, table_id: str) -> str:
+        """
+        Get the schema context of a table, see build_schema_context.
+
+        Args:
+            table_id: The fully qualified table ID.
+
+        Returns:
+            str: The schema context of the table.
+        """
+        return self._entry(table_id)['context']
+
+    def get_fields(self, table_id: str) -> list:
+        """
+        Get the schema fields of a table.
+
+        Args:
+            table_id: The fully qualified table ID.
+
+        Returns:
+            list: The fields in their API representation, e.g.
+                {'name': 'sku', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [...]}.
+        """
+        return self._entry(table_id)['fields']
+
+    def _entry(self, table_id: str) -> dict:
+        with self._lock:
+            entry = self.entries.get(table_id) or self._read_disk(table_id)
+            if entry is not None and 'fields' in entry and time.time() - entry['probed_at'] < self.probe_seconds:
+                return entry
+
+            bigquery_client = self.client_factory()
+            table_obj = bigquery_client.get_table(table_id)
+            modified = table_obj.modified.isoformat() if table_obj.modified else None
+            if entry is None or entry['modified'] != modified or 'fields' not in entry:
+                logging.info(f"Building schema context of {table_id} modified at {modified}")
+                entry = {'modified': modified,
+                         'context': build_schema_context(bigquery_client, table_obj),
+                         'fields': [field.to_api_repr() for field in table_obj.schema]}
+            entry['probed_at'] = time.time()
+            self.entries[table_id] = entry
+            self._write_disk(table_id, entry)
+            return entry
+
+    def _path(self, table_id: str) -> str:
+        return os.path.join(self.cache_dir, f"schema_context_{table_id.replace(':', '.')}.json")
+
+    def _read_disk(self, table_id: str):
+        if not self.cache_dir or not os.path.exists(self._path(table_id)):
+            return None
+        try:
+            with open(self._path(table_id), 'r') as cache_file:
+                entry = json.load(cache_file)
+            # A file of another shape is a miss, 'fields' is missing from the entries of older versions.
+            if not (isinstance(entry, dict) and isinstance(entry.get('context'), str)
+                    and isinstance(entry.get('modified'), (str, type(None)))
+                    and isinstance(entry.get('probed_at'), (int, float))
+                    and isinstance(entry.get('fields', []), list)):
+                raise ValueError('unexpected entry')
+            return entry
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to read schema context of {table_id}: {e}")
+            return None
+
+    def _write_disk(self, table_id: str, entry: dict) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(table_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to write schema context of {table_id}: {e}")
@@ -0,0 +1,130 @@
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# Name of the CTE combining the target billing tables, suffixed if the query already has a CTE of that name.
+BILLING_CTE_NAME = 'billing_export'
+# Pseudo-columns of the ingestion-time partitioned billing tables --> the column exposing them in the CTE,
+# a filter on it still prunes the partitions of every branch. Column names cannot start with _PARTITION.
+PARTITION_COLUMNS = {'_partitiontime': 'export_partition_time', '_partitiondate': 'export_partition_date'}
+# A fenced code block of the model output, with an optional language tag.
+CODE_BLOCK = re.compile(r'```[ \t]*(?:sql|googlesql|bigquery)?[ \t]*\n(.*?)```', re.DOTALL | re.IGNORECASE)
+
+
+class ExpansionError(ValueError):
+    """The SQL cannot be expanded to the target billing tables, it must not run on the prototype table alone."""
+
+
+def table_id(table: exp.Table) -> str:
+    """The ID of a table reference, as written, e.g. project.dataset.table."""
+    return '.'.join(part.name for part in table.parts)
+
+
+def extract_sql(text: str) -> str:
+    """
+    The SQL of a model output, the first fenced code block if any, e.g. when the SQL comes with an explanation.
+
+    Args:
+        text: The model output.
+
+    Returns:
+        str: The SQL, stripped.
+    """
+    match = CODE_BLOCK.search(text)
+    return (match.group(1) if match else text).strip()
+
+
+def _partition_references(expression: exp.Expression, references: list) -> list:
+    """
+    Find the partition pseudo-columns read from the prototype table references.
+
+    Returns:
+        list: The columns, unqualified or qualified by the alias of a reference, in a SELECT reading a reference.
+    """
+    columns = []
+    for reference in references:
+        select = reference.find_ancestor(exp.Select)
+        if select is None:
+            continue
+        for column in select.find_all(exp.Column):
+            if (column.name.lower() in PARTITION_COLUMNS and column.table in ('', reference.alias_or_name)
+                    and column.find_ancestor(exp.Select) is select):
+                columns.append(column)
+    return columns
+
+
+def _union_branches(target_table_ids: list, columns: list, partition_columns: set) -> exp.Query:
+    branches = []
+    for target_id in target_table_ids:
+        projections = [exp.column(name, quoted=True) for name in columns] if columns else [exp.Star()]
+        for pseudo_column in sorted(partition_columns):
+            projections.append(exp.alias_(exp.column(pseudo_column.upper()), PARTITION_COLUMNS[pseudo_column]))
+        branches.append(exp.select(*projections).from_(exp.to_table(f'`{target_id}`', dialect='bigquery')))
+    union = branches[0]
+    for branch in branches[1:]:
+        union = exp.union(union, branch, distinct=False)
+    return union
+
+
+def expand_billing_tables(sql: str, prototype_table_id: str, target_table_ids: list, columns: list = None) -> str:
+    """
+    Rewrite a query on the prototype billing table into the same query on all the target billing tables.
+
+    Every reference to the prototype table reads a CTE of the UNION ALL of the target tables instead, keeping the
+    alias of the reference so that the rest of the query is untouched. Partition pseudo-columns read from the
+    prototype are exposed by the CTE, see PARTITION_COLUMNS.
+
+    Args:
+        sql: The query, in the BigQuery dialect, reading the prototype table.
+        prototype_table_id: The ID of the prototype table, e.g. project.dataset.table.
+        target_table_ids: The IDs of the target tables, sharing the schema of the prototype table.
+        columns: The top-level columns of the schema, listed by every branch of the UNION ALL, None for *.
+
+    Returns:
+        str: The expanded query, or the query as it is if it does not read the prototype table.
+
+    Raises:
+        ExpansionError: If the query cannot be parsed, or is not a single query.
+    """
+    target_table_ids = [target_id.strip() for target_id in target_table_ids or [] if target_id.strip()]
+    if not target_table_ids:
+        return sql
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read='bigquery') if statement is not None]
+    except SqlglotError as e:
+        raise ExpansionError(f"Cannot parse the SQL to expand to the target billing tables: {e}") from e
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        raise ExpansionError("Expected a single query to expand to the target billing tables")
+    expression = statements[0]
+
+    # Table names are case sensitive in BigQuery, but the prototype table is the only one the model is given.
+    references = [table for table in expression.find_all(exp.Table)
+                  if table_id(table).lower() == prototype_table_id.lower()]
+    if not references:
+        return sql
+
+    cte_names = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+    cte_name, suffix = BILLING_CTE_NAME, 1
+    while cte_name in cte_names:
+        cte_name, suffix = f'{BILLING_CTE_NAME}_{suffix}', suffix + 1
+
+    partition_references = _partition_references(expression, references)
+    union = _union_branches(target_table_ids, columns, {column.name.lower() for column in partition_references})
+    for column in partition_references:
+        column.set('this', exp.to_identifier(PARTITION_COLUMNS[column.name.lower()]))
+
+    for reference in references:
+        # Without an alias, columns may be qualified by the table name.
+        alias = reference.alias_or_name
+        reference.replace(exp.to_table(cte_name).as_(alias))
+
+    cte = exp.CTE(this=union, alias=exp.TableAlias(this=exp.to_identifier(cte_name)))
+    with_ = expression.args.get('with_')
+    if with_ is None:
+        expression.set('with_', exp.With(expressions=[cte]))
+    else:
+        # First, so that the CTEs of the query can read it.
+        with_.set('expressions', [cte] + list(with_.expressions))
+    return expression.sql(dialect='bigquery', pretty=True)
@@ -0,0 +1,171 @@
+import datetime
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# Number of generated SQL kept, least recently used first out.
+SQL_TEMPLATE_CACHE_MAX_ENTRIES = int(os.getenv('SQL_TEMPLATE_CACHE_MAX_ENTRIES', 1000))
+
+MONTH_NAMES = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+               'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+# (parameter kind, pattern, value of a match), days first so their year and month are not taken for a month
+PARAMETER_PATTERNS = [
+    ('date', re.compile(r'\b(20\d{2}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01]))\b'),
+     lambda match: match.group(1)),
+    ('month', re.compile(r'\b(20\d{2})-?(0[1-9]|1[0-2])\b'),
+     lambda match: f'{match.group(1)}{match.group(2)}'),
+    ('month', re.compile(r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+(20\d{2})\b'),
+     lambda match: f'{match.group(2)}{MONTH_NAMES[match.group(1)]:02d}'),
+]
+# The cost type the user clarified, see the root agent: the SQL differs by cost type, it is part of the fingerprint.
+COST_TYPE_PATTERNS = [
+    ('credits_without_promotions', re.compile(r'with credits but (?:without|no|excluding) promotions?')),
+    ('without_credits', re.compile(r'without (?:any )?credits (?:or|and|nor) promotions?|raw cost|sum\(cost\)')),
+    ('with_credits_and_promotions', re.compile(r'with (?:both )?credits and promotions?|final cost|net cost')),
+]
+# Words making the answer depend on the day the question is asked.
+RELATIVE_TIME = re.compile(r'\b(today|yesterday|tomorrow|current|this|last|past|previous|recent|recently|ago|'
+                           r'next|ytd|mtd|now)\b')
+STOP_WORDS = {'a', 'an', 'the', 'please', 'me', 'us', 'my', 'our', 'what', 'whats', 'is', 'are', 'was', 'show',
+              'give', 'tell', 'get', 'list', 'of', 'for', 'in'}
+# Literals of the SQL that look like a day or a month, they must all come from the question parameters.
+DATE_LIKE = re.compile(r'\d{4}-\d{2}|\b\d{6}\b')
+
+
+def fingerprint_question(question: str, today: datetime.date = None) -> dict:
+    """
+    Normalize a question, with its dates and months extracted as parameters.
+
+    Args:
+        question: The question, e.g. "Total cost with credits and promotions for 202506?"
+        today: The day the question is asked, part of the fingerprint when the question is relative to it.
+
+    Returns:
+        dict: 'template': the normalized question with placeholders,
+                e.g. "total cost @cost_with_credits_and_promotions@ {month}",
+            'exact': the normalized question with the parameter values,
+            'params': placeholder, e.g. month_1 --> value, e.g. 202506.
+    """
+    text = question.lower()
+    params = {}
+    counts = {}
+
+    def parameter(kind: str, value: str) -> str:
+        counts[kind] = counts.get(kind, 0) + 1
+        name = f'{kind}_{counts[kind]}'
+        params[name] = value
+        return f' @{name}@ '
+
+    for kind, pattern, value in PARAMETER_PATTERNS:
+        text = pattern.sub(lambda match: parameter(kind, value(match)), text)
+    for cost_type, pattern in COST_TYPE_PATTERNS:
+        text = pattern.sub(f' @cost_{cost_type}@ ', text)
+
+    words = [word for word in re.sub(r'[^a-z0-9_@()\-]+', ' ', text).split() if word not in STOP_WORDS]
+    if not params or RELATIVE_TIME.search(question.lower()):
+        words.append(f'@today_{(today or datetime.date.today()).isoformat()}@')
+    template = ' '.join(re.sub(r'@(date|month)_\d+@', r'{\1}', word) for word in words)
+    exact = ' '.join(re.sub(r'@((?:date|month)_\d+)@', lambda m: params[m.group(1)], word) for word in words)
+    return {'template': template, 'exact': exact, 'params': params}
+
+
+def sql_template(sql: str, params: dict):
+    """
+    Turn a generated SQL into a template, its literals equal to a parameter value become placeholders.
+
+    Args:
+        sql: The SQL generated for the question.
+        params: The parameters of the question, see fingerprint_question.
+
+    Returns:
+        str: The template, or None if the SQL has a day or month literal that is not a parameter,
+            e.g. a partition window derived from the month of the question, or a parameter value used out of a literal.
+    """
+    if not params or len(set(params.values())) != len(params):
+        return None
+    try:
+        expression = sqlglot.parse_one(sql.replace("```sql", "").replace("```", ""), read='bigquery')
+    except SqlglotError:
+        return None
+    values = set(params.values())
+    for literal in expression.find_all(exp.Literal):
+        if DATE_LIKE.search(literal.name) and literal.name not in values:
+            return None
+
+    template = sql
+    for name, value in params.items():
+        quoted = re.compile(r"""(['"])""" + re.escape(value) + r"\1")
+        if len(quoted.findall(template)) != template.count(value):
+            return None
+        template = quoted.sub(lambda m: f'{m.group(1)}@{name}@{m.group(1)}', template)
+    return template
+
+
+def fill_template(template: str, params: dict) -> str:
+    for name, value in params.items():
+        template = template.replace(f'@{name}@', value)
+    return template
+
+
+class SqlTemplateCache:
+    """
+    SQL generated for the questions, keyed by the question fingerprint and the generation context, e.g. the schema.
+
+    A SQL whose day and month literals all come from the question is kept as a template, reused for the same question
+    about other days or months. Other SQL is only reused for the exact same question.
+    """
+
+    def __init__(self, max_entries: int = SQL_TEMPLATE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # (context version, fingerprint) --> SQL template
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str, context_version: str):
+        """
+        Get the SQL of a question.
+
+        Args:
+            question: The question.
+            context_version: Version of what the generation depends on besides the question,
+                entries of other versions are never returned.
+
+        Returns:
+            str: The SQL, with the parameters of the question substituted, or None.
+        """
+        fingerprint = fingerprint_question(question)
+        with self._lock:
+            for key, params in (((context_version, 'template', fingerprint['template']), fingerprint['params']),
+                                ((context_version, 'exact', fingerprint['exact']), {})):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    logging.debug(f"SQL template cache hit: {key[1]} {key[2]}")
+                    return fill_template(self.entries[key], params)
+        return None
+
+    def put(self, question: str, context_version: str, sql: str) -> None:
+        """
+        Cache the SQL generated for a question.
+
+        Args:
+            question: The question.
+            context_version: See get.
+            sql: The generated SQL.
+        """
+        fingerprint = fingerprint_question(question)
+        template = sql_template(sql, fingerprint['params'])
+        if template is not None:
+            key = (context_version, 'template', fingerprint['template'])
+        else:
+            key, template = (context_version, 'exact', fingerprint['exact']), sql
+        with self._lock:
+            self.entries[key] = template
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
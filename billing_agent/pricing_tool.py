@@ -3,9 +3,9 @@ from typing import Optional
 from google.adk.tools import FunctionTool
 import os
 import sys
-import yaml
 from billing_agent.python_script.lib.instance import Instance
-from billing_agent.python_script.lib.price import get_price_list, get_pricing_for_sku_from_bq
+from billing_agent.python_script.lib.sku_catalog import get_catalog
+from billing_agent.python_script.lib.price import get_unit_price_dicts, get_pricing_for_sku_from_bq
 import json
 
 def get_price(
@@ -13,22 +13,11 @@ def get_price(
     region: str,
 ) -> str:
     try:
-        # Load SKU mappings from yaml files
-        with open("billing_agent/python_script/conf/sku_cpu.yaml", 'r') as sku_yaml:
-            sku_cpu_dict = yaml.safe_load(sku_yaml)
-        with open("billing_agent/python_script/conf/sku_ram.yaml", 'r') as sku_yaml:
-            sku_ram_dict = yaml.safe_load(sku_yaml)
-        with open("billing_agent/python_script/conf/sku_gpu.yaml", 'r') as sku_yaml:
-            sku_gpu_dict = yaml.safe_load(sku_yaml)
-        with open("billing_agent/python_script/conf/sku_disk.yaml", 'r') as sku_yaml:
-            sku_disk_dict = yaml.safe_load(sku_yaml)
+        # Load SKU mappings, [category][key][region] --> SKU_ID
+        catalog = get_catalog()
 
-        # Get price lists
-        all_prices = get_price_list()
-        # The Instance class expects a dict with sku_id -> price.
-        # We take the first price from the tiered rates for simplicity.
-        list_price_dict = {k: v['list_price_details']['tiered_rates'][0]['usd_amount'] for k, v in all_prices.items() if v.get('list_price_details', {}).get('tiered_rates')}
-        final_price_dict = {k: v['final_price_details']['tiered_rates'][0]['usd_amount'] for k, v in all_prices.items() if v.get('final_price_details', {}).get('tiered_rates')}
+        # Get price lists, SKU_ID --> usd amount of the first pricing tier
+        list_price_dict, final_price_dict = get_unit_price_dicts()
 
         # Create an Instance and calculate the price
         machine = Instance(machine_type)
@@ -36,10 +25,10 @@ def get_price(
             region,
             list_price_dict,
             final_price_dict,
-            sku_cpu_dict,
-            sku_ram_dict,
-            sku_gpu_dict,
-            sku_disk_dict
+            catalog.sku_dict('cpu'),
+            catalog.sku_dict('ram'),
+            catalog.sku_dict('gpu'),
+            catalog.sku_dict('disk')
         )
         return str(result)
     except Exception as e:
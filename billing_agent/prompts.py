@@ -168,14 +168,14 @@ You are a BigQuery SQL expert tasked with answering user's questions about BigQu
 
 **Business Backgound:**
 ```
-{PUBLIC_DOCS}
+{app:PUBLIC_DOCS}
 ```
 **Schema:**
 
 The database structure is defined by the following table schemas (possibly with sample rows):
 
 ```
-{SCHEMA}
+{app:SCHEMA}
 ```
 
 **Natural language question:**
@@ -221,9 +221,8 @@ NL2SQL_EXPAND_PROMPT = """
 You are a BigQuery SQL expert tasked with answering user's questions about BigQuery tables by generating SQL queries in the GoogleSql dialect.  
 Your task is to write a Bigquery SQL query that answers the following question while using the provided context.
 
-The query should operate on four different customer-specific GCP billing export tables, which share the exact same schema and logical structure.
-The four customer billing tables are:
-{TARGET_BILLING_TABLES}
+Write the query on the single prototype billing table `{PROTOTYPE_DETAILED_BILLING_TABLE_ID}`, reading it directly in the FROM clause.
+The query is expanded afterwards to the customer billing tables, which share the exact same schema: DO NOT reference any other billing table, and DO NOT write a UNION ALL of billing tables.
 
 **Guidelines:**
 
@@ -245,28 +244,22 @@ The four customer billing tables are:
 
 
 **Requirements for the Output SQL:**
-1. Combine Data: Use UNION ALL to combine data from the four customer billing tables.
-1.1 In order to generate valid SQL, please list all columns in the union statement, instead of select *, eg. SELECT billing_account_id, service, sku, usage_start_time, usage_end_time, `project`, `labels`, `system_labels`, location, resource, `tags`, export_time, cost, currency, currency_conversion_rate, usage, `credits`, invoice, cost_type, adjustment_info, price, cost_at_list, transaction_type, seller_name, subscription FROM ...
-2. Partition Filtering:
-2.1 For each individual customer table query within the UNION ALL structure, add a WHERE clause to filter on the _PARTITIONTIME pseudo-column.
-2.2 The filter condition should be: TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) BETWEEN relevant_query_start_date_minus_1_month AND relevant_query_end_date_plus_1_month.
-2.2.1 relevant_query_start_date_minus_1_month and relevant_query_end_date_plus_1_month should be a YYYY-MM-DD STRING, DO NOT CAST IT INTO DATE TYPE. eg: TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) BETWEEN '2024-01-01' AND '2024-03-31'
-2.3 Determining the range:
-2.3.1 A time range filter on either `usage_start_time` or `invoice.month` is always required for billing queries.
-2.3.2 If the user's natural language question specifies a time range (e.g., "last month", "January 2023", "from 2023-01-01 to 2023-01-31"), use that range.
-2.3.3 If no explicit time range is provided in the user's question, you must infer a reasonable default range (e.g., "the last 30 days" or "the current month"). Make sure to clearly indicate in the explanation part of your response that a default range was used.
-3. Apply Original Logic: The overall structure of the query (its SELECT list, main WHERE conditions (other than the new partition filter), GROUP BY, JOINs, etc.) should be applied to the result of the UNION ALL of the pre-filtered customer tables. This typically means the UNION ALL part will be in a Common Table Expression (CTE) or a subquery.
+1. Time Range:
+1.1 A time range filter on either `usage_start_time` or `invoice.month` is always required for billing queries.
+1.2 If the user's natural language question specifies a time range (e.g., "last month", "January 2023", "from 2023-01-01 to 2023-01-31"), use that range.
+1.3 If no explicit time range is provided in the user's question, you must infer a reasonable default range (e.g., "the last 30 days" or "the current month"). Make sure to clearly indicate in the explanation part of your response that a default range was used.
+1.4 Write the time range with constant dates or months, e.g. `invoice.month = '202506'` or `DATETIME(usage_start_time, 'America/Los_Angeles') >= '2025-06-01'`. DO NOT filter on the _PARTITIONTIME pseudo-column, the partition filter is derived from the time range and added afterwards.
 
 **Business Backgound:**
 ```
-{PUBLIC_DOCS}
+{app:PUBLIC_DOCS}
 ```
 **Schema for prototype table `{PROTOTYPE_DETAILED_BILLING_TABLE_ID}`:**
 
 The database structure is defined by the following table schemas (possibly with sample rows):
 
 ```
-{SCHEMA}
+{app:SCHEMA}
 ```
 
 **Natural language question:**
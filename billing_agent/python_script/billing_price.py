@@ -0,0 +1,292 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from lib.batch_pricing import BatchPricer, TIERS, PRICE_TYPES
+from lib.instance import Instance
+from lib.price import get_unit_price_dicts
+from lib.sku_catalog import get_catalog
+
+DEFAULT_REGION = 'us-east4'
+
+# columns of a batch input row, only info is mandatory.
+# sku_type is instance (default) or disk, disk is the disk definition of an instance, e.g. local-ssd-9000_pd-standard-200
+INPUT_FIELDS = ['sku_type', 'info', 'region', 'disk']
+OUTPUT_FIELDS = INPUT_FIELDS + [f'{tier}_{price_type}' for tier in TIERS for price_type in PRICE_TYPES] + ['error']
+# key of the placeholder row of an input line which cannot be read, holding the error reported on its output row
+READ_ERROR = '_read_error'
+
+# (list_price_dict, final_price_dict, catalog) of this process, see get_pricing_context
+_pricing_context = None
+
+
+def process_args(args: [str]) -> argparse.Namespace:
+    """
+    To process input arguments. and retrieve instance type and region.
+    :param args:
+    string list of input arguments, e.g. ['-i', 'n2-custom-128-524288', '-z', 'us-central1']
+    :return:
+    3-item string tuple, first of which is instance type, second of which is region,
+    and the third of which is disk type.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python3 billing_price.py',
+        description='To show pricing information of given instance/disk info.')
+    parser.add_argument('sku_type', type=str, choices=['instance', 'disk', 'batch'],
+                        help='SKU type, value is either instance or disk. '
+                             'batch prices every row of the -f file instead.')
+    parser.add_argument('-i', type=str,
+                        help='instance/disk information, like nvidia-tesla-t4_4_custom-48-163840, local-ssd or n2-highmem-80')
+    parser.add_argument('-z', type=str, default=DEFAULT_REGION,
+                        help='region, default is us-east4')
+    parser.add_argument('-d', type=str, help='<Deprecated> disk type, this option will not be used.')
+    parser.add_argument('-f', type=str, default='-',
+                        help=f'batch input file of {",".join(INPUT_FIELDS)} rows in csv (with header) or jsonl, '
+                             f'default is - (stdin)')
+    parser.add_argument('-o', type=str, default='-', help='batch output file, default is - (stdout)')
+    parser.add_argument('--input-format', type=str, choices=['csv', 'jsonl'],
+                        help='batch input format, default is guessed from the -f file extension, csv for stdin')
+    parser.add_argument('--output-format', type=str, choices=['csv', 'jsonl'], default='csv',
+                        help='batch output format, default is csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of processes pricing batch chunks in parallel, default is the cpu count')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='number of batch rows priced together, default is 1000')
+
+    namespace = parser.parse_args(args)
+    if namespace.sku_type != 'batch' and not namespace.i:
+        parser.error(f'-i is required for {namespace.sku_type}')
+    return namespace
+
+
+def get_pricing_context() -> tuple:
+    """
+    :return: (list_price_dict, final_price_dict, catalog), loaded once per process.
+        Worker processes forked after the first call inherit it.
+    """
+    global _pricing_context
+
+    if _pricing_context is None:
+        # Get list price and account price of all SKUs from BigQuery pricing table
+        list_price_dict, final_price_dict = get_unit_price_dicts()
+        _pricing_context = (list_price_dict, final_price_dict, get_catalog())
+    return _pricing_context
+
+
+def disk_price_result(info: str, region: str, list_price_dict: dict, final_price_dict: dict,
+                      sku_disk_dict: dict) -> dict:
+    """
+    :return: unit pricing of a disk type, e.g. pd-ssd, in the region.
+    """
+    result = {'disk_type': info, 'region': region}
+    if info in sku_disk_dict.keys():
+        sku = sku_disk_dict[info].get(region)
+        if sku:
+            result["ondemand"] = {
+                'list_price': list_price_dict[sku],
+                'account_price': final_price_dict[sku]
+            }
+    if f'{info}-cud-1y' in sku_disk_dict.keys():
+        sku = sku_disk_dict[f'{info}-cud-1y'].get(region)
+        if sku:
+            result['1cud'] = {
+                'list_price': list_price_dict[sku],
+                'account_price': final_price_dict[sku]
+            }
+    if f'{info}-cud-3y' in sku_disk_dict.keys():
+        sku = sku_disk_dict[f'{info}-cud-3y'].get(region)
+        result['3cud'] = {
+            'list_price': list_price_dict[sku],
+            'account_price': final_price_dict[sku]
+        }
+    return result
+
+
+def read_rows(stream, input_format: str):
+    """
+    :return: generator of input rows as dicts, rows are read lazily so the input can be arbitrarily large.
+        A jsonl line which is not a JSON object is yielded as a placeholder row with its READ_ERROR.
+    """
+    if input_format == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {READ_ERROR: f'line {line_number}: {type(e).__name__}: {e}'}
+                continue
+            if not isinstance(row, dict):
+                row = {READ_ERROR: f'line {line_number}: expected a JSON object, got {type(row).__name__}'}
+            yield row
+    else:
+        yield from csv.DictReader(stream)
+
+
+def _price_value(value):
+    # e.g. a Decimal unit price of a disk, csv and jsonl rows both get the same plain float
+    return None if value is None else float(value)
+
+
+def _output_row(row: dict, result: dict = None, error: str = None) -> dict:
+    row = row if isinstance(row, dict) else {}
+    output = {field: row.get(field) for field in INPUT_FIELDS}
+    output['sku_type'] = output['sku_type'] or 'instance'
+    output['region'] = output['region'] or DEFAULT_REGION
+    for tier in TIERS:
+        for price_type in PRICE_TYPES:
+            output[f'{tier}_{price_type}'] = _price_value((result or {}).get(tier, {}).get(price_type))
+    output['error'] = error
+    return output
+
+
+def price_chunk(rows: [dict]) -> [dict]:
+    """
+    Price a chunk of batch input rows.
+    Instances are priced by region group with one BatchPricer call each, errors are reported on the row.
+
+    :return: output rows, in the order of the input rows.
+    """
+    list_price_dict, final_price_dict, catalog = get_pricing_context()
+    pricer = BatchPricer(list_price_dict, final_price_dict, catalog.sku_dict('cpu'), catalog.sku_dict('ram'),
+                         catalog.sku_dict('gpu'), catalog.sku_dict('disk'))
+
+    outputs = [None] * len(rows)
+    instances_by_region = {}
+    for position, row in enumerate(rows):
+        try:
+            if READ_ERROR in row:
+                outputs[position] = _output_row(row, error=row[READ_ERROR])
+                continue
+            sku_type = row.get('sku_type') or 'instance'
+            region = row.get('region') or DEFAULT_REGION
+            if sku_type == 'disk':
+                result = disk_price_result(row['info'], region, list_price_dict, final_price_dict,
+                                           catalog.sku_dict('disk'))
+                outputs[position] = _output_row(row, result)
+            elif sku_type == 'instance':
+                instance = Instance(row['info'], row.get('disk') or None)
+                instances_by_region.setdefault(region, []).append((position, instance))
+            else:
+                raise ValueError(f'Unknown sku_type {sku_type}, value is either instance or disk.')
+        except Exception as e:
+            outputs[position] = _output_row(row, error=f'{type(e).__name__}: {e}')
+
+    for region, positioned_instances in instances_by_region.items():
+        try:
+            batch_result = pricer.price([instance for _, instance in positioned_instances], [region])
+        except Exception as e:
+            for position, _ in positioned_instances:
+                outputs[position] = _output_row(rows[position], error=f'{type(e).__name__}: {e}')
+            continue
+        for i, (position, _) in enumerate(positioned_instances):
+            try:
+                outputs[position] = _output_row(rows[position], batch_result.result_in_json(i, 0))
+            except Exception as e:
+                outputs[position] = _output_row(rows[position], error=f'{type(e).__name__}: {e}')
+    return outputs
+
+
+def _chunks(rows, chunk_size: int):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _priced_chunks(chunks, workers: int):
+    """
+    :return: generator of priced chunks in input order.
+        At most 2 chunks per worker are in flight, so memory stays constant whatever the input size.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield price_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(executor.submit(price_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def run_batch(input_stream, output_stream, input_format: str = 'csv', output_format: str = 'csv',
+              workers: int = 1, chunk_size: int = 1000) -> int:
+    """
+    Price every row of input_stream and stream the results to output_stream.
+
+    :return: number of rows priced.
+    """
+    # load prices and SKU mappings before forking, so the workers share them
+    get_pricing_context()
+
+    writer = None
+    if output_format == 'csv':
+        writer = csv.DictWriter(output_stream, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+
+    count = 0
+    for outputs in _priced_chunks(_chunks(read_rows(input_stream, input_format), chunk_size), workers):
+        for output in outputs:
+            if writer:
+                writer.writerow(output)
+            else:
+                output_stream.write(f'{json.dumps(output)}\n')
+        count += len(outputs)
+    return count
+
+
+if __name__ == '__main__':
+    # python3 billing_price.py instance|disk -i n2-custom-128-524288 -z us-west4 -d local-ssd-9000_pd-standard-200
+    # python3 billing_price.py batch -f inventory.csv -o prices.jsonl --output-format jsonl
+    logging.basicConfig(level=logging.WARNING)
+
+    # process input parameters
+    namespace = process_args(sys.argv[1::])
+    sku_type = namespace.sku_type
+    info = namespace.i
+    region = namespace.z
+
+    if sku_type == 'batch':
+        input_format = namespace.input_format or ('jsonl' if namespace.f.endswith(('.jsonl', '.json')) else 'csv')
+        input_stream = sys.stdin if namespace.f == '-' else open(namespace.f, 'r', newline='')
+        output_stream = sys.stdout if namespace.o == '-' else open(namespace.o, 'w', newline='')
+        with input_stream, output_stream:
+            count = run_batch(input_stream, output_stream, input_format, namespace.output_format,
+                              namespace.workers, namespace.chunk_size)
+        logging.info(f'{count} rows priced.')
+        sys.exit(0)
+
+    list_price_dict, final_price_dict, catalog = get_pricing_context()
+    if sku_type == 'instance':
+        #  Init and do calculation
+        machine = Instance(info)
+
+        result = machine.price_result_in_json(
+            region,
+            list_price_dict,
+            final_price_dict,
+            catalog.sku_dict('cpu'),
+            catalog.sku_dict('ram'),
+            catalog.sku_dict('gpu'),
+            catalog.sku_dict('disk')
+        )
+        print(result)
+    else:
+        result = disk_price_result(info, region, list_price_dict, final_price_dict, catalog.sku_dict('disk'))
+        print(result)
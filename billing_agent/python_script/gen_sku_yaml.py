@@ -0,0 +1,414 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import argparse
+import bisect
+import collections
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+import yaml
+from google.cloud import bigquery
+
+from lib.price import latest_partition_date
+from lib.sku_catalog import write_compiled_catalog
+
+PRICING_TABLE = 'bytedance-cloud-216403.billing.cloud_pricing_export'
+# partition, SKU list and yaml content hashes of the last run, used by --incremental
+STATE_FILE = 'conf/sku_yaml_state.json'
+
+SKU_COLUMNS = '''
+            sku.id, sku.description, (case
+                when lower(sku.description) like '%delhi%' and array_length(geo_taxonomy.regions)=0 then ['asia-south2']
+                else geo_taxonomy.regions
+                end
+            ) as regions
+'''
+
+filtering_cpu_dict = {
+    'e2-predefined': ['E2 Instance Core running in%'],
+    'e2-custom': ['E2 Instance Core running in%'],
+    'e2-cud-1y': ['Commitment v1: E2 Cpu in%', '%for 1 Year'],
+    'e2-cud-3y': ['Commitment v1: E2 Cpu in%', '%for 3 Year'],
+    'a2-predefined': ['A2 Instance Core running in%'],
+    'a2-cud-1y': ['Commitment v1: A2 Cpu in%', '%for 1 Year'],
+    'a2-cud-3y': ['Commitment v1: A2 Cpu in%', '%for 3 Year'],
+    'a3-predefined': ['A3 Instance Core running in%'],
+    'a3-cud-1y': ['Commitment v1: A3 Cpu in%', '%for 1 Year'],
+    'a3-cud-3y': ['Commitment v1: A3 Cpu in%', '%for 3 Years'],
+    'g2-predefined': ['G2 Instance Core running in%'],
+    'g2-custom': ['G2 Custom Instance Core running in%'],
+    'g2-cud-1y': ['Commitment v1: G2 Cpu in%', '%for 1 Year'],
+    'g2-cud-3y': ['Commitment v1: G2 Cpu in%', '%for 3 Years'],
+    'n1-predefined': ['N1 Predefined Instance Core running in%'],
+    'n1-custom': ['Custom Instance Core running in%'],
+    'n1-cud-1y': ['Commitment v1: Cpu in%', '%for 1 Year'],
+    'n1-cud-3y': ['Commitment v1: Cpu in%', '%for 3 Year'],
+    'n2-predefined': ['N2 Instance Core running in%'],
+    'n2-custom': ['N2 Custom Instance Core running in%'],
+    'n2-cud-1y': ['Commitment v1: N2 Cpu in%', '%for 1 Year'],
+    'n2-cud-3y': ['Commitment v1: N2 Cpu in%', '%for 3 Year'],
+    'n2d-predefined': ['N2D AMD Instance Core running in%'],
+    'n2d-custom': ['N2D AMD Custom Instance Core running in%'],
+    'n2d-cud-1y': ['Commitment v1: N2D AMD Cpu in%', '%for 1 Year'],
+    'n2d-cud-3y': ['Commitment v1: N2D AMD Cpu in%', '%for 3 Year'],
+    'c2-predefined': ['Compute optimized Core running in%'],
+    'c2-cud-1y': ['Commitment: Compute optimized Core running in%', '%for 1 Year'],
+    'c2-cud-3y': ['Commitment: Compute optimized Core running in%', '%for 3 Year'],
+    'c3-predefined': ['C3 Instance Core running in%'],
+    'c3-cud-1y': ['Commitment v1: C3 Cpu in%', '%for 1 Year'],
+    'c3-cud-3y': ['Commitment v1: C3 Cpu in%', '%for 3 Years'],
+    'c3d-predefined': ['C3D Instance Core running in%'],
+    'c3d-cud-1y': ['Commitment v1: C3D Cpu in%', '%for 1 Year'],
+    'c3d-cud-3y': ['Commitment v1: C3D Cpu in%', '%for 3 Years'],
+    'g4-predefined': ['G4 Instance Core running in%'],
+    'g4-cud-1y': ['Commitment v1: G4 Cpu in%', '%for 1 Year'],
+    'g4-cud-3y': ['Commitment v1: G4 Cpu in%', '%for 3 Years'],
+    'c4-predefined': ['C4 Instance Core running in%'],
+    'c4-cud-1y': ['Commitment v1: C4 Cpu in%', '%for 1 Year'],
+    'c4-cud-3y': ['Commitment v1: C4 Cpu in%', '%for 3 Years'],
+    'c4d-predefined': ['C4D Instance Core running in%'],
+    'c4d-cud-1y': ['Commitment v1: C4D Cpu in%', '%for 1 Year'],
+    'c4d-cud-3y': ['Commitment v1: C4D Cpu in%', '%for 3 Years'],
+    'z3-predefined': ['Z3 Instance Core running in%'],
+    'z3-cud-1y': ['Commitment v1: Z3 Cpu in%', '%for 1 Year'],
+    'z3-cud-3y': ['Commitment v1: Z3 Cpu in%', '%for 3 Years'],
+}
+
+filtering_ram_dict = {
+    'e2-predefined': ['E2 Instance Ram running in%'],
+    'e2-custom': ['E2 Instance Ram running in%'],
+    'e2-cud-1y': ['Commitment v1: E2 Ram in%', '%for 1 Year'],
+    'e2-cud-3y': ['Commitment v1: E2 Ram in%', '%for 3 Year'],
+    'a2-predefined': ['A2 Instance Ram running in%'],
+    'a2-cud-1y': ['Commitment v1: A2 Ram in%', '%for 1 Year'],
+    'a2-cud-3y': ['Commitment v1: A2 Ram in%', '%for 3 Year'],
+    'a3-predefined': ['A3 Instance Ram running in%'],
+    'a3-cud-1y': ['Commitment v1: A3 Ram in%', '%for 1 Year'],
+    'a3-cud-3y': ['Commitment v1: A3 Ram in%', '%for 3 Years'],
+    'g2-predefined': ['G2 Instance Ram running in%'],
+    'g2-custom': ['G2 Custom Instance Ram running in%'],
+    'g2-cud-1y': ['Commitment v1: G2 Ram in%', '%for 1 Year'],
+    'g2-cud-3y': ['Commitment v1: G2 Ram in%', '%for 3 Years'],
+    'n1-predefined': ['N1 Predefined Instance Ram running in%'],
+    'n1-custom': ['Custom Instance Ram running in%'],
+    'n1-cud-1y': ['Commitment v1: Ram in%', '%for 1 Year'],
+    'n1-cud-3y': ['Commitment v1: Ram in%', '%for 3 Year'],
+    'n2-predefined': ['N2 Instance Ram running in%'],
+    'n2-custom': ['N2 Custom Instance Ram running in%'],
+    'n2-cud-1y': ['Commitment v1: N2 Ram in%', '%for 1 Year'],
+    'n2-cud-3y': ['Commitment v1: N2 Ram in%', '%for 3 Year'],
+    'n2d-predefined': ['N2D AMD Instance Ram running in%'],
+    'n2d-custom': ['N2D AMD Custom Instance Ram running in%'],
+    'n2d-cud-1y': ['Commitment v1: N2D AMD Ram in%', '%for 1 Year'],
+    'n2d-cud-3y': ['Commitment v1: N2D AMD Ram in%', '%for 3 Year'],
+    'c2-predefined': ['Compute optimized Ram running in%'],
+    'c2-cud-1y': ['Commitment: Compute optimized Ram running in%', '%for 1 Year'],
+    'c2-cud-3y': ['Commitment: Compute optimized Ram running in%', '%for 3 Year'],
+    'c3-predefined': ['C3 Instance Ram running in%'],
+    'c3-cud-1y': ['Commitment v1: C3 Ram in%', '%for 1 Year'],
+    'c3-cud-3y': ['Commitment v1: C3 Ram in%', '%for 3 Years'],
+    'c3d-predefined': ['C3D Instance Ram running in%'],
+    'c3d-cud-1y': ['Commitment v1: C3D Ram in%', '%for 1 Year'],
+    'c3d-cud-3y': ['Commitment v1: C3D Ram in%', '%for 3 Years'],
+    'g4-predefined': ['G4 Instance Ram running in%'],
+    'g4-cud-1y': ['Commitment v1: G4 Ram in%', '%for 1 Year'],
+    'g4-cud-3y': ['Commitment v1: G4 Ram in%', '%for 3 Years'],
+    'c4-predefined': ['C4 Instance Ram running in%'],
+    'c4-cud-1y': ['Commitment v1: C4 Ram in%', '%for 1 Year'],
+    'c4-cud-3y': ['Commitment v1: C4 Ram in%', '%for 3 Years'],
+    'c4d-predefined': ['C4D Instance Ram running in%'],
+    'c4d-cud-1y': ['Commitment v1: C4D Ram in%', '%for 1 Year'],
+    'c4d-cud-3y': ['Commitment v1: C4D Ram in%', '%for 3 Years'],
+    'z3-predefined': ['Z3 Instance Ram running in%'],
+    'z3-cud-1y': ['Commitment v1: Z3 Ram in%', '%for 1 Year'],
+    'z3-cud-3y': ['Commitment v1: Z3 Ram in%', '%for 3 Years'],
+}
+
+filtering_gpu_dict = {
+    'nvidia-tesla-a100': ['Nvidia Tesla A100 GPU running in%'],
+    'nvidia-tesla-a100-cud-1y': ['Commitment v1: Nvidia Tesla A100 GPU running in%', '%for 1 Year'],
+    'nvidia-tesla-a100-cud-3y': ['Commitment v1: Nvidia Tesla A100 GPU running in%', '%for 3 Year'],
+    'nvidia-tesla-t4': ['Nvidia Tesla T4 GPU running in%'],
+    'nvidia-tesla-t4-cud-1y': ['Commitment v1: Nvidia Tesla T4 GPU running in%', '%for 1 Year'],
+    'nvidia-tesla-t4-cud-3y': ['Commitment v1: Nvidia Tesla T4 GPU running in%', '%for 3 Year'],
+    'nvidia-l4': ['Nvidia L4 GPU running in%'],
+    'nvidia-l4-cud-1y': ['Commitment v1: Nvidia L4 GPU running in%', '%for 1 Year'],
+    'nvidia-l4-cud-3y': ['Commitment v1: Nvidia L4 GPU running in%', '%for 3 Years'],
+    'nvidia-h100-80gb': ['Nvidia H100 80GB GPU running in%'],
+    'nvidia-h100-80gb-cud-1y': ['Commitment v1: Nvidia H100 80GB GPU running in%', '%for 1 Year'],
+    'nvidia-h100-80gb-cud-3y': ['Commitment v1: Nvidia H100 80GB GPU running in%', '%for 3 Years'],
+    'nvidia-h100-mega-80gb': ['Reserved Nvidia H100 80GB Mega GPU in%'],
+    'nvidia-h100-mega-80gb-cud-1y': ['Commitment v1: Nvidia H100 80GB Mega GPU running in%', '%for 1 Year'],
+    'nvidia-h100-mega-80gb-cud-3y': ['Commitment v1: Nvidia H100 80GB Mega GPU running in%', '%for 3 Years'],
+    'nvidia-rtx-pro-6000': ['RTX 6000 96GB running in%'],
+    'nvidia-rtx-pro-6000-cud-1y': ['Commitment v1: RTX 6000 96GB running in%', '%for 1 Year'],
+    'nvidia-rtx-pro-6000-cud-3y': ['Commitment v1: RTX 6000 96GB running in%', '%for 3 Years'],
+    'nvidia-b200': ['A4 Nvidia B200 (1 gpu slice) running in%'],
+    'nvidia-b200-cud-1y': ['Commitment v1: A4 Nvidia B200 (1 gpu slice) in%', '%for 1 Year'],
+    'nvidia-b200-cud-3y': ['Commitment v1: A4 Nvidia B200 (1 gpu slice) in%', '%for 3 Year%'],
+}
+
+filtering_disk_dict = {
+    'local-ssd': ["SSD backed Local Storage' or sku.description like 'SSD backed Local Storage in%"],
+    'local-ssd-cud-1y': ['Commitment v1: Local SSD in%', '%for 1 Year'],
+    'local-ssd-cud-3y': ['Commitment v1: Local SSD in%', '%for 3 Year'],
+    'pd-ssd': ["SSD backed PD Capacity' or sku.description like 'SSD backed PD Capacity in%"],
+    'pd-balanced': ["Balanced PD Capacity' or sku.description like 'Balanced PD Capacity in%"],
+    'pd-standard': ["Storage PD Capacity' or sku.description like 'Storage PD Capacity in%"],
+    'pd-custom': ["Efficient Storage PD Capacity in%"]
+}
+
+filtering_nat_dict = {
+    'nat-data': ['NAT Gateway: Data processing charge in%']
+}
+
+
+# The disk filters smuggle an OR into the LIKE string of the former per-filter query,
+# each such pattern is a list of alternatives.
+LIKE_ALTERNATIVE_SEPARATOR = "' or sku.description like '"
+
+
+def get_bq_pricing_sku_list(partition_date: str, client: bigquery.Client = None) -> json:
+    """
+    Retrieve all COMPUTE ENGINE SKUs of one partition of the pricing table with a single query.
+    All filters are then evaluated locally, see filter_sku_list.
+
+    :param partition_date: (str) partition to read, e.g. 2025-06-30
+    :return: list of {'id', 'description', 'regions'} ordered by id
+    """
+    pricing_query = f'''
+        SELECT {SKU_COLUMNS}
+        FROM `{PRICING_TABLE}` 
+        WHERE 
+        DATE(_PARTITIONTIME) = @partition_date
+        AND service.id='6F81-5844-456A' 
+        ORDER BY sku.id
+    '''
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter('partition_date', 'DATE', partition_date)]
+    )
+
+    client = client or bigquery.Client()
+    query_job = client.query(pricing_query, job_config=job_config)
+
+    results = query_job.result()  # Waits for job to complete.
+
+    json_obj = [dict(row) for row in results]
+    return json_obj
+
+
+def sku_row_key(row: dict) -> tuple:
+    """
+    :return: identity of a SKU row, rows sharing a SKU id but not their description or regions are distinct.
+    """
+    return row['id'], row['description'], tuple(row['regions'] or [])
+
+
+def diff_sku_lists(previous_sku_list: json, sku_list: json) -> json:
+    """
+    Compare two SKU lists of get_bq_pricing_sku_list locally, e.g. the one saved by the last run with the latest.
+
+    :return: list of {'id', 'description', 'regions', 'removed'}, one per row only in one of the lists.
+    """
+    previous_keys = collections.Counter(sku_row_key(row) for row in previous_sku_list)
+    keys = collections.Counter(sku_row_key(row) for row in sku_list)
+    changes = []
+    for (sku_id, description, regions), count in sorted((keys - previous_keys).items()):
+        changes.extend([{'id': sku_id, 'description': description, 'regions': list(regions), 'removed': False}] * count)
+    for (sku_id, description, regions), count in sorted((previous_keys - keys).items()):
+        changes.extend([{'id': sku_id, 'description': description, 'regions': list(regions), 'removed': True}] * count)
+    return changes
+
+
+def like_to_regex(pattern: str) -> re.Pattern:
+    """
+    Translate a SQL LIKE pattern into an equivalent (case sensitive, whole string) regular expression.
+    """
+    regex = ''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern
+    )
+    return re.compile(regex, re.DOTALL)
+
+
+class SkuIndex(object):
+    def __init__(self, json_obj: json):
+        """
+        SKU rows sorted by description, so that a LIKE pattern with a literal prefix only has to be
+        matched against the rows sharing that prefix.
+        """
+        self.json_obj = json_obj
+        order = sorted(range(len(json_obj)), key=lambda position: json_obj[position]['description'])
+        self.sorted_positions = order
+        self.sorted_descriptions = [json_obj[position]['description'] for position in order]
+
+    def like(self, pattern: str) -> set:
+        """
+        :return: positions of the rows whose description is LIKE the pattern.
+        """
+        prefix = re.split('[%_]', pattern, maxsplit=1)[0]
+        start = bisect.bisect_left(self.sorted_descriptions, prefix)
+        end = bisect.bisect_right(self.sorted_descriptions, prefix + '\U0010ffff', lo=start) if prefix else \
+            len(self.sorted_descriptions)
+        regex = like_to_regex(pattern)
+        return {self.sorted_positions[i] for i in range(start, end) if regex.fullmatch(self.sorted_descriptions[i])}
+
+
+def filter_sku_list(sku_index: SkuIndex, filter_str: [str]) -> json:
+    """
+    :param filter_str: LIKE patterns on sku.description which must all match,
+        e.g. ['Commitment v1: E2 Cpu in%', '%for 1 Year']
+    :return: matching rows, in the order of the query result.
+    """
+    if not filter_str or len(filter_str) == 0:
+        return None
+
+    # like the former per-filter query, only the first and the last pattern are applied
+    positions = None
+    for pattern in (filter_str[0], filter_str[-1]):
+        matched = set()
+        for alternative in pattern.split(LIKE_ALTERNATIVE_SEPARATOR):
+            matched |= sku_index.like(alternative)
+        positions = matched if positions is None else positions & matched
+    return [sku_index.json_obj[position] for position in sorted(positions)]
+
+
+def region_to_sku(json_obj: json) -> dict:
+    result_dict = {}
+    for item in json_obj:
+        # for skus of warsaw will need special care
+        if 'Warsaw' in item['description']:
+            # result_dict['europe-central2'] = item['description']
+            result_dict['europe-central2'] = item['id']
+            continue
+        for region in item['regions']:
+            # result_dict[region] = item['description']
+            result_dict[region] = item['id']
+    return result_dict
+
+
+def gen_yaml_data(filter_dict: {}, sku_index: SkuIndex) -> json:
+    yaml_data = {}
+    for cost_type in filter_dict:
+        json_obj = filter_sku_list(sku_index, filter_dict[cost_type])
+        yaml_data[cost_type] = region_to_sku(json_obj)
+    return yaml_data
+
+
+SKU_YAML_FILES = [
+    ('conf/sku_cpu.yaml', filtering_cpu_dict),
+    ('conf/sku_ram.yaml', filtering_ram_dict),
+    ('conf/sku_gpu.yaml', filtering_gpu_dict),
+    ('conf/sku_nat.yaml', filtering_nat_dict),
+    ('conf/sku_disk.yaml', filtering_disk_dict),
+]
+
+
+def dump_yaml(yaml_data: dict) -> str:
+    return yaml.dump(yaml_data, default_flow_style=False, allow_unicode=False)
+
+
+def diff_yaml_data(file_name: str, old_yaml_data: dict, yaml_data: dict) -> [dict]:
+    """
+    :return: one {'file', 'key', 'region', 'change', 'old_sku', 'new_sku'} per mapping which was
+        added, removed or remapped to another SKU.
+    """
+    changes = []
+    for key in sorted(set(old_yaml_data) | set(yaml_data)):
+        old_regions = old_yaml_data.get(key) or {}
+        regions = yaml_data.get(key) or {}
+        for region in sorted(set(old_regions) | set(regions)):
+            old_sku, new_sku = old_regions.get(region), regions.get(region)
+            if old_sku == new_sku:
+                continue
+            change = 'added' if old_sku is None else 'removed' if new_sku is None else 'remapped'
+            changes.append({
+                'file': file_name, 'key': key, 'region': region, 'change': change,
+                'old_sku': old_sku, 'new_sku': new_sku,
+            })
+    return changes
+
+
+def load_state(state_file: str):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as infile:
+        return json.load(infile)
+
+
+def save_state(state_file: str, partition_date: str, sku_list: json, yaml_hashes: dict) -> None:
+    tmp_file = f'{state_file}.tmp'
+    with open(tmp_file, 'w') as outfile:
+        json.dump({'partition_date': partition_date, 'yaml_hashes': yaml_hashes, 'sku_list': sku_list}, outfile)
+    os.replace(tmp_file, state_file)
+
+
+def process_args(args: [str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python3 gen_sku_yaml.py',
+        description='To generate conf/sku_*.yaml from the latest partition of the pricing table.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip the pricing table if its partition did not change since the last run, '
+                             'rewrite only the yaml files whose content changed and print the changes as json')
+    parser.add_argument('--state', type=str, default=STATE_FILE,
+                        help=f'state file of the last run, default is {STATE_FILE}')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    namespace = process_args(sys.argv[1::])
+
+    client = bigquery.Client()
+    partition_date = latest_partition_date(PRICING_TABLE, client)
+    state = load_state(namespace.state) if namespace.incremental else None
+
+    if state is None:
+        # one scan of the pricing table for all five yaml files
+        sku_list = get_bq_pricing_sku_list(partition_date, client)
+        changed_skus = len(sku_list)
+    elif state['partition_date'] == partition_date:
+        # nothing new, no query at all
+        sku_list = state['sku_list']
+        changed_skus = 0
+    else:
+        # one scan of the latest partition, compared with the SKU list of the last run locally
+        sku_list = get_bq_pricing_sku_list(partition_date, client)
+        changed_skus = len(diff_sku_lists(state['sku_list'], sku_list))
+
+    report = {
+        'previous_partition_date': state['partition_date'] if state else None,
+        'partition_date': partition_date,
+        'changed_skus': changed_skus,
+        'changes': [],
+    }
+    old_hashes = state['yaml_hashes'] if state else {}
+    yaml_hashes = {}
+    sku_index = SkuIndex(sku_list)
+    for file_name, filter_dict in SKU_YAML_FILES:
+        yaml_data = gen_yaml_data(filter_dict, sku_index)
+        content = dump_yaml(yaml_data)
+        yaml_hashes[file_name] = hashlib.sha1(content.encode('utf8')).hexdigest()
+        if yaml_hashes[file_name] == old_hashes.get(file_name) and os.path.exists(file_name):
+            continue
+
+        if os.path.exists(file_name):
+            with io.open(file_name, 'r', encoding='utf8') as infile:
+                old_yaml_data = yaml.safe_load(infile) or {}
+        else:
+            old_yaml_data = {}
+        report['changes'].extend(diff_yaml_data(file_name, old_yaml_data, yaml_data))
+        with io.open(file_name, 'w', encoding='utf8') as outfile:
+            outfile.write(content)
+
+    save_state(namespace.state, partition_date, sku_list, yaml_hashes)
+
+    # precompiled catalog, lib.sku_catalog.get_catalog loads it instead of parsing the yaml files above.
+    write_compiled_catalog()
+
+    if namespace.incremental:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,269 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import numpy as np
+
+from .instance import Instance, TOTAL_HOURS
+
+# price tiers in the order of Instance.price_result_in_json
+TIERS = ('ondemand', '1cud', '3cud')
+# (is_cud_3y, is_cud_1y) of each tier
+TIER_FLAGS = ((False, False), (False, True), (True, False))
+# price columns, list price and account price
+PRICE_TYPES = ('list_price', 'account_price')
+
+CONFIDENTIAL_CPU_SKU = 'E5BD-12DD-EB30'
+CONFIDENTIAL_RAM_SKU = '3999-11C3-1EE4'
+
+# resolved SKU components of one (instance, region, tier)
+_CPU, _RAM, _GPU, _BOOT_DISK, _LOCAL_SSD = range(5)
+
+
+class BatchPriceResult(object):
+    def __init__(self, instances: [Instance], regions: [str], prices: np.ndarray, errors: dict):
+        """
+        :param instances: the N priced instances.
+        :param regions: the M regions they are priced in.
+        :param prices: (N, M, len(TIERS), len(PRICE_TYPES)) array of monthly prices, NaN where pricing failed.
+        :param errors: (instance index, region index) --> exception raised while pricing it.
+        """
+        self.instances = instances
+        self.regions = regions
+        self.prices = prices
+        self.errors = errors
+
+    def result_in_json(self, i: int, j: int) -> dict:
+        """
+        :return: pricing of instances[i] in regions[j], in the format of Instance.price_result_in_json.
+            Raises the exception the scalar path would have raised if it could not be priced.
+        """
+        error = self.errors.get((i, j))
+        if error is not None:
+            raise error
+
+        instance = self.instances[i]
+        result = {}
+        for t, tier in enumerate(TIERS):
+            result[tier] = {
+                price_type: round(float(self.prices[i, j, t, p]), 2) for p, price_type in enumerate(PRICE_TYPES)
+            }
+        result['region'] = self.regions[j]
+        result['instance_type'] = instance.machine_definition
+        result['disk_type'] = instance.disk_type.disk_definition
+        result['calculation_period'] = 'monthly (based on 730 hours)'
+        return result
+
+
+class BatchPricer(object):
+    def __init__(self,
+                 list_price_dict: dict,
+                 final_price_dict: dict,
+                 sku_cpu_dict: dict,
+                 sku_ram_dict: dict,
+                 sku_gpu_dict: dict,
+                 sku_disk_dict: dict,
+                 ):
+        """
+        Prices N instances x M regions at once with numpy, see Instance.price_result_in_json for the parameters.
+        SKU_IDs are resolved once per distinct (machine family, gpu, disk) shape and region into integer indices
+        of the price vectors, the fees are then computed with array operations in the same order as the
+        scalar cpu_fee/ram_fee/gpu_fee/disk_fee path, so the results are identical.
+        """
+        self.list_price_dict = list_price_dict
+        self.final_price_dict = final_price_dict
+        self.sku_cpu_dict = sku_cpu_dict
+        self.sku_ram_dict = sku_ram_dict
+        self.sku_gpu_dict = sku_gpu_dict
+        self.sku_disk_dict = sku_disk_dict
+
+        # index 0 stands for "no SKU", its price is 0 like price_dict.get(None, 0)
+        self._skus = [None]
+        self._sku_index = {}
+
+    def price(self, instances: [Instance], regions: [str]) -> BatchPriceResult:
+        n, m = len(instances), len(regions)
+        errors = {}
+
+        # quantities of each instance: cpu, ram (GB), gpu, boot disk (GB), local ssd (GB), is_confidential
+        quantities = np.zeros((n, 6), dtype=np.float64)
+        shapes = {}
+        shape_of_instance = np.zeros(n, dtype=np.intp)
+        representatives = []
+        for i, instance in enumerate(instances):
+            try:
+                shape = self._shape(instance)
+                quantities[i] = self._quantities(instance)
+            except Exception as e:
+                for j in range(m):
+                    errors[(i, j)] = e
+                continue
+            if shape not in shapes:
+                shapes[shape] = len(representatives)
+                representatives.append(instance)
+            shape_of_instance[i] = shapes[shape]
+        if not representatives:
+            # every instance failed, or there is none, only the errors are left to report
+            prices = np.full((n, m, len(TIERS), len(PRICE_TYPES)), np.nan, dtype=np.float64)
+            return BatchPriceResult(instances, regions, prices, errors)
+
+        # SKU indices of every (shape, region, tier, component)
+        resolved = np.zeros((len(representatives), m, len(TIERS), 5), dtype=np.intp)
+        shape_errors = {}
+        for s, instance in enumerate(representatives):
+            for j, region in enumerate(regions):
+                try:
+                    resolved[s, j] = self._resolve(instance, region)
+                except Exception as e:
+                    shape_errors[(s, j)] = e
+        for i in range(n):
+            for j in range(m):
+                if (i, j) not in errors and (shape_of_instance[i], j) in shape_errors:
+                    errors[(i, j)] = shape_errors[(shape_of_instance[i], j)]
+
+        indices = resolved[shape_of_instance]
+        cpu_no = quantities[:, 0, None, None]
+        ram_gb = quantities[:, 1, None, None]
+        gpu_no = quantities[:, 2, None, None]
+        boot_disk_size = quantities[:, 3, None, None]
+        localssd_size = quantities[:, 4, None, None]
+        is_confidential = quantities[:, 5] > 0
+
+        prices = np.empty((n, m, len(TIERS), len(PRICE_TYPES)), dtype=np.float64)
+        for p, price_dict in enumerate((self.list_price_dict, self.final_price_dict)):
+            vector = np.array([price_dict.get(sku_id, 0) for sku_id in self._skus], dtype=np.float64)
+            cpu_fee = vector[indices[..., _CPU]] * cpu_no * TOTAL_HOURS
+            ram_fee = vector[indices[..., _RAM]] * ram_gb * TOTAL_HOURS
+            gpu_fee = vector[indices[..., _GPU]] * gpu_no * TOTAL_HOURS
+            disk_fee = vector[indices[..., _LOCAL_SSD]] * localssd_size + \
+                vector[indices[..., _BOOT_DISK]] * boot_disk_size
+            total = cpu_fee + ram_fee + gpu_fee + disk_fee
+
+            if is_confidential.any() and CONFIDENTIAL_CPU_SKU in price_dict and CONFIDENTIAL_RAM_SKU in price_dict:
+                conf_fee = price_dict[CONFIDENTIAL_CPU_SKU] * TOTAL_HOURS * quantities[:, 0] + \
+                    price_dict[CONFIDENTIAL_RAM_SKU] * TOTAL_HOURS * quantities[:, 1]
+                conf_fee = np.where(is_confidential, conf_fee, 0.0)[:, None]
+                # confidential computing is charged on demand and with 3-year CUD only
+                total[:, :, 0] += conf_fee
+                total[:, :, 2] += conf_fee
+            prices[..., p] = total
+
+        for i, j in errors:
+            prices[i, j] = np.nan
+        return BatchPriceResult(instances, regions, prices, errors)
+
+    def _index(self, sku_id: str) -> int:
+        if not sku_id:
+            return 0
+        index = self._sku_index.get(sku_id)
+        if index is None:
+            index = len(self._skus)
+            self._sku_index[sku_id] = index
+            self._skus.append(sku_id)
+        return index
+
+    @staticmethod
+    def _shape(instance: Instance) -> tuple:
+        """
+        Everything of an instance that decides which SKUs it is charged for.
+        """
+        return (
+            instance.machine_type.cpu_ram_type,
+            instance.machine_type.is_custom,
+            instance.gpu_type.gpu_type if instance.has_gpu else None,
+            instance.disk_type.boot_disk_type,
+            instance.disk_type.has_localssd,
+            instance.is_confidential,
+        )
+
+    @staticmethod
+    def _quantities(instance: Instance) -> tuple:
+        return (
+            instance.machine_type.cpu_no,
+            instance.machine_type.ram_gb,
+            instance.gpu_type.gpu_no if instance.has_gpu else 0,
+            instance.disk_type.boot_disk_size,
+            instance.disk_type.localssd_size if instance.disk_type.has_localssd else 0,
+            1 if instance.is_confidential else 0,
+        )
+
+    def _resolve(self, instance: Instance, region: str) -> list:
+        """
+        :return: SKU indices of [tier][component] of the instance in the region.
+            Raises the same exceptions as cpu_fee/ram_fee/gpu_fee/disk_fee, in the same order.
+        """
+        cpu_ram_type = instance.machine_type.cpu_ram_type
+        resolved = []
+        for is_cud_3y, is_cud_1y in TIER_FLAGS:
+            if is_cud_3y:
+                cpu_ram_key = f'{cpu_ram_type}-cud-3y'
+            elif is_cud_1y:
+                cpu_ram_key = f'{cpu_ram_type}-cud-1y'
+            elif instance.machine_type.is_custom:
+                cpu_ram_key = f'{cpu_ram_type}-custom'
+            else:
+                cpu_ram_key = f'{cpu_ram_type}-predefined'
+            cpu_sku_id = self.sku_cpu_dict[cpu_ram_key][region]
+            ram_sku_id = self.sku_ram_dict[cpu_ram_key][region]
+
+            gpu_sku_id = None
+            if instance.has_gpu:
+                if is_cud_3y:
+                    gpu_key = f'{instance.gpu_type.gpu_type}-cud-3y'
+                elif is_cud_1y:
+                    gpu_key = f'{instance.gpu_type.gpu_type}-cud-1y'
+                else:
+                    gpu_key = instance.gpu_type.gpu_type
+                gpu_sku_id = self.sku_gpu_dict[gpu_key][region]
+                if not gpu_sku_id:
+                    raise Exception(
+                        f'There is no {gpu_key} under {region}, please double check.')
+
+            boot_disk_key = f'{instance.disk_type.boot_disk_type}'
+            boot_disk_sku_id = self.sku_disk_dict[boot_disk_key][region]
+            if not boot_disk_sku_id:
+                raise Exception(
+                    f'There is no {boot_disk_key} under {region}, please double check.')
+
+            local_ssd_sku_id = None
+            if instance.disk_type.has_localssd:
+                if is_cud_3y:
+                    local_ssd_key = 'local-ssd-cud-3y'
+                elif is_cud_1y:
+                    local_ssd_key = 'local-ssd-cud-1y'
+                else:
+                    local_ssd_key = 'local-ssd'
+                local_ssd_sku_id = self.sku_disk_dict[local_ssd_key][region]
+
+            resolved.append([
+                self._index(cpu_sku_id),
+                self._index(ram_sku_id),
+                self._index(gpu_sku_id),
+                self._index(boot_disk_sku_id),
+                self._index(local_ssd_sku_id),
+            ])
+
+        if instance.is_confidential:
+            # KeyError if the confidential computing SKUs are not priced, like the scalar path
+            for sku_id in (CONFIDENTIAL_CPU_SKU, CONFIDENTIAL_RAM_SKU):
+                self.list_price_dict[sku_id]
+                self.final_price_dict[sku_id]
+        return resolved
+
+
+def price_instances(instances: [Instance],
+                    regions: [str],
+                    list_price_dict: dict,
+                    final_price_dict: dict,
+                    sku_cpu_dict: dict,
+                    sku_ram_dict: dict,
+                    sku_gpu_dict: dict,
+                    sku_disk_dict: dict,
+                    ) -> BatchPriceResult:
+    """
+    Price every instance in every region, see BatchPricer.
+
+    :return: BatchPriceResult
+    """
+    pricer = BatchPricer(list_price_dict, final_price_dict, sku_cpu_dict, sku_ram_dict, sku_gpu_dict, sku_disk_dict)
+    return pricer.price(instances, regions)
@@ -0,0 +1,132 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from google.cloud import compute_v1
+
+from .sku_catalog import CONF_DIR
+
+# next to the other local artifacts, not in a directory other users can write to.
+MACHINE_TYPE_CATALOG_DIR = os.environ.get('MACHINE_TYPE_CATALOG_DIR', CONF_DIR)
+# machine types only change when a new family or region launches, a day is fresh enough.
+MACHINE_TYPE_CATALOG_TTL_SECONDS = int(os.environ.get('MACHINE_TYPE_CATALOG_TTL_SECONDS', 86400))
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def fetch_machine_types(project_id: str, client=None) -> dict:
+    """
+    Retrieves every machine type of every zone with one aggregated_list sweep of the Compute Engine API.
+
+    :param project_id: The GCP project ID.
+    :param client: compute_v1.MachineTypesClient, or any object with the same aggregated_list method.
+    :return: machine type name --> (family, cpus, memory in GB), deduplicated across zones.
+    """
+    client = client or compute_v1.MachineTypesClient()
+    request = compute_v1.AggregatedListMachineTypesRequest(project=project_id)
+
+    machine_types = {}
+    # The aggregated_list method returns an iterator of (zone, MachineTypesScopedList) tuples.
+    for _, response in client.aggregated_list(request=request):
+        for machine_type in response.machine_types:
+            if machine_type.name in machine_types:
+                continue
+            machine_types[machine_type.name] = (
+                machine_type.name.split('-')[0],
+                machine_type.guest_cpus,
+                machine_type.memory_mb / 1024.0
+            )
+    logging.info(f'{len(machine_types)} machine types fetched from project {project_id}.')
+    return machine_types
+
+
+class MachineTypeCatalog(object):
+    def __init__(self,
+                 project_id: str,
+                 cache_dir: str = MACHINE_TYPE_CATALOG_DIR,
+                 ttl_seconds: int = MACHINE_TYPE_CATALOG_TTL_SECONDS,
+                 client_factory=None):
+        """
+        All predefined machine types of a project, fetched once and persisted locally for ttl_seconds.
+
+        :param project_id: The GCP project ID.
+        :param cache_dir: (str) directory of the persisted catalog, None to keep it in memory only.
+        :param ttl_seconds: (int) age after which the catalog is fetched again.
+        :param client_factory: callable returning a compute_v1.MachineTypesClient,
+            tests can pass a fake client here to stay offline.
+        """
+        self.project_id = project_id
+        self.cache_path = os.path.join(cache_dir, f'machine_types_{project_id}.json') if cache_dir else None
+        self.ttl_seconds = ttl_seconds
+        self.client_factory = client_factory or compute_v1.MachineTypesClient
+        self.machine_types = None
+        self.fetched_at = None
+        self._lock = threading.Lock()
+
+    def lookup(self, machine_type_name: str) -> tuple:
+        """
+        :return: (family, cpus, memory in GB) of the machine type, or None if the project has no such machine type.
+        """
+        if self._expired():
+            with self._lock:
+                if self._expired():
+                    self._load()
+        return self.machine_types.get(machine_type_name)
+
+    def _expired(self) -> bool:
+        return self.fetched_at is None or time.time() - self.fetched_at >= self.ttl_seconds
+
+    def _load(self) -> None:
+        if self._read_disk():
+            return
+        self.machine_types = fetch_machine_types(self.project_id, self.client_factory())
+        self.fetched_at = time.time()
+        self._write_disk()
+
+    def _read_disk(self) -> bool:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                cached = json.load(cache_file)
+            fetched_at = cached['fetched_at']
+            if time.time() - fetched_at >= self.ttl_seconds:
+                return False
+            machine_types = {name: tuple(details) for name, details in cached['machine_types'].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # a cache file of another format is a miss, it is overwritten by the next fetch
+            logging.warning(f'Failed to read machine type catalog {self.cache_path}: {e}')
+            return False
+        self.machine_types = machine_types
+        self.fetched_at = fetched_at
+        return True
+
+    def _write_disk(self) -> None:
+        if not self.cache_path:
+            return
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'fetched_at': self.fetched_at, 'machine_types': self.machine_types}, cache_file)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.warning(f'Failed to write machine type catalog {self.cache_path}: {e}')
+
+
+def get_machine_type_catalog(project_id: str) -> MachineTypeCatalog:
+    """
+    :return: the process-wide MachineTypeCatalog of project_id.
+    """
+    with _catalogs_lock:
+        catalog = _catalogs.get(project_id)
+        if catalog is None:
+            catalog = MachineTypeCatalog(project_id)
+            _catalogs[project_id] = catalog
+    return catalog
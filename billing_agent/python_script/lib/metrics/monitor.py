@@ -0,0 +1,279 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.cloud import monitoring_v3
+from pytz import timezone
+
+# record field --> NAT metric type
+NAT_METRICS = {
+    'received_bytes_count': 'compute.googleapis.com/nat/received_bytes_count',
+    'sent_bytes_count': 'compute.googleapis.com/nat/sent_bytes_count',
+}
+# projects x metrics fetched at the same time, all through one shared client
+MAX_CONCURRENT_REQUESTS = 16
+# usage dates of the NAT report are days of this timezone, like usage_date of the billing export
+NAT_TIMEZONE = 'PST8PDT'
+NAT_GROUP_BY_FIELDS = [
+    'metric.nat_gateway_name',
+    'resource.project_id',
+    'metadata.user_labels.inner_ip',
+    'metadata.user_labels.psm',
+    'metadata.system_labels.region',
+    'metadata.user_labels.instance_name',
+]
+
+
+def day_start(day: datetime.date) -> datetime.datetime:
+    """
+    :return: 00:00:00 of the day in NAT_TIMEZONE, DST aware.
+    """
+    return timezone(NAT_TIMEZONE).localize(datetime.datetime.combine(day, datetime.time()))
+
+
+def nat_day_segments(start_date: str, end_date: str) -> [tuple]:
+    """
+    Split the days from start_date to end_date (both included) into runs of days of the same length.
+    Monitoring alignment periods have a fixed duration, so a day made of 23 or 25 hours by a DST switch
+    needs its own alignment period to keep the points on local day boundaries.
+
+    :param start_date: (str) e.g. 2022-01-01
+    :param end_date: (str) e.g. 2022-01-31
+    :return: list of (first day, last day, day length in seconds)
+    """
+    first = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+    last = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    if last < first:
+        raise ValueError(f'end_date {end_date} is before start_date {start_date}.')
+
+    segments = []
+    day = first
+    while day <= last:
+        next_day = day + datetime.timedelta(days=1)
+        seconds = int((day_start(next_day) - day_start(day)).total_seconds())
+        if segments and segments[-1][2] == seconds and segments[-1][1] + datetime.timedelta(days=1) == day:
+            segments[-1] = (segments[-1][0], day, seconds)
+        else:
+            segments.append((day, day, seconds))
+        day = next_day
+    return segments
+
+
+def nat_interval(first: datetime.date, last: datetime.date) -> monitoring_v3.TimeInterval:
+    """
+    :return: interval from 00:00:00 of first to 00:00:00 of the day after last.
+    """
+    start_ts = day_start(first).timestamp()
+    end_ts = day_start(last + datetime.timedelta(days=1)).timestamp()
+    return monitoring_v3.TimeInterval(
+        {
+            "end_time": {"seconds": int(end_ts), "nanos": 0},
+            "start_time": {"seconds": int(start_ts), "nanos": 0},
+        }
+    )
+
+
+def nat_aggregation(alignment_seconds: int) -> monitoring_v3.Aggregation:
+    """
+    :return: aggregation giving one point per alignment period (a day), summed over the period,
+        grouped by project_id, region, instance_name etc.
+    """
+    return monitoring_v3.Aggregation(
+        {
+            "alignment_period": {"seconds": alignment_seconds},
+            "per_series_aligner": monitoring_v3.Aggregation.Aligner.ALIGN_SUM,
+            "group_by_fields": NAT_GROUP_BY_FIELDS,
+            "cross_series_reducer": monitoring_v3.Aggregation.Reducer.REDUCE_SUM
+        }
+    )
+
+
+def nat_request(date_str: str, projects: [str], max_workers: int = MAX_CONCURRENT_REQUESTS) -> dict:
+    """
+    Collect the NAT received and sent bytes of all projects of one day, concurrently.
+
+    :param date_str: (str) e.g. 2022-01-01
+    :param projects: (list) project ids
+    :param max_workers: (int) number of list_time_series requests in flight.
+    :return: (gateway, region, psm, instance, ip) --> record with received_bytes_count and sent_bytes_count in GB.
+    """
+    return nat_request_range(date_str, date_str, projects, max_workers).get(date_str, {})
+
+
+def nat_request_range(start_date: str,
+                      end_date: str,
+                      projects: [str],
+                      max_workers: int = MAX_CONCURRENT_REQUESTS) -> dict:
+    """
+    Collect the NAT received and sent bytes of all projects of every day from start_date to end_date.
+    Each project and metric is requested once for the whole window with a daily alignment period,
+    the daily points are split back into per-day records while reading the pages.
+
+    :param start_date: (str) e.g. 2022-01-01
+    :param end_date: (str) e.g. 2022-01-31, included.
+    :param projects: (list) project ids
+    :param max_workers: (int) number of list_time_series requests in flight.
+    :return: usage date (str) --> (gateway, region, psm, instance, ip) --> record, see nat_request.
+    """
+    nat_result = {}
+    client = monitoring_v3.MetricServiceClient()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(nat_records_single_project, nat_interval(first, last), nat_aggregation(seconds),
+                            f'projects/{project}', field, (str(first), str(last)), client)
+            for first, last, seconds in nat_day_segments(start_date, end_date)
+            for project in projects
+            for field in NAT_METRICS
+        ]
+        # merge each (segment, project, metric) as soon as it is fetched
+        for future in as_completed(futures):
+            for key, record, field in future.result():
+                merge_nat_record(nat_result.setdefault(record['usage_date'], {}), key, record, field)
+    return nat_result
+
+
+def nat_record(timeseries: monitoring_v3.types.TimeSeries, field: str, point: monitoring_v3.types.Point
+               ) -> (tuple, dict):
+    """
+    :param point: the daily point of the time series to take.
+    :return: (key, record) of a NAT time series, the key is (gateway, region, psm, instance, ip).
+    """
+    record = {
+        "project_id": timeseries.resource.labels["project_id"],
+        "nat_gateway_name": timeseries.metric.labels["nat_gateway_name"],
+        "region": timeseries.metadata.system_labels.fields["region"].string_value,
+        "psm": timeseries.metadata.user_labels["psm"],
+        "instance_name": timeseries.metadata.user_labels["instance_name"],
+        "inner_ip": timeseries.metadata.user_labels["inner_ip"],
+        "received_bytes_count": 0,
+        "sent_bytes_count": 0,
+        "usage_date": str(point.interval.start_time.astimezone(timezone(NAT_TIMEZONE)).date())
+    }
+    record[field] = point.value.int64_value / pow(2, 30)
+    key = (
+        record["nat_gateway_name"],
+        record["region"],
+        record["psm"],
+        record["instance_name"],
+        record["inner_ip"],
+    )
+    return key, record
+
+
+def merge_nat_record(result: dict, key: tuple, record: dict, field: str) -> None:
+    """
+    Merge the received or sent bytes of a record into result, whichever of the two arrives first.
+    """
+    if key in result:
+        result[key][field] = record[field]
+    else:
+        result[key] = record
+
+
+def nat_records_single_project(interval: monitoring_v3.types.TimeInterval,
+                               aggregation: monitoring_v3.types.Aggregation,
+                               project: str,
+                               field: str,
+                               usage_dates: (str, str),
+                               client: monitoring_v3.MetricServiceClient = None) -> [tuple]:
+    """
+    :param field: received_bytes_count or sent_bytes_count, see NAT_METRICS.
+    :param usage_dates: (first, last) usage dates to keep, points of partial periods outside of them are dropped.
+    :return: list of (key, record, field) of every daily point of every time series of the project.
+    """
+    results = nat_metric_single_project(interval, aggregation, project, NAT_METRICS[field], client)
+    records = []
+    for page in results.pages:
+        for timeseries in page.time_series:
+            for point in timeseries.points:
+                key, record = nat_record(timeseries, field, point)
+                if usage_dates[0] <= record['usage_date'] <= usage_dates[1]:
+                    records.append((key, record, field))
+    return records
+
+
+def nat_metric_single_project(interval: monitoring_v3.types.TimeInterval,
+                              aggregation: monitoring_v3.types.Aggregation,
+                              project: str,
+                              metric_type: str,
+                              client: monitoring_v3.MetricServiceClient = None
+                              ) -> monitoring_v3.services.metric_service.pagers.ListTimeSeriesPager:
+    client = client or monitoring_v3.MetricServiceClient()
+    results = client.list_time_series(
+        request={
+            "name": project,
+            "filter": f"""
+                    metric.type = "{metric_type}" AND
+                    resource.type = "gce_instance" 
+                """,
+            "interval": interval,
+            "view": monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL,
+            "aggregation": aggregation,
+        }
+    )
+    return results
+
+
+def object_count(date_str: str, project: str, bucket_name: str) -> int:
+    project_name = f'projects/{project}'
+    datetime_pst8pdt = datetime.datetime.strptime(f'{date_str} 23:59:59', "%Y-%m-%d %H:%M:%S").replace(
+        tzinfo=timezone('PST8PDT'))
+    # print(datetime_pst8pdt.strftime("%Y-%m-%d %H:%M:%S %Z"))
+    # print(datetime_pst8pdt.timestamp())
+    ts = datetime_pst8pdt.timestamp()
+    seconds = int(ts)
+    nanos = int((ts - seconds) * 10 ** 9)
+
+    # result interval, end_time=start_time, there will be only 1 time series in result.
+    interval = monitoring_v3.TimeInterval(
+        {
+            "end_time": {"seconds": seconds, "nanos": nanos},
+            "start_time": {"seconds": seconds, "nanos": nanos},
+        }
+    )
+
+    # result aggregation, though there will be only 1 time series in result.
+    # the result value will be the SUM of past 1 day (86399 seconds)
+    # e.g. sum over 2022-01-01 00:00:00 PST to 2022-01-01 23:59:59 PST
+    # the result will be further grouped by project_id, region, instance_name etc.
+
+    aggregation = monitoring_v3.Aggregation(
+        {
+            "alignment_period": {"seconds": 86399},  # 1 day
+            "per_series_aligner": monitoring_v3.Aggregation.Aligner.ALIGN_MEAN,
+            "group_by_fields": [
+                'resource.project_id',
+                'metadata.user_labels.bucket_name',
+                'resource.location',
+                'metadata.user_labels.storage_class'
+            ],
+            "cross_series_reducer": monitoring_v3.Aggregation.Reducer.REDUCE_MEAN
+        }
+    )
+
+    client = monitoring_v3.MetricServiceClient()
+    results = client.list_time_series(
+        request={
+            "name": project_name,
+            "filter": f"""
+                metric.type = "storage.googleapis.com/storage/object_count" AND
+                resource.type = "gcs_bucket"  AND
+                metadata.user_labels.bucket_name = "{bucket_name}"
+            """,
+            "interval": interval,
+            "view": monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL,
+            "aggregation": aggregation,
+        }
+    )
+    for result in results.pages:
+        for timeseries in result.time_series:
+            time_series_dict = {
+                'bucket_name': timeseries.metadata.user_labels['bucket_name'],
+                'storage_class': timeseries.metadata.user_labels['storage_class'],
+                'region': timeseries.resource.labels['location'],
+                'object_count': timeseries.points[0].value.double_value
+            }
+            print(time_series_dict)
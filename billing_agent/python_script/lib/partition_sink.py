@@ -0,0 +1,136 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import abc
+import io
+import json
+import logging
+import uuid
+
+from google.cloud import bigquery
+
+
+def ndjson_buffer(rows) -> (io.BytesIO, int):
+    """
+    Serialize rows into an in-memory newline delimited json buffer.
+
+    :param rows: iterable of json serializable dicts.
+    :return: (buffer positioned at 0, number of rows)
+    """
+    buffer = io.BytesIO()
+    count = 0
+    for row in rows:
+        buffer.write(json.dumps(row).encode('utf8'))
+        buffer.write(b'\n')
+        count += 1
+    buffer.seek(0)
+    return buffer, count
+
+
+class PartitionSink(abc.ABC):
+    @abc.abstractmethod
+    def replace_partition(self, table_id: str, partition_date: str, rows) -> int:
+        """
+        Atomically replace the daily partition partition_date of table_id with rows.
+
+        :param table_id: (str) e.g. project.dataset.nat_details_v3, partitioned by day.
+        :param partition_date: (str) e.g. 2022-01-01
+        :param rows: iterable of dicts.
+        :return: number of rows written.
+        """
+
+    def replace_partitions(self, table_id: str, rows_by_date: dict, partition_field: str = 'usage_date') -> int:
+        """
+        Replace several daily partitions of table_id at once.
+
+        :param rows_by_date: partition date (str) --> iterable of dicts.
+        :param partition_field: (str) DATE column table_id is partitioned by.
+        :return: number of rows written.
+        """
+        return sum(self.replace_partition(table_id, partition_date, rows)
+                   for partition_date, rows in rows_by_date.items())
+
+
+class BigQueryPartitionSink(PartitionSink):
+    def __init__(self, client: bigquery.Client = None):
+        self.client = client
+
+    def replace_partition(self, table_id: str, partition_date: str, rows) -> int:
+        buffer, count = ndjson_buffer(rows)
+        client = self.client or bigquery.Client()
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            # with the partition decorator, WRITE_TRUNCATE swaps only that partition in a single job,
+            # the old rows stay visible until the new ones are committed.
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        partition = partition_date.replace('-', '')
+        load_job = client.load_table_from_file(
+            buffer,
+            f'{table_id}${partition}',
+            job_config=job_config,
+        )
+        load_job.result()  # Waits for the job to complete.
+        logging.info(f'{count} rows loaded into {table_id}${partition}.')
+        return count
+
+    def replace_partitions(self, table_id: str, rows_by_date: dict, partition_field: str = 'usage_date') -> int:
+        """
+        All days are loaded with one load job into a staging table,
+        then swapped into table_id by one DELETE + INSERT transaction.
+        Like replace_partition, a date with no rows ends up with an empty partition.
+        """
+        if not rows_by_date:
+            return 0
+        if len(rows_by_date) == 1:
+            (partition_date, rows), = rows_by_date.items()
+            return self.replace_partition(table_id, partition_date, rows)
+
+        buffer, count = ndjson_buffer(row for rows in rows_by_date.values() for row in rows)
+        client = self.client or bigquery.Client()
+        # every date of rows_by_date is emptied, whether it has staged rows or not
+        query_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter('partition_dates', 'DATE', sorted(rows_by_date))]
+        )
+        delete = f'DELETE FROM `{table_id}` WHERE {partition_field} IN UNNEST(@partition_dates);'
+        if not count:
+            client.query(delete, job_config=query_config).result()
+            logging.info(f'{len(rows_by_date)} days of {table_id} emptied.')
+            return 0
+
+        staging_table_id = f'{table_id}_staging_{uuid.uuid4().hex}'
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            schema=client.get_table(table_id).schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        try:
+            client.load_table_from_file(buffer, staging_table_id, job_config=job_config).result()
+            query = f"""
+BEGIN TRANSACTION;
+{delete}
+INSERT INTO `{table_id}` SELECT * FROM `{staging_table_id}`;
+COMMIT TRANSACTION;
+            """
+            client.query(query, job_config=query_config).result()
+        finally:
+            client.delete_table(staging_table_id, not_found_ok=True)
+        logging.info(f'{count} rows of {len(rows_by_date)} days loaded into {table_id}.')
+        return count
+
+
+class MemoryPartitionSink(PartitionSink):
+    def __init__(self):
+        """
+        Local stand-in of BigQueryPartitionSink, partitions are kept in memory as NDJSON lines.
+        """
+        self.partitions = {}
+
+    def replace_partition(self, table_id: str, partition_date: str, rows) -> int:
+        buffer, count = ndjson_buffer(rows)
+        self.partitions[(table_id, partition_date)] = buffer.getvalue().decode('utf8').splitlines()
+        return count
+
+    def rows(self, table_id: str, partition_date: str) -> [dict]:
+        return [json.loads(line) for line in self.partitions.get((table_id, partition_date), [])]
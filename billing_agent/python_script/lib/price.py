@@ -0,0 +1,321 @@
+import decimal
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from google.cloud import bigquery
+import datetime
+
+from .sku_catalog import CONF_DIR
+
+# next to the other local artifacts, not in a directory other users can write to.
+PRICE_SNAPSHOT_CACHE_PATH = os.environ.get('PRICE_SNAPSHOT_CACHE_PATH', os.path.join(CONF_DIR, 'price_snapshot.sqlite'))
+# The pricing export gets a new partition once a day, there is no point probing for it more often than this.
+PRICE_SNAPSHOT_PROBE_SECONDS = int(os.environ.get('PRICE_SNAPSHOT_PROBE_SECONDS', 600))
+
+
+def query_price_list(table_name: str, partition_date: str, client: bigquery.Client = None) -> dict:
+    """
+    This function is to request COMPUTE ENGINE pricing information of one partition from Bigquery pricing table.
+    It will retrieve all relevant pricing details for each SKU.
+
+    :param table_name: (str) Bigquery pricing table, e.g. project.dataset.cloud_pricing_export
+    :param partition_date: (str) partition to read, e.g. 2025-06-30
+    :return:
+    A dictionary where the key is SKU_ID, and value is a dictionary
+    containing list_prices, final_prices,
+    description, and pricing_unit.
+    """
+    pricing_query = f'''
+        SELECT
+            sku.id as sku_id,
+            sku.description as sku_description,
+            list_price,
+            billing_account_price,
+            date(export_time) as pricing_date
+        FROM `{table_name}`
+        WHERE
+        DATE(_PARTITIONTIME) = @partition_date
+        AND service.id in ('6F81-5844-456A','65DF-8A98-0834')
+    '''
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter('partition_date', 'DATE', partition_date)]
+    )
+
+    client = client or bigquery.Client()
+    query_job = client.query(pricing_query, job_config=job_config)
+    results = query_job.result()
+
+    all_prices = {}
+    for row in results:
+        list_price_details = dict(row.list_price) if row.list_price else {}
+        if 'tiered_rates' in list_price_details and list_price_details['tiered_rates']:
+            list_price_details['tiered_rates'] = [dict(rate) for rate in list_price_details['tiered_rates']]
+
+        final_price_details = dict(row.billing_account_price) if row.billing_account_price else {}
+        if 'tiered_rates' in final_price_details and final_price_details['tiered_rates']:
+            final_price_details['tiered_rates'] = [dict(rate) for rate in final_price_details['tiered_rates']]
+
+        all_prices[row.sku_id] = {
+            "description": row.sku_description,
+            "list_price_details": list_price_details,
+            "final_price_details": final_price_details,
+            "pricing_date": str(row.pricing_date),
+        }
+    logging.info(f"Pricing of {len(all_prices)} SKUs loaded from partition {partition_date}.")
+    return all_prices
+
+
+def latest_partition_date(table_name: str, client: bigquery.Client = None) -> str:
+    """
+    Metadata-only probe of the latest partition of the pricing table, it does not scan any table data.
+
+    :return: latest partition date, e.g. 2025-06-30, or None if the table has no partition.
+    """
+    client = client or bigquery.Client()
+    partition_ids = [partition_id for partition_id in client.list_partitions(table_name)
+                     if partition_id.isdigit()]
+    if not partition_ids:
+        return None
+    partition_id = max(partition_ids)
+    return f'{partition_id[0:4]}-{partition_id[4:6]}-{partition_id[6:8]}'
+
+
+def _encode_decimal(value):
+    # NUMERIC prices, e.g. usd_amount, are kept exact across the disk cache.
+    if isinstance(value, decimal.Decimal):
+        return {'__decimal__': str(value)}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode_decimal(obj: dict):
+    return decimal.Decimal(obj['__decimal__']) if obj.keys() == {'__decimal__'} else obj
+
+
+class PriceSnapshot(object):
+    def __init__(self, partition_date: str, all_prices: dict):
+        self.partition_date = partition_date
+        self.all_prices = all_prices
+        # We take the first price from the tiered rates for simplicity.
+        # The NUMERIC usd_amount is a Decimal, the unit prices are floats for the arithmetic and json of the callers.
+        self.list_price_dict = {k: float(v['list_price_details']['tiered_rates'][0]['usd_amount'])
+                                for k, v in all_prices.items() if v.get('list_price_details', {}).get('tiered_rates')}
+        self.final_price_dict = {k: float(v['final_price_details']['tiered_rates'][0]['usd_amount'])
+                                 for k, v in all_prices.items() if v.get('final_price_details', {}).get('tiered_rates')}
+
+
+class PriceSnapshotCache(object):
+    def __init__(self,
+                 table_name: str,
+                 cache_path: str = PRICE_SNAPSHOT_CACHE_PATH,
+                 probe_seconds: int = PRICE_SNAPSHOT_PROBE_SECONDS,
+                 client_factory=bigquery.Client):
+        """
+        Latest pricing snapshot of table_name, kept in memory and in a local sqlite file keyed by partition date.
+        The pricing table is only queried again when a metadata probe shows a newer partition.
+
+        :param table_name: (str) Bigquery pricing table, e.g. project.dataset.cloud_pricing_export
+        :param cache_path: (str) sqlite file shared by all processes of this checkout, the prices are stored as json,
+            None to keep the snapshot in memory only.
+        :param probe_seconds: (int) minimum interval between two probes of the latest partition.
+        :param client_factory: callable returning a bigquery.Client.
+        """
+        self.table_name = table_name
+        self.cache_path = cache_path
+        self.probe_seconds = probe_seconds
+        self.client_factory = client_factory
+        self.snapshot = None
+        self.probed_at = None
+        self._refresh_lock = threading.Lock()
+
+    def get(self) -> PriceSnapshot:
+        """
+        :return: the latest PriceSnapshot.
+            Only the very first call blocks on Bigquery, later calls return the cached snapshot immediately
+            and refresh it in the background once probe_seconds has elapsed.
+        """
+        if self.snapshot is None:
+            self.refresh()
+        elif self._probe_due():
+            self.refresh_in_background()
+        return self.snapshot
+
+    def refresh(self) -> None:
+        """
+        Probe the latest partition and reload the snapshot if it moved.
+        Concurrent callers are single-flighted, only one of them talks to Bigquery.
+        """
+        with self._refresh_lock:
+            # someone else refreshed while we were waiting for the lock
+            if self.snapshot is not None and not self._probe_due():
+                return
+
+            client = self.client_factory()
+            partition_date = latest_partition_date(self.table_name, client)
+            self.probed_at = time.monotonic()
+            if self.snapshot is not None and self.snapshot.partition_date == partition_date:
+                return
+
+            all_prices = self._read_disk(partition_date)
+            if all_prices is None:
+                all_prices = query_price_list(self.table_name, partition_date, client) if partition_date else {}
+                self._write_disk(partition_date, all_prices)
+            self.snapshot = PriceSnapshot(partition_date, all_prices)
+
+    def refresh_in_background(self) -> None:
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self._refresh_quietly, name='price-snapshot-refresh', daemon=True).start()
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            # keep serving the current snapshot, the next probe will try again
+            self.probed_at = time.monotonic()
+            logging.warning(f'Failed to refresh pricing snapshot of {self.table_name}: {e}')
+
+    def _probe_due(self) -> bool:
+        return self.probed_at is None or time.monotonic() - self.probed_at >= self.probe_seconds
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.cache_path, timeout=30)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS price_snapshot ('
+            ' table_name TEXT NOT NULL,'
+            ' partition_date TEXT NOT NULL,'
+            ' all_prices TEXT NOT NULL,'
+            ' PRIMARY KEY (table_name, partition_date))'
+        )
+        return connection
+
+    def _read_disk(self, partition_date: str):
+        if not self.cache_path or not partition_date:
+            return None
+        try:
+            with closing(self._connect()) as connection:
+                row = connection.execute(
+                    'SELECT all_prices FROM price_snapshot WHERE table_name = ? AND partition_date = ?',
+                    (self.table_name, partition_date)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f'Failed to read pricing snapshot from {self.cache_path}: {e}')
+            return None
+        if row is None:
+            return None
+        try:
+            all_prices = json.loads(row[0], object_hook=_decode_decimal)
+        except ValueError as e:
+            # e.g. a snapshot written in another format, it is replaced by the next write
+            logging.warning(f'Ignoring unreadable pricing snapshot in {self.cache_path}: {e}')
+            return None
+        logging.info(f'Pricing snapshot of partition {partition_date} loaded from {self.cache_path}.')
+        return all_prices
+
+    def _write_disk(self, partition_date: str, all_prices: dict) -> None:
+        if not self.cache_path or not partition_date:
+            return
+        try:
+            with closing(self._connect()) as connection, connection:
+                # only the latest partition is worth keeping
+                connection.execute('DELETE FROM price_snapshot WHERE table_name = ?', (self.table_name,))
+                connection.execute(
+                    'INSERT INTO price_snapshot (table_name, partition_date, all_prices) VALUES (?, ?, ?)',
+                    (self.table_name, partition_date, json.dumps(all_prices, default=_encode_decimal)))
+        except sqlite3.Error as e:
+            logging.warning(f'Failed to write pricing snapshot to {self.cache_path}: {e}')
+
+
+_snapshot_caches = {}
+_snapshot_caches_lock = threading.Lock()
+
+
+def get_price_snapshot():
+    """
+    :return: PriceSnapshot of the latest partition of BIGQUERY_PRICING_TABLE, shared by the whole process,
+        or None if BIGQUERY_PRICING_TABLE is not set.
+    """
+    table_name = os.environ.get('BIGQUERY_PRICING_TABLE')
+    if not table_name:
+        return None
+
+    with _snapshot_caches_lock:
+        cache = _snapshot_caches.get(table_name)
+        if cache is None:
+            cache = PriceSnapshotCache(table_name)
+            _snapshot_caches[table_name] = cache
+    return cache.get()
+
+
+def get_price_list() -> dict:
+    """
+    This function is to get the latest COMPUTE ENGINE pricing information from Bigquery pricing table.
+    It will retrieve all relevant pricing details for each SKU.
+    The result is cached per partition, see PriceSnapshotCache.
+
+    Please export Json key of the account having the right permission,
+    and set GOOGLE_APPLICATION_CREDENTIALS as the path of the Json file.
+    :return:
+    A dictionary where the key is SKU_ID, and value is a dictionary
+    containing list_prices, final_prices,
+    description, and pricing_unit.
+    The dictionary is shared by the whole process, do not modify it.
+    """
+    snapshot = get_price_snapshot()
+    if snapshot is None:
+        logging.warning("BIGQUERY_PRICING_TABLE environment variable not set. Using empty price list.")
+        return {}
+    return snapshot.all_prices
+
+
+def get_unit_price_dicts() -> (dict, dict):
+    """
+    :return: (list_price_dict, final_price_dict), both mapping SKU_ID to the usd amount of its first pricing tier,
+        e.g. list_price_dict['1C2E-893A-C634'] = 0.0396, final_price_dict['1C2E-893A-C634'] = 0.02376
+        Both dictionaries are shared by the whole process, do not modify them.
+    """
+    snapshot = get_price_snapshot()
+    if snapshot is None:
+        logging.warning("BIGQUERY_PRICING_TABLE environment variable not set. Using empty price list.")
+        return {}, {}
+    return snapshot.list_price_dict, snapshot.final_price_dict
+
+
+def get_pricing_for_sku_from_bq(sku_id: str) -> dict:
+    """
+    This function is to request the latest COMPUTE ENGINE pricing information for a specific SKU from Bigquery pricing table.
+    It will retrieve all relevant pricing details for the SKU.
+
+    Please export Json key of the account having the right permission,
+    and set GOOGLE_APPLICATION_CREDENTIALS as the path of the Json file.
+    :return:
+    A dictionary containing all pricing details for the SKU.
+    """
+    table_name = os.environ.get('BIGQUERY_PRICING_TABLE')
+    if not table_name:
+        logging.warning("BIGQUERY_PRICING_TABLE environment variable not set. Cannot get pricing for SKU.")
+        return {}
+
+    pricing_query = f'''
+        SELECT
+            sku.id as sku_id,
+            sku.description as sku_description,
+            list_price,
+            billing_account_price,
+            date(export_time) as pricing_date
+        FROM `{table_name}`
+        WHERE
+        DATE(_PARTITIONTIME) = (select max(date(_PARTITIONTIME)) from `{table_name}`)
+        AND sku.id = "{sku_id}"
+    '''
+
+    client = bigquery.Client()
+    query_job = client.query(pricing_query)
+    results = query_job.result()
+
+    if results.total_rows == 0:
+        return {"error": "SKU not found"}
+
+    return dict(list(results)[0])
@@ -0,0 +1,144 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.cloud import bigquery
+
+from .report_writer import Report, merge_watermarks, replace_report_days
+
+# number of day scripts running in BigQuery at the same time
+REPORT_BACKFILL_CONCURRENCY = int(os.environ.get('REPORT_BACKFILL_CONCURRENCY', 4))
+
+
+def date_range(start_date: str, end_date: str) -> [str]:
+    """
+    :return: every day from start_date to end_date, both included, e.g. ['2022-01-01', '2022-01-02']
+    """
+    first = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+    last = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    if last < first:
+        raise ValueError(f'end_date {end_date} is before start_date {start_date}.')
+    return [str(first + datetime.timedelta(days=i)) for i in range((last - first).days + 1)]
+
+
+class BackfillCheckpoint(object):
+    def __init__(self, path: str = None):
+        """
+        Completed (report, usage date) pairs of a backfill, appended to a json lines file as soon as they are written,
+        so a rerun of the same backfill skips them.
+
+        :param path: (str) checkpoint file, None to keep the checkpoint in memory only.
+        """
+        self.path = path
+        self.completed = {}
+        self._lock = threading.Lock()
+        # whether the file ends with a line torn by an interrupted run, the next record starts on a new line
+        self._torn = False
+        if path and os.path.exists(path):
+            with open(path, 'r') as checkpoint_file:
+                for line_number, line in enumerate(checkpoint_file, 1):
+                    self._torn = not line.endswith('\n')
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        self.completed[(record['report'], record['usage_date'])] = record
+                    except (ValueError, KeyError, TypeError) as e:
+                        # e.g. the last line of an interrupted run, its day is written again
+                        logging.warning(f'Skipping unreadable line {line_number} of checkpoint {path}: {e}')
+
+    def done(self, report_name: str, usage_date: str) -> bool:
+        return (report_name, usage_date) in self.completed
+
+    def record(self, report_names: [str], usage_date: str, stats: dict) -> None:
+        with self._lock:
+            records = [dict(stats, report=report_name, usage_date=usage_date) for report_name in report_names]
+            for record in records:
+                self.completed[(record['report'], usage_date)] = record
+            if self.path:
+                with open(self.path, 'a') as checkpoint_file:
+                    if self._torn:
+                        checkpoint_file.write('\n')
+                        self._torn = False
+                    for record in records:
+                        checkpoint_file.write(f'{json.dumps(record)}\n')
+
+
+def backfill_day(reports: [Report], usage_date: str, client: bigquery.Client = None) -> (dict, [dict]):
+    """
+    Write one day of the reports with one script, see replace_report_days.
+
+    :return: stats of the day: seconds, bytes_processed, slot_millis,
+        and the watermark rows of the day, left to merge_watermarks.
+    """
+    started = time.monotonic()
+    # day scripts run side by side on the same tables, see replace_sql
+    query_job = replace_report_days(reports, [usage_date], client, transaction=False, watermarks=False)
+    watermark_rows = [dict(row) for row in query_job.result()]
+    stats = {
+        'seconds': round(time.monotonic() - started, 3),
+        'bytes_processed': query_job.total_bytes_processed,
+        'slot_millis': query_job.slot_millis,
+    }
+    return stats, watermark_rows
+
+
+def backfill_reports(reports: [Report],
+                     start_date: str,
+                     end_date: str,
+                     concurrency: int = REPORT_BACKFILL_CONCURRENCY,
+                     checkpoint: BackfillCheckpoint = None,
+                     client: bigquery.Client = None,
+                     on_day=None) -> [dict]:
+    """
+    Rewrite every day from start_date to end_date of the reports, days run concurrently.
+    Each day scans the billing export once for all of its pending reports, pairs already in checkpoint are skipped.
+
+    :param concurrency: (int) number of day scripts running at the same time.
+    :param checkpoint: BackfillCheckpoint recording completed pairs, default is in memory only.
+    :param on_day: callable receiving the result of every day as soon as it is done.
+    :return: result of every day run: usage_date, reports, seconds, bytes_processed, slot_millis and error,
+        in the order they completed. Failed days are not checkpointed, a rerun retries them.
+    """
+    checkpoint = checkpoint or BackfillCheckpoint()
+    client = client or bigquery.Client()
+
+    pending = []
+    for usage_date in date_range(start_date, end_date):
+        day_reports = [report for report in reports if not checkpoint.done(report.name, usage_date)]
+        if day_reports:
+            pending.append((usage_date, day_reports))
+    logging.info(f'{len(pending)} days to backfill from {start_date} to {end_date}.')
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {
+            executor.submit(backfill_day, day_reports, usage_date, client): (usage_date, day_reports)
+            for usage_date, day_reports in pending
+        }
+        for future in as_completed(futures):
+            usage_date, day_reports = futures[future]
+            report_names = [report.name for report in day_reports]
+            result = {'usage_date': usage_date, 'reports': report_names, 'seconds': None,
+                      'bytes_processed': None, 'slot_millis': None, 'error': None}
+            try:
+                stats, watermark_rows = future.result()
+                # one watermark MERGE at a time, the days only run their report MERGE statements side by side
+                merge_watermarks(watermark_rows, client)
+                checkpoint.record(report_names, usage_date, stats)
+                result.update(stats)
+            except Exception as e:
+                logging.warning(f'Failed to backfill {", ".join(report_names)} of {usage_date}: {e}')
+                result['error'] = f'{type(e).__name__}: {e}'
+            results.append(result)
+            if on_day:
+                on_day(result)
+    return results
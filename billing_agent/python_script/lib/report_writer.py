@@ -0,0 +1,296 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import datetime
+import logging
+import os
+
+from google.cloud import bigquery
+
+BILLING_EXPORT_TABLE = 'bytedance-cloud-216403.billing.gcp_billing_export_v1_01A25B_AA5CE5_4FBF3D'
+# report --> usage date --> max(export_time) of the billing rows the usage date was last computed from
+REPORT_WATERMARK_TABLE = 'sunivy-hkjc-poc-public.report.report_watermarks'
+# billing data of a usage date keeps arriving for a few days, earlier days are checked for late rows this far back
+REPORT_LOOKBACK_DAYS = int(os.environ.get('REPORT_LOOKBACK_DAYS', 7))
+# billing rows of a usage date are exported from the day before it until the invoice of its month closes,
+# only the partitions of this many days after a usage date are read for it
+REPORT_EXPORT_WINDOW_DAYS = int(os.environ.get('REPORT_EXPORT_WINDOW_DAYS', 45))
+
+# temp table of the billing rows of @target_dates, from @first_target_date to @last_target_date,
+# shared by all the reports of a script
+BILLING_DAY_SLICE = 'billing_day_slice'
+BILLING_DAY_SLICE_SQL = f"""
+CREATE TEMP TABLE {BILLING_DAY_SLICE} AS
+SELECT
+  service.id AS service_id,
+  service.description AS service_description,
+  billing_account_id AS billing_name,
+  invoice.month AS invoice_month,
+  DATE(usage_start_time, "America/Los_Angeles") AS usage_date,
+  project.id AS project_id,
+  project.name AS project_name,
+  location.location AS region,
+  location.country AS location_country,
+  location.region AS location_region,
+  location.zone AS location_zone,
+  sku.id AS sku_id,
+  sku.description AS sku_description,
+  cost_type,
+  currency,
+  usage.amount AS usage_amount,
+  usage.unit AS usage_unit,
+  usage.amount_in_pricing_units AS usage_amount_in_pricing_units,
+  usage.pricing_unit AS usage_pricing_unit,
+  export_time,
+  cost,
+  COALESCE((SELECT SUM(amount) FROM UNNEST(credits)), 0) AS credits_amount,
+  COALESCE((SELECT SUM(amount) FROM UNNEST(credits) WHERE type != 'PROMOTION'), 0) AS non_promotion_credits_amount,
+  cost + COALESCE((SELECT SUM(amount) FROM UNNEST(credits)), 0) AS total_cost,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'instance_name') AS instance_name,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'psm') AS psm,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'inner_ip') AS inner_ip,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'forwarding-rule-name') AS forwarding_rule_name,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'bucket_name') AS bucket_name,
+  'forwarding-rule-name' IN (SELECT key FROM UNNEST(labels)) AS has_forwarding_rule,
+  ARRAY_LENGTH(labels) AS label_count
+FROM `{BILLING_EXPORT_TABLE}`
+-- keeps the scan to the partitions the rows of the target dates are exported to, see REPORT_EXPORT_WINDOW_DAYS
+-- with constant bounds, partitions are only pruned by filters without subqueries
+WHERE DATE(_PARTITIONTIME) BETWEEN DATE_SUB(@first_target_date, INTERVAL 1 DAY)
+    AND DATE_ADD(@last_target_date, INTERVAL {REPORT_EXPORT_WINDOW_DAYS} DAY)
+  AND DATE(usage_start_time, "America/Los_Angeles") IN UNNEST(@target_dates)
+  AND (@all_services OR service.id IN UNNEST(@service_ids));
+"""
+
+REPORT_WATERMARK_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS `{REPORT_WATERMARK_TABLE}` (
+  report STRING, usage_date DATE, export_time TIMESTAMP, updated_at TIMESTAMP
+);
+"""
+
+
+class Report(object):
+    def __init__(self, name: str, table_id: str, service_id: str, select_sql: str, create_sql: str = None):
+        """
+        A daily report table, partitioned by usage_date and computed from the billing export.
+
+        :param name: (str) e.g. compute_engine
+        :param table_id: (str) report table, e.g. project.report.compute_engine_details_v3
+        :param service_id: (str) billing service of the report, e.g. 6F81-5844-456A, None for all the services.
+        :param select_sql: (str) query of the report rows, in the column order of table_id,
+            reading the billing rows of the service from BILLING_DAY_SLICE.
+        :param create_sql: (str) statement creating table_id if it does not exist, None if it is created beforehand.
+        """
+        self.name = name
+        self.table_id = table_id
+        self.service_id = service_id
+        self.select_sql = select_sql
+        self.create_sql = create_sql
+
+    def service_filter(self, column: str = 'service_id') -> str:
+        """
+        :return: condition on the service column of the billing rows of the report.
+        """
+        return 'TRUE' if self.service_id is None else f"{column} = '{self.service_id}'"
+
+    def watermark_sql(self) -> str:
+        """
+        :return: query of the export_time watermark of every usage date of the report in BILLING_DAY_SLICE.
+        """
+        return f"""
+  SELECT '{self.name}' AS report, usage_date, MAX(export_time) AS export_time
+  FROM {BILLING_DAY_SLICE}
+  WHERE {self.service_filter()}
+  GROUP BY usage_date"""
+
+    def merge_sql(self, watermark: bool = True) -> str:
+        """
+        :param watermark: (bool) False to leave the watermarks to the caller, see replace_sql.
+        :return: statements replacing the usage dates @target_dates of the report table with the rows of
+            BILLING_DAY_SLICE, and recording the export_time watermark of each of them.
+        """
+        merge = f"""
+MERGE `{self.table_id}` T
+USING ({self.select_sql}) S
+ON FALSE
+WHEN NOT MATCHED BY SOURCE AND T.usage_date IN UNNEST(@target_dates) THEN DELETE
+WHEN NOT MATCHED THEN INSERT ROW;
+"""
+        return merge + (watermark_merge_sql(self.watermark_sql()) if watermark else '')
+
+
+def watermark_merge_sql(source_sql: str) -> str:
+    """
+    :param source_sql: (str) query of report, usage_date, export_time rows.
+    :return: statement recording the rows in REPORT_WATERMARK_TABLE.
+    """
+    return f"""
+MERGE `{REPORT_WATERMARK_TABLE}` W
+USING ({source_sql}
+) S
+ON W.report = S.report AND W.usage_date = S.usage_date
+WHEN MATCHED THEN UPDATE SET export_time = S.export_time, updated_at = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN INSERT (report, usage_date, export_time, updated_at)
+  VALUES (S.report, S.usage_date, S.export_time, CURRENT_TIMESTAMP());
+"""
+
+
+def replace_sql(reports: [Report], transaction: bool = True, watermarks: bool = True) -> str:
+    """
+    :param transaction: (bool) False to run the MERGE statements on their own, each of them is still atomic.
+        BigQuery cancels concurrent transactions mutating the same table, while it queues plain DML statements,
+        so scripts running side by side on the same reports, e.g. a backfill, must not use a transaction.
+        The watermark of a report is always merged after its rows, a failure in between only causes a recompute.
+    :param watermarks: (bool) False to select the watermark rows at the end of the script instead of merging them,
+        see merge_watermarks. Concurrent MERGE statements on the unpartitioned watermark table fail to serialize.
+    :return: script scanning the billing export once into BILLING_DAY_SLICE,
+        then replacing the usage dates @target_dates of every report.
+    """
+    merges = ''.join(report.merge_sql(watermarks) for report in reports)
+    if transaction:
+        merges = f'\nBEGIN TRANSACTION;\n{merges}\nCOMMIT TRANSACTION;\n'
+    if not watermarks:
+        merges += '\nUNION ALL'.join(report.watermark_sql() for report in reports) + ';\n'
+    # tables are created out of the transaction, DDL statements cannot run in one
+    creates = ''.join(report.create_sql for report in reports if report.create_sql)
+    return REPORT_WATERMARK_TABLE_SQL + creates + BILLING_DAY_SLICE_SQL + merges
+
+
+def merge_watermarks(rows: [dict], client: bigquery.Client = None) -> None:
+    """
+    Record the watermarks selected by a replace_sql script with watermarks=False.
+
+    :param rows: (list) {'report', 'usage_date', 'export_time'} rows.
+    """
+    if not rows:
+        return
+    watermarks = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter('report', 'STRING', row['report']),
+            bigquery.ScalarQueryParameter('usage_date', 'DATE', row['usage_date']),
+            bigquery.ScalarQueryParameter('export_time', 'TIMESTAMP', row['export_time']),
+        ) for row in rows
+    ]
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter('watermarks', 'STRUCT', watermarks)]
+    )
+    client = client or bigquery.Client()
+    client.query(watermark_merge_sql('SELECT * FROM UNNEST(@watermarks)'), job_config=job_config).result()
+
+
+def service_parameters(reports: [Report]) -> list:
+    """
+    :return: query parameters @service_ids and @all_services of the billing rows of the reports,
+        all the services if one of the reports has no service_id.
+    """
+    return [
+        bigquery.ArrayQueryParameter('service_ids', 'STRING',
+                                     sorted({report.service_id for report in reports if report.service_id})),
+        bigquery.ScalarQueryParameter('all_services', 'BOOL', any(report.service_id is None for report in reports)),
+    ]
+
+
+def export_watermarks(reports: [Report], from_date: str, to_date: str, client: bigquery.Client = None) -> dict:
+    """
+    Compare the latest export_time of the billing rows of every usage date with the one each report was computed from.
+
+    :param from_date: (str) first usage date, e.g. 2022-01-01
+    :param to_date: (str) last usage date, included.
+    :return: report name --> usage date (str) --> (export_time watermark of the billing export,
+        watermark of the report or None)
+    """
+    report_services = ', '.join(
+        f"STRUCT('{report.name}' AS report, "
+        + ("CAST(NULL AS STRING)" if report.service_id is None else f"'{report.service_id}'") + " AS service_id)"
+        for report in reports)
+    query = REPORT_WATERMARK_TABLE_SQL + f"""
+SELECT R.report, E.usage_date, MAX(E.export_time) AS export_time, ANY_VALUE(W.export_time) AS reported_export_time
+FROM (
+  SELECT service.id AS service_id, DATE(usage_start_time, "America/Los_Angeles") AS usage_date,
+    MAX(export_time) AS export_time
+  FROM `{BILLING_EXPORT_TABLE}`
+  -- the same partitions as BILLING_DAY_SLICE_SQL, the watermarks only move with the rows the reports read
+  WHERE DATE(_PARTITIONTIME) BETWEEN DATE_SUB(@from_date, INTERVAL 1 DAY)
+    AND DATE_ADD(@to_date, INTERVAL {REPORT_EXPORT_WINDOW_DAYS} DAY)
+    AND DATE(usage_start_time, "America/Los_Angeles") BETWEEN @from_date AND @to_date
+    AND (@all_services OR service.id IN UNNEST(@service_ids))
+  GROUP BY service_id, usage_date
+) E
+JOIN UNNEST([{report_services}]) R
+-- a report of all the services is as recent as its most recently exported service
+ON R.service_id IS NULL OR R.service_id = E.service_id
+LEFT JOIN `{REPORT_WATERMARK_TABLE}` W
+ON W.report = R.report AND W.usage_date = E.usage_date
+GROUP BY R.report, E.usage_date
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=service_parameters(reports) + [
+            bigquery.ScalarQueryParameter('from_date', 'DATE', from_date),
+            bigquery.ScalarQueryParameter('to_date', 'DATE', to_date),
+        ]
+    )
+    client = client or bigquery.Client()
+    watermarks = {report.name: {} for report in reports}
+    for row in client.query(query, job_config=job_config).result():
+        watermarks[row.report][str(row.usage_date)] = (row.export_time, row.reported_export_time)
+    return watermarks
+
+
+def stale_usage_dates(watermarks: dict) -> [str]:
+    """
+    :param watermarks: usage date --> watermarks of one report, see export_watermarks.
+    :return: usage dates having billing rows exported after the report was computed, or never computed.
+    """
+    return sorted(usage_date for usage_date, (export_time, reported_export_time) in watermarks.items()
+                  if reported_export_time is None or export_time > reported_export_time)
+
+
+def replace_report_days(reports: [Report], usage_dates: [str], client: bigquery.Client = None,
+                        transaction: bool = True, watermarks: bool = True) -> bigquery.QueryJob:
+    """
+    Recompute the usage dates of the reports from a single scan of the billing export,
+    and swap them in within one transaction, readers see either the old or the new rows of a day, never an empty day.
+
+    :param usage_dates: (list) e.g. ['2022-01-01']
+    :param transaction: (bool) see replace_sql.
+    :param watermarks: (bool) see replace_sql, the rows of the finished job are then the watermarks to merge.
+    :return: the finished script job, e.g. for its total_bytes_processed.
+    """
+    usage_dates = sorted(set(usage_dates))
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=service_parameters(reports) + [
+            bigquery.ArrayQueryParameter('target_dates', 'DATE', usage_dates),
+            bigquery.ScalarQueryParameter('first_target_date', 'DATE', usage_dates[0]),
+            bigquery.ScalarQueryParameter('last_target_date', 'DATE', usage_dates[-1]),
+        ]
+    )
+    client = client or bigquery.Client()
+    query_job = client.query(replace_sql(reports, transaction, watermarks), job_config=job_config)
+    query_job.result()
+    logging.info(f'{", ".join(report.name for report in reports)} of {", ".join(usage_dates)} written.')
+    return query_job
+
+
+def refresh_reports(reports: [Report], target_date: str, lookback_days: int = REPORT_LOOKBACK_DAYS,
+                    client: bigquery.Client = None) -> [str]:
+    """
+    Compute target_date, plus every earlier day of the last lookback_days whose billing rows moved since
+    one of the reports was written, e.g. late arriving cost or credits.
+    All the reports are recomputed for all those days, as they share the same scan of the billing export.
+
+    :param target_date: (str) e.g. 2022-01-10
+    :param lookback_days: (int) 0 to compute target_date only.
+    :return: usage dates written.
+    """
+    client = client or bigquery.Client()
+    usage_dates = {target_date}
+    if lookback_days > 0:
+        from_date = (datetime.datetime.strptime(target_date, "%Y-%m-%d") -
+                     datetime.timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+        for watermarks in export_watermarks(reports, from_date, target_date, client).values():
+            usage_dates.update(stale_usage_dates(watermarks))
+    usage_dates = sorted(usage_dates)
+    replace_report_days(reports, usage_dates, client)
+    return usage_dates
@@ -0,0 +1,166 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+
+import yaml
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'conf')
+SKU_CATEGORIES = ('cpu', 'ram', 'gpu', 'disk', 'nat')
+COMPILED_CATALOG_FILE = 'sku_catalog.pickle'
+COMPILED_CATALOG_VERSION = 1
+
+# libyaml is an order of magnitude faster than the pure python loader, use it when available.
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class SkuCatalog(object):
+    def __init__(self, mappings: dict, source_mtimes: dict):
+        """
+        In-memory SKU catalog built from conf/sku_*.yaml.
+
+        :param mappings: (dict) [category][key][region] --> SKU_ID,
+            e.g. mappings['cpu']['a2-cud-1y']['asia-east1'] = '38FA-6071-3D88'
+        :param source_mtimes: (dict) category --> mtime (ns) of the yaml file the mapping was loaded from.
+        """
+        self.source_mtimes = source_mtimes
+        self.mappings = {}
+        self.index = {}
+        for category, sku_dict in mappings.items():
+            self.mappings[category] = {}
+            for key, regions in (sku_dict or {}).items():
+                regions = {region: sys.intern(sku_id) for region, sku_id in (regions or {}).items()}
+                self.mappings[category][key] = regions
+                for region, sku_id in regions.items():
+                    self.index[(category, key, region)] = sku_id
+
+    def sku_dict(self, category: str) -> dict:
+        """
+        :param category: (str) one of SKU_CATEGORIES.
+        :return: [key][region] --> SKU_ID mapping of the category, in the same shape as yaml.safe_load
+            of conf/sku_<category>.yaml. The dict is shared by the whole process, do not modify it.
+        """
+        return self.mappings.get(category, {})
+
+    def sku_id(self, category: str, key: str, region: str) -> str:
+        """
+        :return: SKU_ID of (category, key, region), e.g. ('cpu', 'n2-cud-1y', 'us-east4'), or None if not mapped.
+        """
+        return self.index.get((category, key, region))
+
+
+def _yaml_path(conf_dir: str, category: str) -> str:
+    return os.path.join(conf_dir, f'sku_{category}.yaml')
+
+
+def _source_mtimes(conf_dir: str) -> dict:
+    mtimes = {}
+    for category in SKU_CATEGORIES:
+        try:
+            mtimes[category] = os.stat(_yaml_path(conf_dir, category)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return mtimes
+
+
+def _source_digests(conf_dir: str, categories) -> dict:
+    digests = {}
+    for category in categories:
+        with open(_yaml_path(conf_dir, category), 'rb') as sku_yaml:
+            digests[category] = hashlib.sha1(sku_yaml.read()).hexdigest()
+    return digests
+
+
+def _load_yaml_mappings(conf_dir: str, categories) -> dict:
+    mappings = {}
+    for category in categories:
+        with open(_yaml_path(conf_dir, category), 'r') as sku_yaml:
+            mappings[category] = yaml.load(sku_yaml, Loader=_YAML_LOADER) or {}
+    return mappings
+
+
+def _load_compiled_mappings(conf_dir: str, categories) -> dict:
+    """
+    Load mappings from the precompiled artifact written by write_compiled_catalog.
+    The artifact is only used if it was compiled from exactly the yaml files currently on disk.
+
+    :return: mappings, or None if there is no usable artifact.
+    """
+    compiled_path = os.path.join(conf_dir, COMPILED_CATALOG_FILE)
+    if not os.path.exists(compiled_path):
+        return None
+    try:
+        with open(compiled_path, 'rb') as compiled_file:
+            compiled = pickle.load(compiled_file)
+    except Exception as e:
+        logging.warning(f'Failed to read compiled SKU catalog {compiled_path}: {e}')
+        return None
+
+    if compiled.get('version') != COMPILED_CATALOG_VERSION or \
+            compiled.get('source_digests') != _source_digests(conf_dir, categories):
+        logging.info(f'Compiled SKU catalog {compiled_path} is out of date, loading yaml files instead.')
+        return None
+    return compiled['mappings']
+
+
+def load_catalog(conf_dir: str = CONF_DIR) -> SkuCatalog:
+    """
+    Build a SkuCatalog from conf_dir, bypassing the process-wide cache.
+    """
+    source_mtimes = _source_mtimes(conf_dir)
+    mappings = _load_compiled_mappings(conf_dir, source_mtimes.keys())
+    if mappings is None:
+        mappings = _load_yaml_mappings(conf_dir, source_mtimes.keys())
+    catalog = SkuCatalog(mappings, source_mtimes)
+    logging.info(f'SKU catalog of {len(catalog.index)} (category, key, region) entries loaded from {conf_dir}.')
+    return catalog
+
+
+def get_catalog(conf_dir: str = CONF_DIR) -> SkuCatalog:
+    """
+    Get the process-wide SkuCatalog of conf_dir.
+    The catalog is loaded once and reloaded automatically when any conf/sku_*.yaml file changes.
+
+    :param conf_dir: (str) directory containing sku_cpu.yaml, sku_ram.yaml, sku_gpu.yaml, sku_disk.yaml and sku_nat.yaml.
+    :return: SkuCatalog
+    """
+    source_mtimes = _source_mtimes(conf_dir)
+    catalog = _catalogs.get(conf_dir)
+    if catalog is not None and catalog.source_mtimes == source_mtimes:
+        return catalog
+
+    with _catalogs_lock:
+        catalog = _catalogs.get(conf_dir)
+        if catalog is None or catalog.source_mtimes != source_mtimes:
+            catalog = load_catalog(conf_dir)
+            _catalogs[conf_dir] = catalog
+    return catalog
+
+
+def write_compiled_catalog(conf_dir: str = CONF_DIR) -> str:
+    """
+    Compile conf/sku_*.yaml into a binary artifact that get_catalog loads instead of parsing yaml.
+
+    :return: path of the compiled artifact.
+    """
+    categories = _source_mtimes(conf_dir).keys()
+    compiled = {
+        'version': COMPILED_CATALOG_VERSION,
+        'source_digests': _source_digests(conf_dir, categories),
+        'mappings': _load_yaml_mappings(conf_dir, categories),
+    }
+    compiled_path = os.path.join(conf_dir, COMPILED_CATALOG_FILE)
+    tmp_path = f'{compiled_path}.tmp'
+    with open(tmp_path, 'wb') as compiled_file:
+        pickle.dump(compiled, compiled_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, compiled_path)
+    return compiled_path
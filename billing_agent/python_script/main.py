@@ -0,0 +1,500 @@
+from datetime import datetime, timedelta
+
+from lib.metrics.monitor import nat_request, nat_request_range
+from lib.price import get_unit_price_dicts
+from lib.partition_sink import PartitionSink, BigQueryPartitionSink
+from lib.report_writer import BILLING_DAY_SLICE, BILLING_EXPORT_TABLE, REPORT_LOOKBACK_DAYS, Report, refresh_reports, replace_report_days
+from lib.sku_catalog import get_catalog
+
+NAT_TABLE_ID = 'sunivy-hkjc-poc-public.report.nat_details_v3'
+NAT_PROJECTS = ['bytedance-yawn-default']
+
+COMPUTE_ENGINE_SERVICE_ID = '6F81-5844-456A'
+CLOUD_STORAGE_SERVICE_ID = '95FF-2EF5-5EA1'
+
+INSTANCE_REPORT = Report(
+    'compute_engine',
+    'sunivy-hkjc-poc-public.report.compute_engine_details_v3',
+    COMPUTE_ENGINE_SERVICE_ID,
+    f"""
+with billing_with_category as
+(
+SELECT
+  billing_name,
+  invoice_month,
+  usage_date,
+  project_id,
+  total_cost,
+  instance_name,
+  psm,
+  inner_ip,
+(case
+ when upper(sku_description) like '%CPU%' or upper(sku_description) like '%CORE%' then 'CPU'
+ when upper(sku_description) like '%RAM%' then 'RAM'
+ when upper(sku_description) like '%GPU%' then 'GPU'
+ when (upper(sku_description) like '%SSD%' and upper(sku_description) like '%PD%') then 'PD_SSD'
+ when (upper(sku_description) like '%SSD%' and upper(sku_description) like '%LOCAL%') then 'LOCAL_SSD'
+ when (upper(sku_description) like '%PD%') then 'PD_HDD'
+ when upper(sku_description) like '%NETWORK%' then 'NETWORK'
+ELSE 'OTHERS'
+END) as sku_category,
+ FROM {BILLING_DAY_SLICE}
+where service_id='{COMPUTE_ENGINE_SERVICE_ID}'
+  and not has_forwarding_rule
+)
+select
+ billing_name, invoice_month, usage_date, project_id,
+ ifnull(instance_name,'--') as instance_name,
+ ifnull(psm,'--') as psm, inner_ip,
+(ifnull(CPU,0) +
+ifnull(RAM,0) +
+ifnull(NETWORK,0) +
+ifnull(PD_SSD,0) +
+ifnull(LOCAL_SSD,0) +
+ifnull(PD_HDD,0) +
+ifnull(GPU,0) +
+ifnull(OTHERS,0)) AS SUBTOTAL,
+ifnull(CPU,0) AS CPU,
+ifnull(RAM,0) AS RAM,
+ifnull(NETWORK,0) AS NETWORK,
+ifnull(PD_SSD,0) AS PD_SSD,
+ifnull(LOCAL_SSD,0) AS LOCAL_SSD,
+ifnull(PD_HDD,0) AS PD_HDD,
+ifnull(GPU,0) AS GPU,
+ifnull(OTHERS,0) AS OTHERS,
+from billing_with_category
+pivot( sum(total_cost)
+for sku_category in ('CPU','RAM','NETWORK','PD_SSD','LOCAL_SSD','PD_HDD','GPU','OTHERS'))
+-- where instance_name='web1617710019-compass546826-2'
+-- insert into sunivy-hkjc-poc-public.report.compute_engine_details_v3 from other billing accounts
+""")
+
+
+LOAD_BALANCER_REPORT = Report(
+    'compute_load_balancer',
+    'sunivy-hkjc-poc-public.report.compute_load_balancer_details',
+    COMPUTE_ENGINE_SERVICE_ID,
+    f"""
+with billing_with_category as
+(
+SELECT
+  billing_name,
+  invoice_month,
+  usage_date,
+  project_id,
+  total_cost,
+  forwarding_rule_name,
+ FROM {BILLING_DAY_SLICE}
+where service_id='{COMPUTE_ENGINE_SERVICE_ID}'
+  and has_forwarding_rule
+)
+select
+ billing_name, invoice_month, usage_date, project_id,
+ ifnull(forwarding_rule_name,'--') as forwarding_rule_name,
+ sum(total_cost) as SUBTOTAL_USD
+ from billing_with_category
+ group by billing_name, invoice_month, usage_date, project_id, forwarding_rule_name
+""")
+
+
+OTHERS_REPORT = Report(
+    'compute_others',
+    'sunivy-hkjc-poc-public.report.compute_others_details_v3',
+    COMPUTE_ENGINE_SERVICE_ID,
+    f"""
+with no_label as (
+SELECT
+  billing_name,
+  invoice_month,
+  usage_date,
+  project_name,
+  total_cost,
+  sku_description as description
+ FROM {BILLING_DAY_SLICE}
+ where service_id='{COMPUTE_ENGINE_SERVICE_ID}' and
+ upper(sku_description) not like '%CPU%'
+ and  upper(sku_description) not like '%CORE%'
+ and upper(sku_description) not like '%RAM%'
+ and  upper(sku_description) not like '%GPU%'
+ and  (upper(sku_description) not like '%PD%')
+ and  upper(sku_description) not like '%NETWORK%'
+ and not (upper(sku_description) like '%SSD%' and upper(sku_description) like '%LOCAL%')
+ and label_count = 0
+)
+select description, billing_name , project_name , invoice_month , usage_date , sum(total_cost ) as SUBTOTAL from no_label
+group by description, billing_name , project_name, invoice_month , usage_date
+""")
+
+
+STORAGE_REPORT = Report(
+    'storage',
+    'sunivy-hkjc-poc-public.report.storage_details_v3',
+    CLOUD_STORAGE_SERVICE_ID,
+    f"""
+with billing_with_category as
+(
+SELECT
+  billing_name,
+  invoice_month,
+  usage_date,
+  project_name,
+  region,
+  total_cost,
+  usage_amount_in_pricing_units * cast(EXTRACT(DAY FROM LAST_DAY(usage_date)) as int) as total_usage,
+ifnull(bucket_name ,'--') as bucket_name,
+trim(REGEXP_REPLACE(sku_description, r'\W+', '_'),'_') AS SKU_DESCRIPTION,
+(case
+ when upper(sku_description) like 'STANDARD STORAGE%' then 'STORAGE'
+ when upper(sku_description) like 'NEARLINE STORAGE%' then 'STORAGE'
+ when upper(sku_description) like 'DOWNLOAD%' then trim(REGEXP_REPLACE(sku_description, r'\W+', '_'),'_')
+ when upper(sku_description) like '%STANDARD CLASS A OPERATIONS' then 'STANDARD_CLASS_A_OPERATIONS'
+ when upper(sku_description) like '%STANDARD CLASS B OPERATIONS' then 'STANDARD_CLASS_B_OPERATIONS'
+ when upper(sku_description) like '%EGRESS%' then trim(REGEXP_REPLACE(sku_description, r'\W+', '_'),'_')
+ELSE 'OTHERS'
+END) as sku_category,
+ FROM {BILLING_DAY_SLICE}
+ WHERE service_id='{CLOUD_STORAGE_SERVICE_ID}'
+
+)
+select BUCKET_INFO.*,
+(
+    ifnull(STORAGE_COST.STORAGE,0) +
+    ifnull(CLASS_A_OPERATIONS_COST.STANDARD_CLASS_A_OPERATIONS,0) +
+    ifnull(CLASS_B_OPERATIONS_COST.STANDARD_CLASS_B_OPERATIONS,0) +
+    ifnull(NETWORK_AND_OTHERS.NETWORK_PRICE,0 ) +
+    ifnull(NETWORK_AND_OTHERS.OTHERS,0 )
+    ) AS SUBTOTAL,
+ifnull(STORAGE_COST.STORAGE_TYPE, '--') as STORAGE_TYPE,
+ifnull(STORAGE_COST.STORAGE, 0) as STORAGE,
+ifnull(STORAGE_COST.storage_usage, 0 ) as USAGE_GB,
+ifnull(CLASS_A_OPERATIONS_COST.STANDARD_CLASS_A_OPERATIONS_TYPE, '--') as STANDARD_CLASS_A_OPERATIONS_TYPE,
+ifnull(CLASS_A_OPERATIONS_COST.STANDARD_CLASS_A_OPERATIONS, 0) as STANDARD_CLASS_A_OPERATIONS,
+ifnull(CLASS_B_OPERATIONS_COST.STANDARD_CLASS_B_OPERATIONS_TYPE ,'--') as STANDARD_CLASS_B_OPERATIONS_TYPE,
+ifnull(CLASS_B_OPERATIONS_COST.STANDARD_CLASS_B_OPERATIONS,0) as STANDARD_CLASS_B_OPERATIONS,
+ifnull(NETWORK_AND_OTHERS.Download_APAC,0) AS Download_APAC,
+ifnull(NETWORK_AND_OTHERS.Download_Australia,0) AS Download_Australia,
+ifnull(NETWORK_AND_OTHERS.Download_China,0) AS Download_China,
+ifnull(NETWORK_AND_OTHERS.Download_Worldwide_Destinations_excluding_Asia_Australia,0) AS Download_Worldwide_Destinations_excluding_Asia_Australia,
+ifnull(NETWORK_AND_OTHERS.APAC_based_Storage_egress_via_peered_interconnect_network,0) AS APAC_based_Storage_egress_via_peered_interconnect_network,
+ifnull(NETWORK_AND_OTHERS.EU_based_Storage_egress_via_peered_interconnect_network,0) AS EU_based_Storage_egress_via_peered_interconnect_network,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_APAC_and_SA,0) AS GCP_Storage_egress_between_APAC_and_SA,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_AU_and_APAC,0) AS GCP_Storage_egress_between_AU_and_APAC,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_AU_and_EU,0) AS GCP_Storage_egress_between_AU_and_EU,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_AU_and_NA,0) AS GCP_Storage_egress_between_AU_and_NA,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_AU_and_SA,0) AS GCP_Storage_egress_between_AU_and_SA,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_EU_and_APAC,0) AS GCP_Storage_egress_between_EU_and_APAC,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_EU_and_SA,0) AS GCP_Storage_egress_between_EU_and_SA,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_NA_and_APAC,0) AS GCP_Storage_egress_between_NA_and_APAC,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_NA_and_EU,0) AS GCP_Storage_egress_between_NA_and_EU,
+ifnull(NETWORK_AND_OTHERS.GCP_Storage_egress_between_NA_and_SA,0) AS GCP_Storage_egress_between_NA_and_SA,
+ifnull(NETWORK_AND_OTHERS.Inter_region_GCP_Storage_egress_within_APAC,0) AS Inter_region_GCP_Storage_egress_within_APAC,
+ifnull(NETWORK_AND_OTHERS.Inter_region_GCP_Storage_egress_within_AU,0) AS Inter_region_GCP_Storage_egress_within_AU,
+ifnull(NETWORK_AND_OTHERS.Inter_region_GCP_Storage_egress_within_EU,0) AS Inter_region_GCP_Storage_egress_within_EU,
+ifnull(NETWORK_AND_OTHERS.Inter_region_GCP_Storage_egress_within_NA,0) AS Inter_region_GCP_Storage_egress_within_NA,
+ifnull(NETWORK_AND_OTHERS.Inter_region_GCP_Storage_egress_within_SA,0) AS Inter_region_GCP_Storage_egress_within_SA,
+ifnull(NETWORK_AND_OTHERS.NA_based_Storage_egress_via_peered_interconnect_network,0) AS NA_based_Storage_egress_via_peered_interconnect_network,
+ifnull(NETWORK_AND_OTHERS.Networking_Traffic_Egress_GAE_Firebase_Storage,0) AS Networking_Traffic_Egress_GAE_Firebase_Storage,
+ifnull(NETWORK_AND_OTHERS.NETWORK_PRICE,0) as NETWORK_PRICE,
+ifnull(NETWORK_AND_OTHERS.OTHERS ,0) as OTHERS
+
+from
+(SELECT
+    billing_name ,
+    invoice_month ,
+    usage_date,
+    project_name ,
+    region ,
+    bucket_name
+from billing_with_category
+group by billing_name , invoice_month, usage_date, project_name , region , bucket_name
+order by project_name
+) BUCKET_INFO
+LEFT JOIN
+ (
+select billing_name , invoice_month , project_name , region,  bucket_name, usage_date,
+sku_description AS STORAGE_TYPE, sum(total_cost) AS STORAGE, sum(total_usage) as STORAGE_USAGE
+from billing_with_category where sku_category ='STORAGE'
+group by billing_name , invoice_month , project_name , region, sku_description, bucket_name, usage_date
+) STORAGE_COST
+ON BUCKET_INFO.bucket_name = STORAGE_COST.bucket_name and BUCKET_INFO.region = STORAGE_COST.region and BUCKET_INFO.project_name = STORAGE_COST.project_name and BUCKET_INFO.usage_date = STORAGE_COST.usage_date and BUCKET_INFO.invoice_month = STORAGE_COST.invoice_month
+left join
+(
+select billing_name , invoice_month , project_name , region,  bucket_name, usage_date, sku_description AS STANDARD_CLASS_A_OPERATIONS_TYPE, sum(total_cost) AS STANDARD_CLASS_A_OPERATIONS
+from billing_with_category where sku_category ='STANDARD_CLASS_A_OPERATIONS'
+group by billing_name , invoice_month , project_name , region, sku_description, bucket_name, usage_date
+) CLASS_A_OPERATIONS_COST
+ON BUCKET_INFO.bucket_name = CLASS_A_OPERATIONS_COST.bucket_name and BUCKET_INFO.region = CLASS_A_OPERATIONS_COST.region and BUCKET_INFO.project_name = CLASS_A_OPERATIONS_COST.project_name and BUCKET_INFO.usage_date = CLASS_A_OPERATIONS_COST.usage_date and BUCKET_INFO.invoice_month = CLASS_A_OPERATIONS_COST.invoice_month
+left join
+(
+select billing_name , invoice_month , project_name , region,  bucket_name, usage_date, sku_description AS STANDARD_CLASS_B_OPERATIONS_TYPE, sum(total_cost) AS STANDARD_CLASS_B_OPERATIONS
+from billing_with_category where sku_category ='STANDARD_CLASS_B_OPERATIONS'
+group by billing_name , invoice_month , project_name , region, sku_description, bucket_name, usage_date
+) CLASS_B_OPERATIONS_COST
+on BUCKET_INFO.bucket_name = CLASS_B_OPERATIONS_COST.bucket_name  and BUCKET_INFO.region = CLASS_B_OPERATIONS_COST.region and BUCKET_INFO.project_name = CLASS_B_OPERATIONS_COST.project_name and BUCKET_INFO.usage_date =CLASS_B_OPERATIONS_COST.usage_date and BUCKET_INFO.invoice_month = CLASS_B_OPERATIONS_COST.invoice_month
+left join
+(
+select
+project_name, region, bucket_name, usage_date, invoice_month ,
+ifnull(Download_APAC,0) AS Download_APAC,
+ifnull(Download_Australia,0) AS Download_Australia,
+ifnull(Download_China,0) AS Download_China,
+ifnull(Download_Worldwide_Destinations_excluding_Asia_Australia,0) AS Download_Worldwide_Destinations_excluding_Asia_Australia,
+ifnull(APAC_based_Storage_egress_via_peered_interconnect_network,0) AS APAC_based_Storage_egress_via_peered_interconnect_network,
+ifnull(EU_based_Storage_egress_via_peered_interconnect_network,0) AS EU_based_Storage_egress_via_peered_interconnect_network,
+ifnull(GCP_Storage_egress_between_APAC_and_SA,0) AS GCP_Storage_egress_between_APAC_and_SA,
+ifnull(GCP_Storage_egress_between_AU_and_APAC,0) AS GCP_Storage_egress_between_AU_and_APAC,
+ifnull(GCP_Storage_egress_between_AU_and_EU,0) AS GCP_Storage_egress_between_AU_and_EU,
+ifnull(GCP_Storage_egress_between_AU_and_NA,0) AS GCP_Storage_egress_between_AU_and_NA,
+ifnull(GCP_Storage_egress_between_AU_and_SA,0) AS GCP_Storage_egress_between_AU_and_SA,
+ifnull(GCP_Storage_egress_between_EU_and_APAC,0) AS GCP_Storage_egress_between_EU_and_APAC,
+ifnull(GCP_Storage_egress_between_EU_and_SA,0) AS GCP_Storage_egress_between_EU_and_SA,
+ifnull(GCP_Storage_egress_between_NA_and_APAC,0) AS GCP_Storage_egress_between_NA_and_APAC,
+ifnull(GCP_Storage_egress_between_NA_and_EU,0) AS GCP_Storage_egress_between_NA_and_EU,
+ifnull(GCP_Storage_egress_between_NA_and_SA,0) AS GCP_Storage_egress_between_NA_and_SA,
+ifnull(Inter_region_GCP_Storage_egress_within_APAC,0) AS Inter_region_GCP_Storage_egress_within_APAC,
+ifnull(Inter_region_GCP_Storage_egress_within_AU,0) AS Inter_region_GCP_Storage_egress_within_AU,
+ifnull(Inter_region_GCP_Storage_egress_within_EU,0) AS Inter_region_GCP_Storage_egress_within_EU,
+ifnull(Inter_region_GCP_Storage_egress_within_NA,0) AS Inter_region_GCP_Storage_egress_within_NA,
+ifnull(Inter_region_GCP_Storage_egress_within_SA,0) AS Inter_region_GCP_Storage_egress_within_SA,
+ifnull(NA_based_Storage_egress_via_peered_interconnect_network,0) AS NA_based_Storage_egress_via_peered_interconnect_network,
+ifnull(Networking_Traffic_Egress_GAE_Firebase_Storage,0) AS Networking_Traffic_Egress_GAE_Firebase_Storage,
+
+(ifnull(Download_APAC,0) +
+ifnull(Download_Australia,0) +
+ifnull(Download_China,0) +
+ifnull(Download_Worldwide_Destinations_excluding_Asia_Australia,0) +
+ifnull(APAC_based_Storage_egress_via_peered_interconnect_network,0) +
+ifnull(EU_based_Storage_egress_via_peered_interconnect_network,0) +
+ifnull(GCP_Storage_egress_between_APAC_and_SA,0) +
+ifnull(GCP_Storage_egress_between_AU_and_APAC,0) +
+ifnull(GCP_Storage_egress_between_AU_and_EU,0) +
+ifnull(GCP_Storage_egress_between_AU_and_NA,0) +
+ifnull(GCP_Storage_egress_between_AU_and_SA,0) +
+ifnull(GCP_Storage_egress_between_EU_and_APAC,0) +
+ifnull(GCP_Storage_egress_between_EU_and_SA,0) +
+ifnull(GCP_Storage_egress_between_NA_and_APAC,0) +
+ifnull(GCP_Storage_egress_between_NA_and_EU,0) +
+ifnull(GCP_Storage_egress_between_NA_and_SA,0) +
+ifnull(Inter_region_GCP_Storage_egress_within_APAC,0) +
+ifnull(Inter_region_GCP_Storage_egress_within_AU,0) +
+ifnull(Inter_region_GCP_Storage_egress_within_EU,0) +
+ifnull(Inter_region_GCP_Storage_egress_within_NA,0) +
+ifnull(Inter_region_GCP_Storage_egress_within_SA,0) +
+ifnull(NA_based_Storage_egress_via_peered_interconnect_network,0) +
+ifnull(Networking_Traffic_Egress_GAE_Firebase_Storage,0)
+) as NETWORK_PRICE,
+
+ifnull(OTHERS,0) AS OTHERS,
+
+from (
+    select  project_name, bucket_name, region, usage_date, sku_category, total_cost, invoice_month from
+billing_with_category where sku_category not in ('STORAGE','STANDARD_CLASS_A_OPERATIONS','STANDARD_CLASS_B_OPERATIONS')
+)
+pivot( sum(total_cost)
+for sku_category in (
+    'Download_APAC',
+	'Download_Australia',
+	'Download_China',
+	'Download_Worldwide_Destinations_excluding_Asia_Australia',
+	'APAC_based_Storage_egress_via_peered_interconnect_network',
+	'EU_based_Storage_egress_via_peered_interconnect_network',
+	'GCP_Storage_egress_between_APAC_and_SA',
+	'GCP_Storage_egress_between_AU_and_APAC',
+	'GCP_Storage_egress_between_AU_and_EU',
+	'GCP_Storage_egress_between_AU_and_NA',
+	'GCP_Storage_egress_between_AU_and_SA',
+	'GCP_Storage_egress_between_EU_and_APAC',
+	'GCP_Storage_egress_between_EU_and_SA',
+	'GCP_Storage_egress_between_NA_and_APAC',
+	'GCP_Storage_egress_between_NA_and_EU',
+	'GCP_Storage_egress_between_NA_and_SA',
+	'Inter_region_GCP_Storage_egress_within_APAC',
+	'Inter_region_GCP_Storage_egress_within_AU',
+	'Inter_region_GCP_Storage_egress_within_EU',
+	'Inter_region_GCP_Storage_egress_within_NA',
+	'Inter_region_GCP_Storage_egress_within_SA',
+	'NA_based_Storage_egress_via_peered_interconnect_network',
+	'Networking_Traffic_Egress_GAE_Firebase_Storage',
+	'OTHERS'
+)) order by bucket_name desc
+) AS NETWORK_AND_OTHERS
+ON BUCKET_INFO.bucket_name = NETWORK_AND_OTHERS.bucket_name and BUCKET_INFO.project_name = NETWORK_AND_OTHERS.project_name  and BUCKET_INFO.region = NETWORK_AND_OTHERS.region and BUCKET_INFO.usage_date = NETWORK_AND_OTHERS.usage_date and BUCKET_INFO.invoice_month = NETWORK_AND_OTHERS.invoice_month
+order by storage desc
+""")
+
+ROLLUP_TABLE_ID = 'sunivy-hkjc-poc-public.report.billing_daily_rollup'
+
+# cost and credits of all the services summed by day, project, service, SKU, location and cost type,
+# the billing agent reads it instead of the billing export when a question only needs these sums
+ROLLUP_REPORT = Report(
+    'billing_daily_rollup',
+    ROLLUP_TABLE_ID,
+    None,
+    f"""
+select
+ billing_name as billing_account_id, invoice_month, usage_date,
+ project_id, project_name, service_id, service_description, sku_id, sku_description,
+ region as location, location_country as country, location_region as region, location_zone as zone,
+ cost_type, currency, usage_unit, usage_pricing_unit,
+ sum(cost) as cost,
+ sum(credits_amount) as credits_amount,
+ sum(non_promotion_credits_amount) as non_promotion_credits_amount,
+ sum(usage_amount) as usage_amount,
+ sum(usage_amount_in_pricing_units) as usage_amount_in_pricing_units,
+ max(export_time) as export_time,
+ -- the billing agent only reads the rollup for questions on the billing tables it is computed from
+ '{BILLING_EXPORT_TABLE}' as billing_export_table
+ from {BILLING_DAY_SLICE}
+ -- by position, the slice has a region column of its own
+ group by 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17
+""",
+    f"""
+CREATE TABLE IF NOT EXISTS `{ROLLUP_TABLE_ID}` (
+  billing_account_id STRING, invoice_month STRING, usage_date DATE,
+  project_id STRING, project_name STRING, service_id STRING, service_description STRING,
+  sku_id STRING, sku_description STRING,
+  location STRING, country STRING, region STRING, zone STRING,
+  cost_type STRING, currency STRING, usage_unit STRING, usage_pricing_unit STRING,
+  cost FLOAT64, credits_amount FLOAT64, non_promotion_credits_amount FLOAT64,
+  usage_amount FLOAT64, usage_amount_in_pricing_units FLOAT64, export_time TIMESTAMP,
+  billing_export_table STRING
+)
+PARTITION BY usage_date
+CLUSTER BY invoice_month, service_id, project_id, sku_id;
+""")
+
+# the reports computed from the billing export, see daily_reports
+REPORTS = [INSTANCE_REPORT, LOAD_BALANCER_REPORT, OTHERS_REPORT, STORAGE_REPORT, ROLLUP_REPORT]
+
+
+def request_arg(request, name: str, default=None):
+    """
+    :return: query string argument of a Cloud Function request, default if absent or run without a request.
+    """
+    args = getattr(request, 'args', None) or {}
+    return args.get(name) or default
+
+
+def target_date_arg(request) -> str:
+    """
+    :return: ?target_date= of the request, 2 days ago by default, when the billing export of the day is complete.
+    """
+    return request_arg(request, 'target_date', (datetime.today() - timedelta(days=2)).strftime("%Y-%m-%d"))
+
+
+def write_reports(reports: [Report], request) -> str:
+    """
+    Write the reports of target_date, from one scan of the billing export.
+    In the default incremental mode, earlier days of the last lookback_days whose billing rows were exported since
+    they were written are recomputed as well, ?mode=daily writes target_date only.
+    Either way the days are replaced atomically, see replace_report_days.
+    """
+    target_date = target_date_arg(request)
+    if request_arg(request, 'mode', 'incremental') == 'daily':
+        replace_report_days(reports, [target_date])
+    else:
+        refresh_reports(reports, target_date, int(request_arg(request, 'lookback_days', REPORT_LOOKBACK_DAYS)))
+    return 'OK'
+
+
+def daily_reports(request, sink: PartitionSink = None):
+    """
+    All the daily reports in one run: the billing export reports share a single script and scan,
+    the NAT report, computed from Monitoring, is loaded right after.
+    """
+    write_reports(REPORTS, request)
+    return gce_nat_billing(request, sink)
+
+
+# cd python-script && zip -r nat.zip *
+def gce_instance_billing(request):
+    return write_reports([INSTANCE_REPORT], request)
+
+
+def gce_network_billing(request):
+    return write_reports([LOAD_BALANCER_REPORT], request)
+
+
+def gce_others_billing(request):
+    return write_reports([OTHERS_REPORT], request)
+
+
+def storage_billing(request):
+    return write_reports([STORAGE_REPORT], request)
+
+
+def billing_rollup(request):
+    return write_reports([ROLLUP_REPORT], request)
+
+
+def nat_billing_rows(nat_data_dict: dict, final_price_dict: dict, sku_nat_dict: dict):
+    """
+    :return: generator of NAT rows with their nat_fee_usd.
+    """
+    for item in nat_data_dict.values():
+        # print(type(item))
+        in_and_out = item['received_bytes_count'] + item['sent_bytes_count']
+        region = item['region']
+        sku_id = sku_nat_dict['nat-data'][region]
+        price = final_price_dict[sku_id]
+        item['nat_fee_usd'] = price * in_and_out
+        yield item
+
+
+def gce_nat_billing(request, sink: PartitionSink = None):
+    date_str = target_date_arg(request)
+
+    nat_data_dict = nat_request(date_str, NAT_PROJECTS)
+
+    list_price_dict, final_price_dict = get_unit_price_dicts()
+    sku_nat_dict = get_catalog().sku_dict('nat')
+
+    # rows go straight from memory into the day's partition, which is replaced in one load job
+    sink = sink or BigQueryPartitionSink()
+    sink.replace_partition(
+        NAT_TABLE_ID,
+        date_str,
+        nat_billing_rows(nat_data_dict, final_price_dict, sku_nat_dict)
+    )
+    return 'OK'
+
+
+def load_nat_days(start_date: str, end_date: str, sink: PartitionSink = None, usage_dates: [str] = None) -> [str]:
+    """
+    Load the NAT report of the days from start_date to end_date (both included),
+    with one Monitoring request per project and metric and one load of all the days.
+
+    :param usage_dates: (list) days of the range to load, default is all of them.
+    :return: usage dates loaded, days without any NAT traffic are left out.
+    """
+    nat_data_by_date = nat_request_range(start_date, end_date, NAT_PROJECTS)
+    if usage_dates is not None:
+        nat_data_by_date = {usage_date: nat_data_dict for usage_date, nat_data_dict in nat_data_by_date.items()
+                            if usage_date in usage_dates}
+
+    list_price_dict, final_price_dict = get_unit_price_dicts()
+    sku_nat_dict = get_catalog().sku_dict('nat')
+
+    sink = sink or BigQueryPartitionSink()
+    sink.replace_partitions(
+        NAT_TABLE_ID,
+        {
+            usage_date: nat_billing_rows(nat_data_dict, final_price_dict, sku_nat_dict)
+            for usage_date, nat_data_dict in nat_data_by_date.items()
+        }
+    )
+    return sorted(nat_data_by_date)
+
+
+def gce_nat_backfill(request, sink: PartitionSink = None):
+    """
+    Backfill the NAT report of every day from start_date to end_date (both included, e.g. ?start_date=2022-01-01
+    &end_date=2022-01-31), see load_nat_days.
+    """
+    start_date = request_arg(request, 'start_date')
+    end_date = request_arg(request, 'end_date', start_date)
+    if not start_date:
+        return 'start_date is required', 400
+
+    load_nat_days(start_date, end_date, sink)
+    return 'OK'
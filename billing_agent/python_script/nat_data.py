@@ -0,0 +1,41 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import argparse
+import sys
+
+from lib.partition_sink import BigQueryPartitionSink
+from lib.price import get_unit_price_dicts
+from lib.sku_catalog import get_catalog
+from lib.metrics.monitor import nat_request_range
+from main import NAT_TABLE_ID, nat_billing_rows
+
+
+def process_args(args: [str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python3 nat_data.py',
+        description='To load the NAT report of every day from start_date to end_date.')
+    parser.add_argument('start_date', type=str, help='first usage date, e.g. 2022-01-01')
+    parser.add_argument('end_date', type=str, nargs='?', help='last usage date (included), default is start_date')
+    parser.add_argument('-p', type=str, nargs='+', default=['bytedance-cloud-216403', 'bytedance-yawn-default'],
+                        help='project ids')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    # python3 nat_data.py 2022-01-01 2022-01-31
+    namespace = process_args(sys.argv[1::])
+    nat_data_by_date = nat_request_range(namespace.start_date, namespace.end_date or namespace.start_date,
+                                         namespace.p)
+
+    list_price_dict, final_price_dict = get_unit_price_dicts()
+    sku_nat_dict = get_catalog().sku_dict('nat')
+
+    BigQueryPartitionSink().replace_partitions(
+        NAT_TABLE_ID,
+        {
+            usage_date: nat_billing_rows(nat_data_dict, final_price_dict, sku_nat_dict)
+            for usage_date, nat_data_dict in nat_data_by_date.items()
+        }
+    )
@@ -0,0 +1,87 @@
+"""
+Copyright 2021 Google. This software is provided as-is, without warranty or representation for any use or purpose.
+Your use of it is subject to your agreement with Google.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from lib.report_backfill import REPORT_BACKFILL_CONCURRENCY, BackfillCheckpoint, backfill_reports, date_range
+from main import REPORTS, load_nat_days
+
+NAT_REPORT = 'nat'
+REPORT_NAMES = [report.name for report in REPORTS] + [NAT_REPORT]
+
+
+def process_args(args: [str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python3 report_backfill.py',
+        description='To rewrite the daily reports of every day from start_date to end_date.')
+    parser.add_argument('start_date', type=str, help='first usage date, e.g. 2022-01-01')
+    parser.add_argument('end_date', type=str, help='last usage date (included), e.g. 2022-03-31')
+    parser.add_argument('-r', type=str, nargs='+', choices=REPORT_NAMES, default=REPORT_NAMES,
+                        help='reports to backfill, default is all of them')
+    parser.add_argument('--concurrency', type=int, default=REPORT_BACKFILL_CONCURRENCY,
+                        help=f'number of days computed at the same time, default is {REPORT_BACKFILL_CONCURRENCY}')
+    parser.add_argument('--checkpoint', type=str, default='report_backfill_checkpoint.jsonl',
+                        help='file of the completed (report, date) pairs, a rerun resumes from it, '
+                             'default is report_backfill_checkpoint.jsonl')
+    return parser.parse_args(args)
+
+
+def print_day(result: dict) -> None:
+    print(json.dumps(result), flush=True)
+
+
+def backfill_nat(start_date: str, end_date: str, checkpoint: BackfillCheckpoint) -> dict:
+    """
+    NAT usage comes from Monitoring, its pending days are all loaded at once, see load_nat_days.
+
+    :return: result of the NAT run, in the format of backfill_reports.
+    """
+    usage_dates = [usage_date for usage_date in date_range(start_date, end_date)
+                   if not checkpoint.done(NAT_REPORT, usage_date)]
+    result = {'usage_date': None, 'reports': [NAT_REPORT], 'seconds': None,
+              'bytes_processed': None, 'slot_millis': None, 'error': None}
+    if not usage_dates:
+        return result
+
+    result['usage_date'] = f'{usage_dates[0]}..{usage_dates[-1]}'
+    started = time.monotonic()
+    try:
+        load_nat_days(usage_dates[0], usage_dates[-1], usage_dates=usage_dates)
+    except Exception as e:
+        logging.warning(f'Failed to backfill {NAT_REPORT} from {usage_dates[0]} to {usage_dates[-1]}: {e}')
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+    result['seconds'] = round(time.monotonic() - started, 3)
+    # days without NAT traffic have nothing to load, they are done too
+    for usage_date in usage_dates:
+        checkpoint.record([NAT_REPORT], usage_date, {'seconds': result['seconds']})
+    return result
+
+
+if __name__ == '__main__':
+    # python3 report_backfill.py 2022-01-01 2022-03-31 --concurrency 8
+    # python3 report_backfill.py 2022-01-01 2022-01-31 -r compute_engine storage
+    logging.basicConfig(level=logging.INFO)
+    namespace = process_args(sys.argv[1::])
+    checkpoint = BackfillCheckpoint(namespace.checkpoint)
+
+    started = time.monotonic()
+    reports = [report for report in REPORTS if report.name in namespace.r]
+    results = backfill_reports(reports, namespace.start_date, namespace.end_date, namespace.concurrency,
+                               checkpoint, on_day=print_day) if reports else []
+    if NAT_REPORT in namespace.r:
+        nat_result = backfill_nat(namespace.start_date, namespace.end_date, checkpoint)
+        if nat_result['usage_date']:
+            print_day(nat_result)
+            results.append(nat_result)
+
+    failed = [result for result in results if result['error']]
+    logging.info(f'{len(results) - len(failed)} runs done, {len(failed)} failed, '
+                 f'{sum(result["bytes_processed"] or 0 for result in results)} bytes processed '
+                 f'in {round(time.monotonic() - started, 3)} seconds.')
+    sys.exit(1 if failed else 0)
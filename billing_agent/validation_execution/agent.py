@@ -6,7 +6,7 @@ from google.adk.events import Event, EventActions
 from google.adk.agents import LlmAgent,  SequentialAgent, LoopAgent, BaseAgent
 from google.adk.agents.invocation_context import InvocationContext
 
-from billing_agent.validation_execution.tools import bigquery_validation
+from billing_agent.validation_execution.tools import bigquery_validation_async, dry_run_validation_async
 
 
 # Custom agent to check the status and escalate if 'pass'
@@ -28,6 +28,7 @@ You are a BigQuery SQL expert. Your task is to correct the input Bigquery SQL qu
  - Read state['VALIDATION_ERROR'] and state['MODIFIED_SQL']
  - Refine {MODIFIED_SQL} according to the {VALIDATION_ERROR}
  - Output the modified SQL statement without any explanations or markdown formatting
+ - If {VALIDATION_ERROR} says the query would process too many bytes, keep the query's meaning and add a partition filter: a time range on usage_start_time or invoice.month with constant dates or months if it has none, otherwise a filter on _PARTITIONTIME on every billing table it reads
  - If state['VALIDATION_ERROR'] is empty or does not exist, then just output {MODIFIED_SQL} as it is
 """,
     output_key='MODIFIED_SQL'
@@ -40,7 +41,8 @@ You are a BigQuery SQL expert. Your task is to correct the input Bigquery SQL qu
 class CheckStatusAndEscalate(BaseAgent):
     async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
         logging.debug("Entering CheckStatusAndEscalate")
-        bigquery_validation(ctx)
+        # A dry run per iteration, the query itself is executed once by QueryExecutor after the loop.
+        await dry_run_validation_async(ctx)
         should_stop = ctx.session.state.get("VALIDATION_EXIT", False)
         logging.debug(
             f"CheckStatusAndEscalate: VALIDATION_EXIT = {should_stop}")
@@ -63,6 +65,20 @@ class CheckStatusAndEscalate(BaseAgent):
             )
 
 
+# Custom agent to execute the SQL the refinement loop converged to
+class QueryExecutor(BaseAgent):
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        logging.debug("Entering QueryExecutor")
+        if ctx.session.state.get("VALIDATION_EXIT", False):
+            await bigquery_validation_async(ctx)
+        else:
+            logging.debug("SQL never passed the dry run - skipping the execution")
+        yield Event(
+            author=self.name,
+            actions=EventActions(state_delta=ctx.session.state)
+        )
+
+
 # BigQuery SQL Validator Loop Agent
 refine_loop_agent = LoopAgent(
     name="RefinementLoop",
@@ -79,7 +95,8 @@ refine_agent = SequentialAgent(
     name='refine_agent_pipeline',
     description="Executes a pre-defined refine pipeline. It performs sql validation, refine, and execution.",
     sub_agents=[
-        refine_loop_agent
+        refine_loop_agent,
+        QueryExecutor(name="query_executor"),
     ]
 )
 # root_agent = LlmAgent(
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+
+# Directory of the on-disk tier, shared by the workers of the host, unset to keep the results in memory only.
+# It must be private to the user of the service, the results are billing data and are served as they are read.
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')
+# Size bounds of the in-memory tier and of the on-disk tier, least recently used results are evicted first.
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+# Minimum interval between two metadata probes of the `modified` timestamp of a table.
+RESULT_CACHE_PROBE_SECONDS = int(os.getenv('RESULT_CACHE_PROBE_SECONDS', 60))
+
+# Functions whose result changes from one run to the next, like BigQuery, queries calling them are not cached.
+NON_DETERMINISTIC_FUNCTIONS = (exp.CurrentDate, exp.CurrentDatetime, exp.CurrentTime, exp.CurrentTimestamp,
+                               exp.CurrentUser, exp.SessionUser, exp.Rand, exp.Uuid)
+
+
+def _canonical_aliases(expression: exp.Expression) -> None:
+    """
+    Rename the range variables of the query (table, subquery and UNNEST aliases) in their order of appearance,
+    when the name is only used to qualify columns.
+    """
+    definitions = {}
+    for alias in expression.find_all(exp.TableAlias, bfs=False):
+        if not isinstance(alias.parent, (exp.Table, exp.Subquery, exp.Unnest)):
+            continue
+        identifier = alias.columns[0] if isinstance(alias.parent, exp.Unnest) and alias.columns else alias.this
+        if isinstance(identifier, exp.Identifier):
+            definitions.setdefault(identifier.name, []).append(identifier)
+
+    qualifiers = {}
+    for column in expression.find_all(exp.Column):
+        parts = column.parts
+        if len(parts) > 1:
+            qualifiers.setdefault(parts[0].name, []).append(parts[0])
+
+    renamed = 0
+    for name, identifiers in definitions.items():
+        allowed = {id(identifier) for identifier in identifiers + qualifiers.get(name, [])}
+        if any(identifier.name == name and id(identifier) not in allowed
+               for identifier in expression.find_all(exp.Identifier)):
+            continue
+        renamed += 1
+        for identifier in identifiers + qualifiers.get(name, []):
+            identifier.set('this', f'__alias_{renamed}')
+            identifier.set('quoted', False)
+
+
+def canonical_sql(sql: str):
+    """
+    Canonical form of a query: whitespace, comments, quoting and the case of the names are normalized, and the
+    range variables renamed. The output column names, and literals, are kept as they are.
+
+    Args:
+        sql: The query, in the BigQuery dialect.
+
+    Returns:
+        tuple: The canonical SQL and the IDs of the tables it reads, as written,
+            or None if the query cannot be cached, e.g. it is not a single SELECT or calls CURRENT_DATE().
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read='bigquery') if statement is not None]
+    except SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return None
+    expression = statements[0]
+    if any(True for _ in expression.find_all(*NON_DETERMINISTIC_FUNCTIONS)):
+        return None
+
+    # Output column names keep the case they are written with.
+    output_names = []
+    for select in list(expression.find_all(exp.Select)):
+        for projection in list(select.expressions):
+            if isinstance(projection, exp.Column) and not isinstance(projection.this, exp.Star):
+                projection = projection.replace(exp.alias_(projection.copy(), projection.name))
+            if isinstance(projection, exp.Alias):
+                projection.args['alias'].set('quoted', True)
+                output_names.append((projection.args['alias'], projection.alias))
+    expression = normalize_identifiers(expression, dialect='bigquery')
+    for identifier, name in output_names:
+        identifier.set('this', name)
+    _canonical_aliases(expression)
+
+    ctes = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    tables = sorted({'.'.join(part.name for part in table.parts) for table in expression.find_all(exp.Table)
+                     if table.args.get('db') or table.name not in ctes})
+    return expression.sql(dialect='bigquery', comments=False, normalize_functions='upper'), tables
+
+
+class QueryResultCache:
+    """
+    Query results keyed by the canonical SQL and the `modified` timestamp of every table it reads,
+    a write to any of the tables makes the results of its queries unreachable.
+
+    Results are kept in memory, least recently used first out, and on disk for the other workers.
+    Queries reading views, tables with a streaming buffer or tables that cannot be probed are not cached.
+    """
+
+    def __init__(self, client_factory, cache_dir: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 disk_max_bytes: int = RESULT_CACHE_DISK_MAX_BYTES, probe_seconds: int = RESULT_CACHE_PROBE_SECONDS):
+        """
+        Args:
+            client_factory: Callable returning a bigquery.Client.
+            cache_dir: Directory of the on-disk tier, None to keep the results in memory only.
+            max_bytes: Size bound of the in-memory tier, in bytes of JSON.
+            disk_max_bytes: Size bound of the on-disk tier.
+            probe_seconds: Minimum interval between two probes of a table.
+        """
+        self.client_factory = client_factory
+        self.cache_dir = cache_dir if cache_dir and self._private_dir(cache_dir) else None
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.probe_seconds = probe_seconds
+        # key --> (size, entry), in least recently used order
+        self.entries = OrderedDict()
+        self.size = 0
+        # table ID --> (modified isoformat, None if the table cannot be cached, probed_at epoch seconds)
+        self.watermarks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _private_dir(cache_dir: str) -> bool:
+        """Create the on-disk tier directory, only readable and writable by the current user."""
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            stat = os.stat(cache_dir)
+        except OSError as e:
+            logging.warning(f"Failed to create {cache_dir}, query results are kept in memory only: {e}")
+            return False
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            logging.warning(f"{cache_dir} is not private to the current user, query results are kept in memory only")
+            return False
+        return True
+
+    def key(self, sql: str):
+        """
+        Get the cache key of a query, see canonical_sql.
+
+        Args:
+            sql: The query.
+
+        Returns:
+            str: The key, or None if the query cannot be cached.
+        """
+        canonical = canonical_sql(sql)
+        if canonical is None:
+            return None
+        canonical_query, tables = canonical
+        bigquery_client = self.client_factory()
+        watermarks = []
+        for table_id in tables:
+            if table_id.count('.') < 2:
+                table_id = f"{bigquery_client.project}.{table_id}"
+            modified = self._watermark(bigquery_client, table_id)
+            if modified is None:
+                return None
+            watermarks.append([table_id, modified])
+        payload = json.dumps([bigquery_client.project, canonical_query, watermarks])
+        return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+    def _watermark(self, bigquery_client, table_id: str):
+        with self._lock:
+            watermark = self.watermarks.get(table_id)
+        if watermark is not None and time.time() - watermark[1] < self.probe_seconds:
+            return watermark[0]
+        try:
+            table_obj = bigquery_client.get_table(table_id)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.warning(f"Failed to probe {table_id}, its queries are not cached: {e}")
+            return None
+        modified = None
+        if table_obj.table_type == 'TABLE' and table_obj.streaming_buffer is None and table_obj.modified:
+            modified = table_obj.modified.isoformat()
+        with self._lock:
+            self.watermarks[table_id] = (modified, time.time())
+        return modified
+
+    def get(self, key: str):
+        """
+        Get a cached result.
+
+        Args:
+            key: The cache key of the query.
+
+        Returns:
+            dict: The result, as it was put, or None.
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._put_memory(key, entry)
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        """
+        Cache a result.
+
+        Args:
+            key: The cache key of the query.
+            entry: The result, JSON serializable.
+        """
+        self._put_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def _put_memory(self, key: str, entry: dict) -> None:
+        size = len(json.dumps(entry))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[0]
+            self.entries[key] = (size, entry)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][0]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"result_{key}.json")
+
+    def _read_disk(self, key: str):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), 'r') as cache_file:
+                entry = json.load(cache_file)
+            # The access time of the file drives the eviction of the on-disk tier.
+            os.utime(self._path(key))
+            return entry
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to read cached result {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, entry: dict) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            logging.warning(f"Failed to write cached result {key}: {e}")
+
+    def _evict_disk(self) -> None:
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('result_') and name.endswith('.json'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue  # evicted by another worker
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
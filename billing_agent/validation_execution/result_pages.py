@@ -0,0 +1,110 @@
+import os
+import time
+
+from google.cloud import bigquery
+from google.cloud import bigquery_storage
+
+# Rows of a result page, the first page is the one returned with the query results.
+RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', 100))
+# Age after which a result handle is not read any more, BigQuery keeps the destination table of a query about a day.
+RESULT_HANDLE_TTL_SECONDS = int(os.getenv('RESULT_HANDLE_TTL_SECONDS', 23 * 3600))
+
+read_client = None
+
+
+def get_read_client() -> bigquery_storage.BigQueryReadClient:
+    """Get or create the BigQuery Storage Read API client."""
+    global read_client
+
+    if read_client is None:
+        read_client = bigquery_storage.BigQueryReadClient()
+    return read_client
+
+
+def first_page(query_job: bigquery.QueryJob, page_size: int = RESULT_PAGE_SIZE):
+    """
+    Wait for a query and read the first page of its result, as Arrow.
+
+    The first page comes with the query results call, the following ones are read on demand from the destination
+    table of the query, see read_page.
+
+    Args:
+        query_job: The query job.
+        page_size: Rows of a page.
+
+    Returns:
+        tuple: The result handle, to be kept in the session state, and the first page as a pyarrow.Table,
+            both None if the query returned no data, e.g. a DML statement.
+    """
+    results = query_job.result(max_results=page_size)
+    if not results.schema:
+        return None, None
+    page = results.to_arrow(create_bqstorage_client=False)
+    destination = query_job.destination
+    handle = {
+        'job_id': query_job.job_id,
+        'project': query_job.project,
+        'table': (f"projects/{destination.project}/datasets/{destination.dataset_id}/tables/{destination.table_id}"
+                  if destination is not None else None),
+        'total_rows': results.total_rows,
+        'page_size': page_size,
+        'created_at': time.time(),
+    }
+    return handle, page
+
+
+def handle_expired(handle: dict, ttl_seconds: int = RESULT_HANDLE_TTL_SECONDS) -> bool:
+    """
+    Whether the destination table of a result handle may be gone, see RESULT_HANDLE_TTL_SECONDS.
+
+    Args:
+        handle: The result handle, see first_page, None if the query returned no data.
+        ttl_seconds: Age after which the handle is expired.
+
+    Returns:
+        bool: True if the pages of the handle may not be readable any more.
+    """
+    if not handle or handle['table'] is None:
+        return False
+    return time.time() - handle.get('created_at', 0) >= ttl_seconds
+
+
+def read_page(handle: dict, page: int, client: bigquery_storage.BigQueryReadClient = None) -> list:
+    """
+    Read a page of a query result from its destination table, with the Storage Read API.
+
+    The destination table of a query is kept by BigQuery for about a day, the page cannot be read past that.
+
+    Args:
+        handle: The result handle, see first_page.
+        page: The page number, from 0.
+        client: The Storage Read API client.
+
+    Returns:
+        list: The rows of the page, as dictionaries.
+    """
+    if page < 0:
+        raise ValueError(f"Invalid page {page}.")
+    offset = page * handle['page_size']
+    if handle['table'] is None or offset >= handle['total_rows']:
+        return []
+
+    client = client or get_read_client()
+    session = client.create_read_session(
+        parent=f"projects/{handle['project']}",
+        read_session=bigquery_storage.types.ReadSession(
+            table=handle['table'], data_format=bigquery_storage.types.DataFormat.ARROW),
+        # A single stream keeps the rows in the order of the result, and lets the read start at the page offset.
+        max_stream_count=1,
+    )
+    if not session.streams:
+        return []
+
+    rows = []
+    reader = client.read_rows(session.streams[0].name, offset=offset)
+    for batch_page in reader.rows(session).pages:
+        batch = batch_page.to_arrow()
+        rows.extend(batch.slice(0, handle['page_size'] - len(rows)).to_pylist())
+        if len(rows) >= handle['page_size']:
+            break
+    return rows
@@ -0,0 +1,366 @@
+import logging
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# Pseudo columns of partitioned and wildcard tables, they are not part of the table schema.
+PSEUDO_COLUMNS = {'_partitiontime', '_partitiondate', '_table_suffix'}
+# Aggregate functions sqlglot does not know, and parses as anonymous functions.
+ANONYMOUS_AGGREGATES = {'APPROX_TOP_COUNT', 'APPROX_TOP_SUM', 'ARRAY_CONCAT_AGG', 'BIT_AND', 'BIT_OR', 'BIT_XOR',
+                        'CORR', 'COVAR_POP', 'COVAR_SAMP', 'GROUPING', 'HLL_COUNT.INIT', 'HLL_COUNT.MERGE',
+                        'HLL_COUNT.MERGE_PARTIAL', 'ST_CENTROID_AGG', 'ST_UNION_AGG'}
+# Legacy SQL type names of the table schemas, as standard SQL prints them.
+STANDARD_TYPES = {'INTEGER': 'INT64', 'FLOAT': 'FLOAT64', 'BOOLEAN': 'BOOL', 'RECORD': 'STRUCT'}
+
+
+class _CheckError(Exception):
+    def __init__(self, message: str, node: exp.Expression):
+        super().__init__(message)
+        self.message = message
+        self.node = node
+
+
+def _is_struct(value: dict) -> bool:
+    return value.get('type') in ('RECORD', 'STRUCT')
+
+
+def _field(value: dict, name: str):
+    for field in value.get('fields') or []:
+        if field['name'].lower() == name.lower():
+            return field
+    return None
+
+
+def _element(value: dict) -> dict:
+    return dict(value, mode='NULLABLE')
+
+
+def _render_type(value: dict) -> str:
+    if _is_struct(value):
+        rendered = 'STRUCT<' + ', '.join(
+            f"{field['name']} {_render_type(field)}" for field in value.get('fields') or []) + '>'
+    else:
+        rendered = STANDARD_TYPES.get(value.get('type'), value.get('type'))
+    if value.get('mode') == 'REPEATED':
+        rendered = f'ARRAY<{rendered}>'
+    return rendered
+
+
+def _record(fields, name: str = None):
+    """The value of a row of the given fields, None when the fields are not known."""
+    if fields is None:
+        return None
+    return {'name': name, 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': fields}
+
+
+def _is_aggregate(node: exp.Expression) -> bool:
+    return isinstance(node, exp.AggFunc) or (
+        isinstance(node, exp.Anonymous) and node.name.upper() in ANONYMOUS_AGGREGATES)
+
+
+def _walk(node: exp.Expression, skip=()):
+    """
+    Yield the nodes of an expression, without descending into nested queries (yielded) or into skip types.
+    """
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        if isinstance(current, tuple(skip)) or (current is not node and isinstance(current, (exp.Query, exp.Star))):
+            continue
+        stack.extend(reversed(list(current.iter_expressions())))
+
+
+class _SqlChecker:
+    """
+    Resolve the column references of a query against the schema of its tables, one SELECT at a time.
+
+    A SELECT sees its FROM items (tables, CTEs, subqueries and UNNEST aliases) first, then the ones of the
+    enclosing queries. Anything whose schema cannot be known, e.g. a table outside table_fields, matches any name:
+    the checker only reports what BigQuery would certainly reject.
+    """
+
+    def __init__(self, sql: str, table_fields: dict):
+        self.sql = sql
+        self.table_fields = {table_id.replace(':', '.').lower(): fields
+                             for table_id, fields in table_fields.items()}
+        self.errors = []
+
+    def error(self, message: str, node: exp.Expression) -> None:
+        self.errors.append({'reason': 'invalidQuery', 'location': 'query',
+                            'message': f'{message} at [{self._position(node)}]'})
+
+    def _position(self, node: exp.Expression) -> str:
+        starts = [identifier.meta['start'] for identifier in node.find_all(exp.Identifier)
+                  if identifier.meta.get('start') is not None]
+        if not starts:
+            return '1:1'
+        start = min(starts)
+        line = self.sql.count('\n', 0, start) + 1
+        return f"{line}:{start - self.sql.rfind(chr(10), 0, start)}"
+
+    def lookup_table(self, table: exp.Table):
+        table_id = '.'.join(part.name for part in table.parts).lower()
+        if table_id in self.table_fields:
+            return self.table_fields[table_id]
+        for known_id, fields in self.table_fields.items():
+            if known_id.endswith('.' + table_id):
+                return fields
+        return None
+
+    def check_query(self, query: exp.Expression, outer_scopes: list, ctes: dict):
+        """
+        Returns:
+            The row value of the query output, None when it is not known.
+        """
+        while isinstance(query, exp.Subquery):
+            query = query.this
+        if isinstance(query, exp.SetOperation):
+            ctes = self.check_ctes(query, outer_scopes, ctes)
+            output = self.check_query(query.this, outer_scopes, ctes)
+            self.check_query(query.expression, outer_scopes, ctes)
+            return output
+        if isinstance(query, exp.Select):
+            return self.check_select(query, outer_scopes, ctes)
+        return None
+
+    def check_ctes(self, query: exp.Expression, outer_scopes: list, ctes: dict) -> dict:
+        with_ = query.args.get('with_')
+        if with_ is None:
+            return ctes
+        ctes = dict(ctes)
+        for cte in with_.expressions:
+            ctes[cte.alias_or_name.lower()] = self.check_query(cte.this, outer_scopes, ctes)
+        return ctes
+
+    def check_select(self, select: exp.Select, outer_scopes: list, ctes: dict):
+        ctes = self.check_ctes(select, outer_scopes, ctes)
+        # range variable (lower case) --> its value
+        sources = {}
+        using = set()
+        from_ = select.args.get('from_')
+        items = ([from_.this] if from_ is not None else []) + [join.this for join in select.args.get('joins') or []]
+        for join in select.args.get('joins') or []:
+            using.update(identifier.name.lower() for identifier in join.args.get('using') or [])
+        for item in items:
+            self.add_source(item, sources, outer_scopes, ctes)
+
+        scopes = [sources] + outer_scopes
+        aliases = {projection.alias.lower() for projection in select.expressions if projection.alias}
+        values = {}
+        for arg_key in ('expressions', 'where', 'group', 'having', 'qualify', 'order', 'windows', 'joins'):
+            args = select.args.get(arg_key)
+            for arg in (args if isinstance(args, list) else [args] if args is not None else []):
+                if arg_key == 'joins':
+                    arg = arg.args.get('on')
+                    if arg is None:
+                        continue
+                for node in _walk(arg):
+                    if isinstance(node, exp.Query) or isinstance(node, exp.Subquery):
+                        self.check_query(node, scopes, ctes)
+                    elif isinstance(node, exp.Column) and not isinstance(node.this, exp.Star):
+                        parts = [part.name for part in node.parts]
+                        if (arg_key in ('group', 'having', 'qualify', 'order') and len(parts) == 1
+                                and parts[0].lower() in aliases):
+                            continue
+                        try:
+                            values[id(node)] = self.resolve(parts, scopes, using, node)
+                        except _CheckError as e:
+                            self.error(e.message, e.node)
+
+        self.check_grouping(select, sources)
+        return self.output(select, sources, values)
+
+    def add_source(self, item: exp.Expression, sources: dict, outer_scopes: list, ctes: dict) -> None:
+        if isinstance(item, exp.Table):
+            name = item.alias_or_name.lower()
+            if not item.args.get('db') and item.name.lower() in ctes:
+                sources[name] = ctes[item.name.lower()]
+            else:
+                sources[name] = _record(self.lookup_table(item), name)
+        elif isinstance(item, exp.Subquery):
+            sources[item.alias_or_name.lower()] = self.check_query(item, outer_scopes, ctes)
+        elif isinstance(item, exp.Unnest):
+            value = None
+            array = item.expressions[0] if item.expressions else None
+            if isinstance(array, exp.Column):
+                try:
+                    value = self.resolve([part.name for part in array.parts], [sources] + outer_scopes, set(), array)
+                except _CheckError as e:
+                    self.error(e.message, e.node)
+                if value is not None and value.get('mode') != 'REPEATED':
+                    self.error('Values referenced in UNNEST must be arrays. '
+                               f'UNNEST contains expression of type {_render_type(value)}', array)
+                    value = None
+            alias = item.args.get('alias')
+            if alias is not None and alias.columns:
+                name = alias.columns[0].name
+            elif alias is not None and alias.name:
+                name = alias.name
+            elif isinstance(array, exp.Column):
+                # UNNEST of a path is implicitly aliased with its last name, e.g. UNNEST(credits) AS credits
+                name = array.name
+            else:
+                return
+            sources[name.lower()] = _element(value) if value is not None else None
+        elif item.alias_or_name:
+            sources[item.alias_or_name.lower()] = None
+
+    def resolve(self, parts: list, scopes: list, using: set, node: exp.Column):
+        """
+        Returns:
+            The value the column path refers to, None when it is not known.
+        """
+        head = parts[0].lower()
+        for sources in scopes:
+            if head in sources:
+                if len(parts) == 2 and parts[1].lower() in PSEUDO_COLUMNS:
+                    return None  # e.g. t._PARTITIONTIME
+                return self.access(sources[head], parts[1:], node)
+            found, unknown = [], False
+            for value in sources.values():
+                if value is None:
+                    unknown = True
+                elif _is_struct(value) and value.get('mode') != 'REPEATED' and _field(value, head) is not None:
+                    found.append(_field(value, head))
+            if len(found) > 1 and head not in using:
+                raise _CheckError(f'Column name {parts[0]} is ambiguous', node)
+            if found:
+                return self.access(found[0], parts[1:], node)
+            if unknown:
+                return None
+        if head in PSEUDO_COLUMNS:
+            return None
+        raise _CheckError(f'Unrecognized name: {parts[0]}', node)
+
+    def access(self, value, names: list, node: exp.Column):
+        for name in names:
+            if value is None or value.get('type') is None:
+                return None
+            if value.get('mode') == 'REPEATED' or not _is_struct(value):
+                raise _CheckError(f'Cannot access field {name} on a value with type {_render_type(value)}', node)
+            field = _field(value, name)
+            if field is None:
+                raise _CheckError(f'Field name {name} does not exist in {_render_type(value)}', node)
+            value = field
+        return value
+
+    def check_grouping(self, select: exp.Select, sources: dict) -> None:
+        group = select.args.get('group')
+        if group is not None and group.args.get('all'):
+            return
+        aggregated = group is not None or any(
+            _is_aggregate(node)
+            for projection in select.expressions for node in _walk(projection, skip=(exp.Window,)))
+        if not aggregated:
+            return
+
+        grouped_keys, grouped_projections = set(), set()
+        group_exprs = []
+        if group is not None:
+            for expression in group.expressions + [
+                    e for key in ('rollup', 'cube', 'grouping_sets') for e in (group.args.get(key) or [])]:
+                if isinstance(expression, (exp.Rollup, exp.Cube, exp.GroupingSets)):
+                    group_exprs.extend(expression.expressions)
+                else:
+                    group_exprs.append(expression)
+        for expression in group_exprs:
+            if isinstance(expression, exp.Literal) and expression.is_int:
+                grouped_projections.add(int(expression.name) - 1)
+                continue
+            if isinstance(expression, exp.Column) and len(expression.parts) == 1:
+                for i, projection in enumerate(select.expressions):
+                    if projection.alias and projection.alias.lower() == expression.name.lower():
+                        grouped_projections.add(i)
+            grouped_keys.add(self.group_key(expression, sources))
+
+        for i, projection in enumerate(select.expressions):
+            if i in grouped_projections:
+                continue
+            for column in self.ungrouped_columns(projection.unalias(), grouped_keys, sources):
+                self.error(f'SELECT list expression references column {column.sql("bigquery")} '
+                           'which is neither grouped nor aggregated', column)
+        if select.args.get('having') is not None:
+            aliases = {projection.alias.lower() for projection in select.expressions if projection.alias}
+            for column in self.ungrouped_columns(select.args['having'].this, grouped_keys, sources):
+                if len(column.parts) > 1 or column.name.lower() not in aliases:
+                    self.error(f'HAVING clause expression references column {column.sql("bigquery")} '
+                               'which is neither grouped nor aggregated', column)
+
+    def group_key(self, expression: exp.Expression, sources: dict) -> str:
+        """The expression in lower case, with its columns stripped of their range variable."""
+        expression = expression.copy()
+        for column in list(expression.find_all(exp.Column)):
+            parts = [part.name for part in column.parts]
+            if len(parts) > 1 and parts[0].lower() in sources:
+                parts = parts[1:]
+            replacement = exp.Column(this=exp.to_identifier('.'.join(parts).lower()))
+            if column is expression:
+                expression = replacement
+            else:
+                column.replace(replacement)
+        return expression.sql('bigquery').lower()
+
+    def ungrouped_columns(self, expression: exp.Expression, grouped_keys: set, sources: dict):
+        stack = [expression]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (exp.Query, exp.Subquery, exp.Window, exp.Star, exp.Literal)) or _is_aggregate(node):
+                continue
+            if self.group_key(node, sources) in grouped_keys:
+                continue
+            if isinstance(node, exp.Column):
+                if not isinstance(node.this, exp.Star) and node.name.lower() not in PSEUDO_COLUMNS:
+                    yield node
+                continue
+            stack.extend(node.iter_expressions())
+
+    def output(self, select: exp.Select, sources: dict, values: dict):
+        fields = []
+        for projection in select.expressions:
+            expression = projection.unalias()
+            if isinstance(expression, exp.Star) or (
+                    isinstance(expression, exp.Column) and isinstance(expression.this, exp.Star)):
+                if isinstance(expression, exp.Star):
+                    expanded = list(sources.values())
+                else:
+                    expanded = [sources.get(expression.table.lower())]
+                excepted = {column.name.lower() for column in expression.args.get('except_') or []} \
+                    if isinstance(expression, exp.Star) else set()
+                for value in expanded:
+                    if value is None or not _is_struct(value) or value.get('mode') == 'REPEATED':
+                        return None
+                    fields.extend(field for field in value['fields'] if field['name'].lower() not in excepted)
+                continue
+            name = projection.alias_or_name
+            value = values.get(id(expression)) if isinstance(expression, exp.Column) else None
+            fields.append(dict(value, name=name) if value is not None else {'name': name, 'type': None})
+        return _record(fields)
+
+
+def check_sql(sql: str, table_fields: dict) -> list:
+    """
+    Check a query offline: the columns it references, including nested fields and UNNEST aliases, must exist
+    in the schema of its tables, and the non aggregated columns of an aggregation must be grouped.
+
+    Args:
+        sql: The query, in the BigQuery dialect.
+        table_fields: Table ID --> schema fields of the table, in their API representation.
+
+    Returns:
+        list: The errors, in the form and the wording of BigQuery job errors, e.g.
+            {'reason': 'invalidQuery', 'location': 'query', 'message': 'Unrecognized name: foo at [3:5]'}.
+            SQL that sqlglot cannot parse is left to BigQuery, no error is reported for it.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read='bigquery') if statement is not None]
+    except SqlglotError as e:
+        logging.debug(f"Leaving the SQL sqlglot cannot parse to BigQuery: {e}")
+        return []
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return []
+
+    checker = _SqlChecker(sql, table_fields)
+    checker.check_query(statements[0], [], {})
+    return checker.errors
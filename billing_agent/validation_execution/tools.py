@@ -1,49 +1,101 @@
+import asyncio
 import datetime
 import logging
+import os
 import re
 from google.adk.agents.invocation_context import InvocationContext
 from google.cloud import bigquery
-from billing_agent.nl2sql.nl2sql_tools import get_bq_client
+from billing_agent.nl2sql.nl2sql_tools import add_billing_partition_filters, get_bq_client, get_schema_context_cache
+from billing_agent.validation_execution.result_cache import QueryResultCache
+from billing_agent.validation_execution.result_pages import first_page, handle_expired
+from billing_agent.validation_execution.sql_checker import check_sql
 from datetime import date, datetime
 from decimal import Decimal
 import json
 
+# Backoff of the job status polls of bigquery_validation_async, in seconds.
+QUERY_POLL_INITIAL_SECONDS = 0.25
+QUERY_POLL_MAX_SECONDS = 2.0
+# Budget of the bytes a query may scan, in bytes, 0 for no budget. Queries estimated over it go back to the refiner,
+# and BigQuery fails the executed job past it, see maximum_bytes_billed.
+QUERY_MAX_BYTES_BILLED = int(os.getenv('QUERY_MAX_BYTES_BILLED', 200 * 1024 ** 3))
+result_cache = None
 
-def bigquery_validation(context: InvocationContext):
-    """Validates the SQL using BigQuery and returns the results.
-    Args:
-        tool_context: The context for the tool execution.
 
-    Returns:
-        A dictionary containing the query result, status and an error message. 
-    """
-    logging.debug("Entering bigquery_validation")
+def get_result_cache() -> QueryResultCache:
+    """Get or create the query result cache shared by all sessions."""
+    global result_cache
+
+    if result_cache is None:
+        result_cache = QueryResultCache(get_bq_client)
+    return result_cache
+
+
+def json_serial(obj):
+    """JSON serializer for objects not serializable by default json code"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Type {type(obj)} not serializable")
 
-    def json_serial(obj):
-        """JSON serializer for objects not serializable by default json code"""
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        if isinstance(obj, Decimal):
-            return str(obj)
-        raise TypeError(f"Type {type(obj)} not serializable")
 
-    def cleanup_sql(sql_string):
-        """Processes the SQL string to get a printable, valid SQL string."""
+def cleanup_sql(sql_string):
+    """Processes the SQL string to get a printable, valid SQL string."""
 
-        # 1. Remove backslashes escaping double quotes
-        sql_string = sql_string.replace('\"', '"')
+    # 1. Remove backslashes escaping double quotes
+    sql_string = sql_string.replace('\"', '"')
 
-        # 2. Remove backslashes before newlines (the key fix for this issue)
-        sql_string = sql_string.replace("\\n", "\n")  # Corrected regex
+    # 2. Remove backslashes before newlines (the key fix for this issue)
+    sql_string = sql_string.replace("\\n", "\n")  # Corrected regex
 
-        # 3. Replace escaped single quotes
-        sql_string = sql_string.replace("\'", "'")
+    # 3. Replace escaped single quotes
+    sql_string = sql_string.replace("\'", "'")
 
-        # 4. Replace escaped newlines (those not preceded by a backslash)
-        sql_string = sql_string.replace("\n", "\n")
+    # 4. Replace escaped newlines (those not preceded by a backslash)
+    sql_string = sql_string.replace("\n", "\n")
+
+    return sql_string
+
+
+def format_bytes(num_bytes) -> str:
+    """Formats a number of bytes for humans, e.g. 1.5 GiB."""
+    if num_bytes is None:
+        return "unknown"
+    value = float(num_bytes)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if value < 1024 or unit == 'TiB':
+            return f"{value:.0f} {unit}" if unit == 'B' else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def bytes_budget_error(estimated_bytes, max_bytes_billed: int = QUERY_MAX_BYTES_BILLED):
+    """Checks the bytes estimated by a dry run against the budget.
+    Args:
+        estimated_bytes: The bytes the query would process.
+        max_bytes_billed: The budget, 0 for no budget.
+
+    Returns:
+        The error to send back to the refiner, with a hint on how to scan less, or None within the budget.
+    """
+    if not max_bytes_billed or estimated_bytes is None or int(estimated_bytes) <= max_bytes_billed:
+        return None
+    return (f"Query would process {format_bytes(estimated_bytes)}, over the budget of "
+            f"{format_bytes(max_bytes_billed)}. Add a partition filter: restrict the query to the time range of "
+            f"the question with constant predicates, e.g. invoice.month = '202506', which are turned into "
+            f"_PARTITIONTIME filters, or filter every billing table on _PARTITIONTIME directly, e.g. "
+            f"TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) BETWEEN '2025-05-01' AND '2025-07-31', "
+            f"and select only the columns needed.")
 
-        return sql_string
 
+def prepare_validation_sql(context: InvocationContext) -> str:
+    """Picks the SQL to validate from the session state and cleans it up.
+    Args:
+        context: The invocation context.
+
+    Returns:
+        The SQL string to run, with the partition filters derived from its time range.
+    """
     if not context.session.state.get('MODIFIED_SQL'):
         sql_string = context.session.state.get('FINAL_RAW_SQL')
         context.session.state.update({'MODIFIED_SQL': sql_string})
@@ -53,77 +105,368 @@ def bigquery_validation(context: InvocationContext):
 
     sql_string = cleanup_sql(sql_string)
     sql_string = sql_string.replace("```sql", "").replace("```", "").strip()
+    # The refiner may rewrite the time range, or drop the partition filters.
+    filtered_sql = add_billing_partition_filters(sql_string)
+    if filtered_sql != sql_string:
+        sql_string = filtered_sql
+        context.session.state.update({'MODIFIED_SQL': sql_string})
     logging.debug("Validating SQL (after cleanup): %s", sql_string)
+    return sql_string
+
+
+def submit_query(context: InvocationContext, sql_string: str) -> bigquery.QueryJob:
+    """Starts the BigQuery job of the SQL and records its ID in the session state.
+    Args:
+        context: The invocation context.
+        sql_string: The SQL to run.
+
+    Returns:
+        The started query job.
+    """
+    bq_client = get_bq_client()
+    # Add labels to the job for tracking and cost analysis.
+    # In a production environment, you might want to get the user from the
+    # invocation context instead of an environment variable.
+
+    job_config = bigquery.QueryJobConfig(
+        labels={"source": "data-agent"},
+        # BigQuery fails the job, before scanning, if it would bill more than the budget.
+        maximum_bytes_billed=QUERY_MAX_BYTES_BILLED or None,
+    )
+    query_job = bq_client.query(sql_string, job_config=job_config)
+    logging.debug(f"Started BigQuery job: {query_job.job_id}")
+    # Save the job ID to the session state.
+    job_ids = context.session.state.get("JOB_IDS", [])
+    if query_job.job_id not in job_ids:
+        context.session.state.update(
+            {"JOB_IDS": job_ids + [query_job.job_id]})
+    return query_job
+
+
+def fetch_query_rows(query_job: bigquery.QueryJob):
+    """Waits for the job and reads the first page of its result, see first_page.
+    Args:
+        query_job: The query job.
+
+    Returns:
+        A tuple of the result handle, None if the query returned no data, and the rows of the first page
+        as dictionaries.
+    """
+    # This call blocks until the job is complete.
+    handle, page = first_page(query_job)
+    return handle, page.to_pylist() if page is not None else []
+
+
+def record_query_results(context: InvocationContext, handle, rows: list) -> dict:
+    """Stores the first page of the results of a successful query in the session state.
+
+    The following pages are read on demand with the result handle, kept in state['QUERY_RESULT_HANDLE'].
+    Args:
+        context: The invocation context.
+        handle: The result handle, None if the query returned no data.
+        rows: The rows of the first page.
 
+    Returns:
+        A dictionary containing the query result, status and an error message.
+    """
     final_result = {"query_result": None,
                     "query_status": None, "error_message": None}
 
-    try:
-        bq_client = get_bq_client()
-        # Add labels to the job for tracking and cost analysis.
-        # In a production environment, you might want to get the user from the
-        # invocation context instead of an environment variable.
+    if handle:  # Check if query returned data
+        # Convert rows to a JSON object
+        json_object = json.dumps(rows, default=json_serial)
+        # return f"Valid SQL. Results: {rows}"
+        context.session.state.update({'VALIDATION_EXIT': True})
+        context.session.state.update({'VALIDATION_ERROR': ""})
+        context.session.state.update({'QUERY_RESULTS': json_object})
+        context.session.state.update({'QUERY_RESULT_HANDLE': handle})
+        context.session.state.update({'QUERY_TOTAL_ROWS': handle['total_rows']})
 
-        job_config = bigquery.QueryJobConfig(
-            labels={"source": "data-agent"}
+        final_result["query_status"] = "success"
+        final_result["query_result"] = json_object
+
+    else:
+        context.session.state.update({'VALIDATION_EXIT': True})
+        context.session.state.update({'VALIDATION_ERROR': ""})
+        context.session.state.update({'QUERY_RESULTS': []})
+        context.session.state.update({'QUERY_RESULT_HANDLE': None})
+        context.session.state.update({'QUERY_TOTAL_ROWS': 0})
+
+        final_result["error_message"] = (
+            "Valid SQL. Query executed successfully (no results)."
         )
-        query_job = bq_client.query(sql_string, job_config=job_config)
-        logging.debug(f"Started BigQuery job: {query_job.job_id}")
-        # Save the job ID to the session state.
-        job_ids = context.session.state.get("JOB_IDS", [])
-        if query_job.job_id not in job_ids:
-            context.session.state.update(
-                {"JOB_IDS": job_ids + [query_job.job_id]})
-        # Get the query results, max 100 rows
-        # This call blocks until the job is complete.
-        results = query_job.result(max_results=100)
-
-        # print(results.max_results)
-
-        if results.schema:  # Check if query returned data
-            rows = [
-                {
-                    key: value
-                    for (key, value) in row.items()
-                }
-                for row in results
-            ]
-            # Convert rows to a JSON object
-            json_object = json.dumps(rows, default=json_serial)
-            # return f"Valid SQL. Results: {rows}"
-            context.session.state.update({'VALIDATION_EXIT': True})
-            context.session.state.update({'VALIDATION_ERROR': ""})
-            context.session.state.update({'QUERY_RESULTS': json_object})
-
-            final_result["query_status"] = "success"
-            final_result["query_result"] = json_object
-
-        else:
-            context.session.state.update({'VALIDATION_EXIT': True})
-            context.session.state.update({'VALIDATION_ERROR': ""})
-            context.session.state.update({'QUERY_RESULTS': []})
-
-            final_result["error_message"] = (
-                "Valid SQL. Query executed successfully (no results)."
-            )
-            final_result["query_status"] = "success"
-
-            context.session.state.update(
-                {'VALIDATION_ERROR': final_result["error_message"]})
+        final_result["query_status"] = "success"
 
-    except (
-        Exception
-    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
-        final_result["error_message"] = f"Invalid SQL: {e}"
-        final_result["query_status"] = "failed"
-        context.session.state.update({'VALIDATION_EXIT': False})
         context.session.state.update(
             {'VALIDATION_ERROR': final_result["error_message"]})
-        context.session.state.update({'QUERY_RESULTS': []})
+    return final_result
+
+
+def lookup_query_results(context: InvocationContext, sql_string: str):
+    """Looks the SQL up in the result cache, and records a hit in the session state like an execution.
+    Args:
+        context: The invocation context.
+        sql_string: The SQL to run.
+
+    Returns:
+        A tuple of the cache key, None if the SQL cannot be cached, and the result of a hit, None on a miss.
+        state['QUERY_CACHE_HIT'] tells whether the results come from the cache.
+    """
+    key, entry = None, None
+    try:
+        key = get_result_cache().key(sql_string)
+        entry = get_result_cache().get(key) if key else None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logging.warning(f"Skipping the result cache: {e}")
+    if entry is not None and ('handle' not in entry or handle_expired(entry['handle'])):
+        # Cached before the results had handles, or the destination table of the handle may be gone:
+        # the query runs again and its fresh handle replaces the entry.
+        entry = None
+    context.session.state.update({'QUERY_CACHE_HIT': entry is not None})
+    if entry is None:
+        return key, None
+    logging.debug(f"Result cache hit: {key}")
+    return key, record_query_results(context, entry['handle'], entry['rows'])
+
+
+def store_query_results(key: str, handle, rows: list) -> None:
+    """Caches the result of an execution under the key returned by lookup_query_results."""
+    if key is None:
+        return
+    try:
+        get_result_cache().put(key, {'handle': handle,
+                                     'rows': json.loads(json.dumps(rows, default=json_serial))})
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logging.warning(f"Failed to cache the result: {e}")
+
+
+def record_query_error(context: InvocationContext, e: Exception) -> dict:
+    """Stores the error of a failed query in the session state, for the refiner to fix.
+    Args:
+        context: The invocation context.
+        e: The error raised by BigQuery.
+
+    Returns:
+        A dictionary containing the query result, status and an error message.
+    """
+    final_result = {"query_result": None,
+                    "query_status": "failed", "error_message": f"Invalid SQL: {e}"}
+    context.session.state.update({'VALIDATION_EXIT': False})
+    context.session.state.update(
+        {'VALIDATION_ERROR': final_result["error_message"]})
+    context.session.state.update({'QUERY_RESULTS': []})
+    context.session.state.update({'QUERY_RESULT_HANDLE': None})
+    context.session.state.update({'QUERY_TOTAL_ROWS': None})
+    return final_result
+
+
+def offline_check(context: InvocationContext, sql_string: str) -> list:
+    """Checks the SQL locally against the cached schema of the billing tables, see check_sql.
+    Args:
+        context: The invocation context.
+        sql_string: The SQL to check.
+
+    Returns:
+        The BigQuery-like errors found, also stored in state['VALIDATION_ERRORS'].
+    """
+    table_id = (context.session.state.get('PROTOTYPE_DETAILED_BILLING_TABLE_ID')
+                or os.getenv('PROTOTYPE_DETAILED_BILLING_TABLE_ID'))
+    errors = []
+    if table_id:
+        try:
+            # The target billing tables share the schema of the prototype table.
+            fields = get_schema_context_cache().get_fields(table_id)
+            table_ids = [table_id] + list(context.session.state.get('TARGET_BILLING_TABLES') or [])
+            errors = check_sql(sql_string, {target_id.strip(): fields for target_id in table_ids})
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The dry run is still there to catch the errors.
+            logging.warning(f"Skipping the offline SQL check: {e}")
+    context.session.state.update({'VALIDATION_ERRORS': errors})
+    return errors
+
+
+def dry_run_query(sql_string: str) -> bigquery.QueryJob:
+    """Checks the SQL with a BigQuery dry run, no data is scanned.
+    Args:
+        sql_string: The SQL to check.
+
+    Returns:
+        The dry run job, raises the BigQuery error if the SQL is invalid.
+    """
+    job_config = bigquery.QueryJobConfig(
+        dry_run=True, use_query_cache=False, labels={"source": "data-agent"}
+    )
+    return get_bq_client().query(sql_string, job_config=job_config)
+
+
+def estimate_query(sql_string: str) -> dict:
+    """Estimates the bytes a query would process, with a dry run, and checks them against the budget.
+    Args:
+        sql_string: The SQL to estimate.
+
+    Returns:
+        A dictionary with the estimated bytes, the budget, whether the query is over it,
+        and the error of the dry run or of the budget check.
+    """
+    sql_string = sql_string.replace("```sql", "").replace("```", "").strip()
+    estimate = {"ESTIMATED_BYTES_PROCESSED": None, "ESTIMATED_SIZE": None,
+                "MAXIMUM_BYTES_BILLED": QUERY_MAX_BYTES_BILLED or None, "OVER_BUDGET": False, "ERROR": None}
+    try:
+        estimated_bytes = dry_run_query(sql_string).total_bytes_processed
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        estimate["ERROR"] = f"Invalid SQL: {e}"
+        return estimate
+    error = bytes_budget_error(estimated_bytes)
+    estimate.update({"ESTIMATED_BYTES_PROCESSED": estimated_bytes, "ESTIMATED_SIZE": format_bytes(estimated_bytes),
+                     "OVER_BUDGET": error is not None, "ERROR": error})
+    return estimate
+
 
+def record_dry_run(context: InvocationContext, query_job: bigquery.QueryJob) -> dict:
+    """Stores the outcome of a successful dry run in the session state.
+
+    A query estimated over the bytes budget fails the validation, its error asks the refiner for a partition filter.
+    Args:
+        context: The invocation context.
+        query_job: The dry run job.
+
+    Returns:
+        A dictionary containing the query result, status and an error message.
+    """
+    estimated_bytes = query_job.total_bytes_processed
+    error = bytes_budget_error(estimated_bytes)
+    final_result = {"query_result": None,
+                    "query_status": "success" if error is None else "failed", "error_message": error,
+                    "estimated_bytes_processed": estimated_bytes}
+    context.session.state.update({'VALIDATION_EXIT': error is None})
+    context.session.state.update({'VALIDATION_ERROR': error or ""})
+    context.session.state.update(
+        {'ESTIMATED_BYTES_PROCESSED': estimated_bytes})
+    return final_result
+
+
+def log_validation(sql_string: str, final_result: dict) -> None:
     logging.debug(f"Validation Result: {final_result}")
 
     print(f"Validating SQL (after cleanup): {sql_string}")
     print(f"Validation Result: {final_result}")
 
+
+def bigquery_validation(context: InvocationContext):
+    """Validates the SQL using BigQuery and returns the results.
+    Args:
+        tool_context: The context for the tool execution.
+
+    Returns:
+        A dictionary containing the query result, status and an error message.
+    """
+    logging.debug("Entering bigquery_validation")
+    sql_string = prepare_validation_sql(context)
+    key, final_result = lookup_query_results(context, sql_string)
+    if final_result is not None:
+        log_validation(sql_string, final_result)
+        return final_result
+
+    try:
+        query_job = submit_query(context, sql_string)
+        handle, rows = fetch_query_rows(query_job)
+        final_result = record_query_results(context, handle, rows)
+        store_query_results(key, handle, rows)
+    except (
+        Exception
+    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
+        final_result = record_query_error(context, e)
+
+    log_validation(sql_string, final_result)
+    return final_result
+
+
+def _cancel_abandoned_job(loop: asyncio.AbstractEventLoop, submission: asyncio.Future) -> None:
+    if submission.cancelled() or submission.exception() is not None:
+        return
+    query_job = submission.result()
+    logging.info(f"Cancelling abandoned BigQuery job: {query_job.job_id}")
+    # Fire and forget, the awaiting task is going away.
+    loop.run_in_executor(None, query_job.cancel)
+
+
+async def bigquery_validation_async(context: InvocationContext,
+                                    poll_initial_seconds: float = QUERY_POLL_INITIAL_SECONDS,
+                                    poll_max_seconds: float = QUERY_POLL_MAX_SECONDS):
+    """Validates the SQL using BigQuery like bigquery_validation, without blocking the event loop.
+
+    Results are served from the result cache when the same query already ran on the same table data.
+
+    Every blocking client call runs in a worker thread, and the job is polled with an exponential backoff.
+    If the awaiting task is cancelled, e.g. the request was abandoned, the BigQuery job is cancelled as well.
+    Args:
+        context: The invocation context.
+        poll_initial_seconds: The first interval between two polls of the job status.
+        poll_max_seconds: The maximum interval between two polls of the job status.
+
+    Returns:
+        A dictionary containing the query result, status and an error message.
+    """
+    logging.debug("Entering bigquery_validation_async")
+    sql_string = prepare_validation_sql(context)
+    key, final_result = await asyncio.to_thread(lookup_query_results, context, sql_string)
+    if final_result is not None:
+        log_validation(sql_string, final_result)
+        return final_result
+
+    loop = asyncio.get_running_loop()
+    # Shielded, so that a job submitted while the task is being cancelled is still known, and cancelled.
+    submission = asyncio.ensure_future(asyncio.to_thread(submit_query, context, sql_string))
+    try:
+        query_job = await asyncio.shield(submission)
+        interval = poll_initial_seconds
+        while not await asyncio.to_thread(query_job.done):
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, poll_max_seconds)
+        handle, rows = await asyncio.to_thread(fetch_query_rows, query_job)
+        final_result = record_query_results(context, handle, rows)
+        await asyncio.to_thread(store_query_results, key, handle, rows)
+    except asyncio.CancelledError:
+        submission.add_done_callback(lambda future: _cancel_abandoned_job(loop, future))
+        raise
+    except (
+        Exception
+    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
+        final_result = record_query_error(context, e)
+
+    log_validation(sql_string, final_result)
+    return final_result
+
+
+async def dry_run_validation_async(context: InvocationContext):
+    """Validates the SQL with a BigQuery dry run, without blocking the event loop.
+
+    A dry run only checks the syntax and the semantics of the SQL against the table metadata, and estimates
+    the bytes it would scan into state['ESTIMATED_BYTES_PROCESSED']. No data is read and no result is stored.
+    Unknown columns and ungrouped columns are first looked for offline, the dry run is skipped when any is found.
+    Args:
+        context: The invocation context.
+
+    Returns:
+        A dictionary containing the query result, status, an error message and the estimated bytes processed.
+    """
+    logging.debug("Entering dry_run_validation_async")
+    sql_string = prepare_validation_sql(context)
+
+    try:
+        errors = await asyncio.to_thread(offline_check, context, sql_string)
+        if errors:
+            final_result = record_query_error(context, "; ".join(error["message"] for error in errors))
+            context.session.state.update({'ESTIMATED_BYTES_PROCESSED': None})
+            log_validation(sql_string, final_result)
+            return final_result
+        query_job = await asyncio.to_thread(dry_run_query, sql_string)
+        final_result = record_dry_run(context, query_job)
+    except (
+        Exception
+    ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
+        final_result = record_query_error(context, e)
+        context.session.state.update({'ESTIMATED_BYTES_PROCESSED': None})
+
+    log_validation(sql_string, final_result)
     return final_result